@@ -22,6 +22,11 @@ from urllib.parse import unquote_plus
 import boto3
 from botocore.exceptions import ClientError
 
+from structured_logging import (
+    current_request, end_request, log_debug, log_error, log_info, log_warning, start_request,
+)
+from instrumentation import span
+
 # =============================================================================
 # 設定
 # =============================================================================
@@ -75,6 +80,7 @@ def generate_temp_password(length: int = 12) -> str:
     return "".join(password)
 
 
+@span("cognitoCreate")
 def create_cognito_user(email: str, temp_password: str) -> dict:
     """
     Cognitoにユーザーを作成（メール通知なし、FORCE_CHANGE_PASSWORD状態）
@@ -103,6 +109,7 @@ def create_cognito_user(email: str, temp_password: str) -> dict:
         raise
 
 
+@span("dynamodbCreate")
 def create_dynamodb_user(user_data: dict) -> dict:
     """
     DynamoDBにユーザープロファイルを作成
@@ -120,6 +127,7 @@ def create_dynamodb_user(user_data: dict) -> dict:
         raise
 
 
+@span("s3Folders")
 def create_s3_folders(email: str) -> dict:
     """
     S3にユーザー専用フォルダを作成
@@ -156,11 +164,12 @@ def create_s3_folders(email: str) -> dict:
         )
         results.append({"path": f"raw-gene/{email}/README.md", "status": "created"})
     except Exception as e:
-        print(f"README creation error: {e}")
+        log_warning("README creation failed", email=email, error=str(e))
 
     return {"status": "success", "folders": results}
 
 
+@span("reportSave")
 def save_results_to_s3(results: dict, credentials: list, csv_key: str):
     """
     結果をS3に保存
@@ -175,7 +184,7 @@ def save_results_to_s3(results: dict, credentials: list, csv_key: str):
         Body=json.dumps(results, ensure_ascii=False, indent=2).encode("utf-8"),
         ContentType="application/json"
     )
-    print(f"📄 Report saved: s3://{S3_BUCKET}/{report_key}")
+    log_info("report saved", location=f"s3://{S3_BUCKET}/{report_key}")
 
     # 認証情報CSV（運営用）
     if credentials:
@@ -192,7 +201,7 @@ def save_results_to_s3(results: dict, credentials: list, csv_key: str):
             Body=output.getvalue().encode("utf-8"),
             ContentType="text/csv"
         )
-        print(f"🔑 Credentials saved: s3://{S3_BUCKET}/{creds_key}")
+        log_info("credentials saved", location=f"s3://{S3_BUCKET}/{creds_key}")
 
 
 # =============================================================================
@@ -202,8 +211,25 @@ def save_results_to_s3(results: dict, credentials: list, csv_key: str):
 def lambda_handler(event, context):
     """
     S3イベントを受けてCSVを処理
+
+    ログは1回の実行につきJSON 1行（ユーザーごとの詳細はDEBUG、失敗はWARNING）。
     """
-    print(f"📥 Event received: {json.dumps(event)}")
+    start_request("bulk_register", context)
+    response = {"statusCode": 500, "body": "Internal error"}
+    try:
+        response = process_csv_event(event)
+        return response
+    except Exception as e:
+        import traceback
+        log_error("bulk registration failed", error=str(e), traceback=traceback.format_exc())
+        raise
+    finally:
+        end_request(statusCode=response["statusCode"])
+
+
+def process_csv_event(event) -> dict:
+    """S3イベントのCSVを読み込み、ユーザーを一括登録"""
+    log_debug("event received", event=lambda: json.dumps(event))
 
     # S3イベントからファイル情報を取得
     try:
@@ -211,17 +237,18 @@ def lambda_handler(event, context):
         bucket = record["s3"]["bucket"]["name"]
         key = unquote_plus(record["s3"]["object"]["key"])
     except (KeyError, IndexError) as e:
-        print(f"❌ Invalid event format: {e}")
+        log_error("invalid event format", error=str(e))
         return {"statusCode": 400, "body": "Invalid event format"}
 
-    print(f"📁 Processing: s3://{bucket}/{key}")
+    current_request().set(csvFile=f"s3://{bucket}/{key}")
 
     # CSVファイルを読み込み
     try:
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        csv_content = response["Body"].read().decode("utf-8-sig")  # BOM対応
+        with span("csvRead"):
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+            csv_content = response["Body"].read().decode("utf-8-sig")  # BOM対応
     except Exception as e:
-        print(f"❌ Failed to read CSV: {e}")
+        log_error("failed to read CSV", error=str(e))
         return {"statusCode": 500, "body": f"Failed to read CSV: {e}"}
 
     # 結果格納
@@ -252,7 +279,7 @@ def lambda_handler(event, context):
             })
             continue
 
-        print(f"👤 Processing user {results['total']}: {email}")
+        log_debug("processing user", row=results["total"], email=email)
 
         # 仮パスワード生成
         temp_password = generate_temp_password()
@@ -316,28 +343,26 @@ def lambda_handler(event, context):
                 "temp_password": temp_password,
             })
 
-            print(f"✅ User registered: {email}")
+            log_debug("user registered", row=results["total"], email=email)
 
         except Exception as e:
             results["failed"] += 1
             user_result["status"] = "failed"
             user_result["error"] = str(e)
-            print(f"❌ Failed to register {email}: {e}")
+            log_warning("failed to register user", row=results["total"], email=email, error=str(e))
 
         results["users"].append(user_result)
 
     # 結果をS3に保存
     save_results_to_s3(results, credentials, key)
 
-    # サマリー出力
-    print("=" * 60)
-    print("📊 Registration Summary")
-    print("=" * 60)
-    print(f"Total: {results['total']}")
-    print(f"Success: {results['success']}")
-    print(f"Skipped: {results['skipped']}")
-    print(f"Failed: {results['failed']}")
-    print("=" * 60)
+    # サマリー（最終行のフィールドとして出力）
+    current_request().set(
+        total=results["total"],
+        success=results["success"],
+        skipped=results["skipped"],
+        failed=results["failed"],
+    )
 
     return {
         "statusCode": 200,
@@ -0,0 +1,140 @@
+"""
+instrumentation.py - 処理フェーズごとのレイテンシ計測
+
+リクエスト内の各フェーズ（シークレット取得、PIIサニタイズ、OpenAI呼び出し等）の
+処理時間を計測し、CloudWatch Embedded Metric Format (EMF) で出力する。
+- with span("piiSanitize"): ... / @span("secretFetch") のどちらでも使える
+- 計測値は structured_logging のリクエストログに記録され、リクエスト終了時のJSON 1行に
+  EMFのメタデータ（_aws）と一緒に出力される（CloudWatchがメトリクスとして抽出）
+- メトリクス名は「フェーズ名 + Ms」（例: piiSanitizeMs）、ディメンションは function
+  → CloudWatchでフェーズごとのp50/p95/p99をグラフ化できる
+
+※ lambda_deployment/temp_vXX と lambda_cognito_trigger に同じファイルを配置している（Lambdaごとに別ZIPのため）
+"""
+
+import functools
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from structured_logging import current_request
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TUUN/Lambda')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# EMFの1ディレクティブに含められるメトリクス数の上限
+MAX_METRICS_PER_RECORD = 100
+
+
+def record_timing(name: str, elapsed_ms: float) -> None:
+    """現在のリクエストにフェーズの処理時間を記録（同じフェーズが複数回あれば合算）"""
+    request_log = current_request()
+    if request_log is not None:
+        request_log.add_timing(name, elapsed_ms)
+
+
+def record_count(name: str, value: float = 1) -> None:
+    """現在のリクエストに件数を記録（メトリクス名は name そのまま、単位は Count）"""
+    request_log = current_request()
+    if request_log is not None:
+        request_log.add_count(name, value)
+
+
+class span:
+    """
+    フェーズの処理時間を計測するコンテキストマネージャー / デコレーター
+
+    使い方:
+        with span("promptBuild"):
+            messages = build_chat_messages(...)
+
+        @span("secretFetch")
+        def fetch_secret_string(secret_id): ...
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at: Optional[float] = None
+        self.elapsed_ms: Optional[float] = None
+
+    def __enter__(self) -> "span":
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+        record_timing(self.name, self.elapsed_ms)
+        return False
+
+    def __call__(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # 呼び出しごとに別インスタンスで計測（スレッドから同時に呼ばれても安全）
+            with span(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def time_first_item(items: Iterable, name: str, started_at: float) -> Iterator:
+    """
+    イテレーターの最初の要素が届くまでの時間を記録（ストリーミングの time to first token）
+
+    Args:
+        items: 計測対象のイテレーター
+        name: フェーズ名
+        started_at: 計測の起点（time.perf_counter()）
+    """
+    first = True
+    for item in items:
+        if first:
+            record_timing(name, (time.perf_counter() - started_at) * 1000)
+            first = False
+        yield item
+
+
+def metric_name(phase: str) -> str:
+    """フェーズ名からメトリクス名（ログのフィールド名）を作る"""
+    return f"{phase}Ms"
+
+
+def emf_fields(
+    function_name: str,
+    timings: Dict[str, float],
+    duration_ms: Optional[float] = None,
+    counts: Optional[Dict[str, float]] = None
+) -> Dict:
+    """
+    EMF形式のフィールドを作成（ログ1行のトップレベルにマージする）
+
+    counts は単位 Count のメトリクス（0/1で記録すればAverage統計が発生率になる）
+
+    Returns:
+        {"_aws": {...}, "function": ..., "piiSanitizeMs": 1.2, ...}（無効時は空dict）
+    """
+    if not METRICS_ENABLED or (not timings and duration_ms is None and not counts):
+        return {}
+
+    values = {metric_name(phase): value for phase, value in timings.items()}
+    if duration_ms is not None:
+        values["durationMs"] = duration_ms
+    units = dict.fromkeys(values, "Milliseconds")
+    for name, value in (counts or {}).items():
+        values[name] = value
+        units[name] = "Count"
+
+    metrics: List[Dict] = [
+        {"Name": name, "Unit": units[name]} for name in list(values)[:MAX_METRICS_PER_RECORD]
+    ]
+    fields = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["function"]],
+                "Metrics": metrics,
+            }],
+        },
+        "function": function_name,
+    }
+    fields.update(values)
+    return fields
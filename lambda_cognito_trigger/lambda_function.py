@@ -3,6 +3,9 @@ import boto3
 from datetime import datetime
 from botocore.exceptions import ClientError
 
+from structured_logging import current_request, end_request, log_debug, log_error, log_warning, start_request
+from instrumentation import span
+
 # AWSクライアントの初期化
 s3 = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
@@ -15,8 +18,18 @@ def lambda_handler(event, context):
     """
     ユーザープロファイル作成のメイン処理
     Cognitoトリガー（PostConfirmation）およびAPI Gatewayに対応
+
+    ログは1回の実行につきJSON 1行にまとめて出力する
     """
-    print(f"Event: {json.dumps(event)}")
+    start_request("user_profile", context)
+    try:
+        return handle_event(event)
+    finally:
+        end_request()
+
+def handle_event(event):
+    """イベントソースを判定してユーザープロファイルを作成"""
+    log_debug("event received", event=lambda: json.dumps(event))
 
     try:
         # ========================================
@@ -28,18 +41,18 @@ def lambda_handler(event, context):
 
             # PostConfirmation_ConfirmSignUp以外は処理しない
             if trigger_source != 'PostConfirmation_ConfirmSignUp':
-                print(f"⏭️ Skipping trigger source: {trigger_source}")
+                current_request().set(triggerSource=trigger_source, skipped=True)
                 return event
 
             # Cognitoイベントからメールアドレスを取得
             email = event['request']['userAttributes']['email'].lower().strip()
-            print(f"📧 Cognito trigger for user: {email}")
+            current_request().set(source="cognito", email=email)
 
         elif 'body' in event:
             # ============ API Gatewayからの呼び出し（後方互換性） ============
             body = json.loads(event['body'])
             email = body['email'].lower().strip()
-            print(f"📧 API Gateway request for user: {email}")
+            current_request().set(source="api_gateway", email=email)
 
         else:
             raise ValueError("Unknown event source - neither Cognito nor API Gateway")
@@ -48,20 +61,18 @@ def lambda_handler(event, context):
         if not validate_email(email):
             if 'triggerSource' in event:
                 # Cognitoトリガーの場合は警告ログのみ（エラーにしない）
-                print(f"⚠️ Invalid email format: {email}")
+                log_warning("invalid email format")
                 return event
             else:
                 return create_response(400, {'error': '無効なメールアドレス形式です'})
 
         # 1. S3フォルダ作成
-        print(f"Creating S3 folders for: {email}")
         s3_results = create_user_folders(email)
 
         # 2. DynamoDBにユーザープロファイル作成
-        print(f"Creating user profile in DynamoDB for: {email}")
         profile = create_user_profile(email)
 
-        print(f"✅ User profile created successfully for: {email}")
+        current_request().set(profileCreated=True)
 
         # ========================================
         # レスポンス返却
@@ -81,14 +92,14 @@ def lambda_handler(event, context):
     except ClientError as e:
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
-        print(f"❌ AWS Error: {error_code} - {error_message}")
+        current_request().set(errorCode=error_code)
 
         # エラーハンドリング（重複チェック）
         if error_code == 'ConditionalCheckFailedException':
             # ユーザーが既に存在する場合
             if 'triggerSource' in event:
                 # Cognitoトリガーの場合は成功として扱う（重要！）
-                print(f"⚠️ User profile already exists for: {email} - treating as success")
+                log_warning("user profile already exists - treating as success")
                 return event
             else:
                 # API Gatewayの場合は409エラーを返す
@@ -97,15 +108,14 @@ def lambda_handler(event, context):
         # その他のエラー
         if 'triggerSource' in event:
             # Cognitoトリガーでは致命的エラーのみ例外を投げる
-            print(f"❌ Critical error - will fail user registration: {error_message}")
+            log_error("critical error - will fail user registration", error=error_message)
             raise
         else:
             return create_response(500, {'error': f'エラー: {error_message}'})
 
     except Exception as e:
-        print(f"❌ Unexpected error: {str(e)}")
         import traceback
-        print(traceback.format_exc())
+        log_error("unexpected error", error=str(e), traceback=traceback.format_exc())
 
         # Cognitoトリガーの場合は例外を再スロー（ユーザー登録を失敗させる）
         if 'triggerSource' in event:
@@ -121,6 +131,7 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+@span("s3Folders")
 def create_user_folders(email):
     """
     S3にユーザー専用フォルダを作成
@@ -191,10 +202,11 @@ def create_user_folders(email):
             'description': 'READMEファイル'
         })
     except Exception as e:
-        print(f"README creation error: {e}")
+        log_warning("README creation failed", error=str(e))
 
     return results
 
+@span("profileCreate")
 def create_user_profile(email):
     """
     DynamoDBにユーザープロファイルを作成
@@ -210,11 +222,11 @@ def create_user_profile(email):
         }
 
         USER_TABLE.put_item(Item=profile)
-        print(f"✅ User profile created in DynamoDB: {email}")
+        log_debug("user profile created in DynamoDB")
         return profile
 
     except Exception as e:
-        print(f"❌ Profile creation failed: {e}")
+        log_error("profile creation failed", error=str(e))
         raise
 
 def create_response(status_code, body):
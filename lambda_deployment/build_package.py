@@ -0,0 +1,259 @@
+"""
+build_package.py - チャットLambdaのデプロイZIP作成（パッケージプロファイル + import時間計測）
+
+使い方:
+    cd lambda_deployment
+    python build_package.py temp_v18 --profile slim --output deployment_v18_slim.zip
+
+プロファイル:
+- full: 作業ディレクトリの内容をそのまま（.DS_Store / Finderの重複ファイル「xxx 2.py」等のみ除外）
+- sdk:  full から未使用のSDK関連を除外（openai CLI、dist-info、Lambdaランタイム同梱のboto3系、requests系）
+- slim: 自前モジュールのみ（openai SDK / pydantic / httpx を含めない）。
+        Lambda環境変数 OPENAI_HTTP_CLIENT=slim が必須
+
+ZIP作成前に `python -X importtime -c "import lambda_function"` でモジュールごとのimport時間を計測し、
+合計が --max-import-ms を超えた場合はエラー終了する（コールドスタートの劣化検知）。
+※ 計測はLambdaと同じPythonバージョン・アーキテクチャで実行すること（pydantic_core等のバイナリのため）
+
+sdk / full プロファイルは tiktoken と o200k_base の語彙（tiktoken_cache/）を必須とする
+（無いとトークン数が概算になり、履歴の要約・レート制限の予約がずれる）。作業ディレクトリに無い場合は
+エラー終了する（概算で良い場合は --allow-estimated-tokens）。import計測時は語彙が読み込めることも確認する。
+slim プロファイルは tiktoken を含めず、常に概算。
+"""
+
+import argparse
+import fnmatch
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+from typing import Dict, List, Tuple
+
+# 全プロファイル共通の除外
+COMMON_EXCLUDES = [
+    ".DS_Store",
+    "__pycache__",
+    "*.pyc",
+    # Finderのコピーで作られた重複ファイル（例: "_client 2.py", "py 3.typed"）
+    "* [0-9].*",
+    "* [0-9]",
+]
+
+# sdk プロファイルで追加除外するトップレベル項目
+SDK_EXCLUDES = [
+    "bin",
+    "*.dist-info",
+    "openai/cli",
+    # Lambda Pythonランタイムに同梱されているもの
+    "boto3",
+    "botocore",
+    "s3transfer",
+    "jmespath",
+    "dateutil",
+    "six.py",
+    "urllib3",
+    # どのモジュールからも使われていないもの
+    "requests",
+    "charset_normalizer",
+    "tqdm",
+]
+
+# slim プロファイルで含めない（自前モジュール以外のトップレベル.py）
+VENDORED_TOP_LEVEL_MODULES = {"six.py", "typing_extensions.py"}
+
+# Lambdaでは使わないローカル用ツール（全プロファイルで除外）
+LOCAL_TOOLS = {"batch_sanitize.py", "context_format_ab.py"}
+
+# プロファイルごとのimport時間の上限（ミリ秒）
+DEFAULT_MAX_IMPORT_MS = {
+    "full": 2500.0,
+    "sdk": 2500.0,
+    "slim": 150.0,
+}
+
+# トークン数の計算に tiktoken と語彙を同梱するプロファイル（token_counter）
+TOKENIZER_PROFILES = {"full", "sdk"}
+TOKENIZER_ENTRIES = ["tiktoken/", "tiktoken_ext/", "tiktoken_cache/"]
+TOKENIZER_HELP = """tiktoken と語彙を作業ディレクトリに追加してください:
+    pip install tiktoken -t {source_dir}
+    TIKTOKEN_CACHE_DIR={source_dir}/tiktoken_cache python -c "import sys; sys.path.insert(0, '{source_dir}'); import tiktoken; tiktoken.get_encoding('o200k_base')"
+（概算のトークン数で良い場合は --allow-estimated-tokens）"""
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def is_excluded(rel_path: str, patterns: List[str]) -> bool:
+    """相対パス（またはその親ディレクトリ）がパターンに一致するか"""
+    parts = rel_path.split('/')
+    for pattern in patterns:
+        if '/' in pattern:
+            if rel_path == pattern or rel_path.startswith(pattern + '/'):
+                return True
+        elif any(fnmatch.fnmatch(part, pattern) for part in parts):
+            return True
+    return False
+
+
+def select_files(source_dir: str, profile: str) -> List[str]:
+    """プロファイルに含めるファイルの相対パス一覧"""
+    selected = []
+    for root, dirs, files in os.walk(source_dir):
+        for name in files:
+            rel_path = os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, '/')
+            if is_excluded(rel_path, COMMON_EXCLUDES) or rel_path in LOCAL_TOOLS:
+                continue
+            if profile == "sdk" and is_excluded(rel_path, SDK_EXCLUDES):
+                continue
+            if profile == "slim" and ('/' in rel_path or not rel_path.endswith('.py') or rel_path in VENDORED_TOP_LEVEL_MODULES):
+                continue
+            selected.append(rel_path)
+    return sorted(selected)
+
+
+def missing_tokenizer_files(files: List[str]) -> List[str]:
+    """tiktoken・語彙のうちプロファイルに含まれていないもの"""
+    return [entry for entry in TOKENIZER_ENTRIES if not any(f.startswith(entry) for f in files)]
+
+
+def verify_tokenizer(staging_dir: str, python: str) -> str:
+    """
+    ステージングした語彙で token_counter がBPEを使えるか確認（ネットワークからは読み込まない）
+
+    Returns:
+        token_counter.tokenizer_name()（"o200k_base" または "estimate"）
+    """
+    env = {key: value for key, value in os.environ.items() if key != "TIKTOKEN_CACHE_DIR"}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    result = subprocess.run(
+        [python, "-c", "import token_counter; print(token_counter.tokenizer_name())"],
+        cwd=staging_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        return "error"
+    return result.stdout.strip().splitlines()[-1]
+
+
+def stage_files(source_dir: str, files: List[str], staging_dir: str) -> None:
+    for rel_path in files:
+        dest = os.path.join(staging_dir, rel_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(os.path.join(source_dir, rel_path), dest)
+
+
+def profile_imports(staging_dir: str, profile: str, python: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    lambda_function のimport時間を計測
+
+    Returns:
+        (合計ミリ秒, [(トップレベルのモジュール名, 累積ミリ秒), ...] 降順)
+    """
+    env = dict(os.environ)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    env.setdefault("PII_SALT", "import-profile-dummy-salt")
+    env.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+    if profile == "slim":
+        env["OPENAI_HTTP_CLIENT"] = "slim"
+
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", "import lambda_function"],
+        cwd=staging_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit(f"❌ import lambda_function failed in profile '{profile}'")
+
+    total_us = 0
+    # lambda_function から直接importされたモジュール（1段下）の累積時間
+    # -X importtime は子モジュールを親より先に出力するため、親が確定するまで保留する
+    pending: Dict[str, int] = {}
+    top_level: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_us = int(match.group(2))
+        indent = len(match.group(3)) - 1
+        module = match.group(4)
+        if indent == 0:
+            if module == "lambda_function":
+                total_us = cumulative_us
+                top_level = pending
+            pending = {}
+        elif indent == 2:
+            pending[module] = pending.get(module, 0) + cumulative_us
+
+    ranked = sorted(((name, us / 1000) for name, us in top_level.items()), key=lambda item: item[1], reverse=True)
+    return total_us / 1000, ranked
+
+
+def write_zip(staging_dir: str, files: List[str], output: str) -> None:
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for rel_path in files:
+            zf.write(os.path.join(staging_dir, rel_path), rel_path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="チャットLambdaのデプロイZIPを作成")
+    parser.add_argument("source_dir", help="作業ディレクトリ（例: temp_v18）")
+    parser.add_argument("--profile", choices=["full", "sdk", "slim"], default="sdk")
+    parser.add_argument("--output", help="出力ZIP（省略時はimport計測のみ）")
+    parser.add_argument("--max-import-ms", type=float, help="import時間の上限（ミリ秒）")
+    parser.add_argument("--python", default=sys.executable, help="計測に使うPython（Lambdaと同じバージョン）")
+    parser.add_argument("--skip-import-check", action="store_true", help="import時間の計測を省略")
+    parser.add_argument("--top", type=int, default=15, help="レポートに表示するモジュール数")
+    parser.add_argument(
+        "--allow-estimated-tokens", action="store_true",
+        help="sdk / full で tiktoken・語彙が無くても作成する（トークン数は概算）"
+    )
+    args = parser.parse_args()
+
+    files = select_files(args.source_dir, args.profile)
+    size = sum(os.path.getsize(os.path.join(args.source_dir, f)) for f in files)
+    print(f"📦 Profile '{args.profile}': {len(files)} files, {size / 1024 / 1024:.1f} MB (uncompressed)")
+
+    check_tokenizer = args.profile in TOKENIZER_PROFILES and not args.allow_estimated_tokens
+    if check_tokenizer:
+        missing = missing_tokenizer_files(files)
+        if missing:
+            print(f"❌ Tokenizer not bundled in profile '{args.profile}': missing {', '.join(missing)}")
+            print(TOKENIZER_HELP.format(source_dir=args.source_dir))
+            return 1
+
+    with tempfile.TemporaryDirectory() as staging_dir:
+        stage_files(args.source_dir, files, staging_dir)
+
+        if not args.skip_import_check:
+            max_import_ms = args.max_import_ms or DEFAULT_MAX_IMPORT_MS[args.profile]
+            total_ms, ranked = profile_imports(staging_dir, args.profile, args.python)
+
+            print(f"\n⏱️ Import time report (profile: {args.profile})")
+            print(f"{'module':<40} {'cumulative ms':>14}")
+            for name, ms in ranked[:args.top]:
+                print(f"{name:<40} {ms:>14.1f}")
+            print(f"{'TOTAL lambda_function':<40} {total_ms:>14.1f}  (limit {max_import_ms:.0f} ms)")
+
+            if total_ms > max_import_ms:
+                print(f"❌ Import time regression: {total_ms:.1f} ms > {max_import_ms:.0f} ms")
+                return 1
+
+            if check_tokenizer:
+                tokenizer = verify_tokenizer(staging_dir, args.python)
+                print(f"🔤 Tokenizer: {tokenizer}")
+                if tokenizer != "o200k_base":
+                    print("❌ token_counter cannot load the bundled o200k_base vocabulary")
+                    print(TOKENIZER_HELP.format(source_dir=args.source_dir))
+                    return 1
+
+        if args.output:
+            write_zip(staging_dir, files, args.output)
+            print(f"\n✅ Created {args.output} ({os.path.getsize(args.output) / 1024 / 1024:.1f} MB)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
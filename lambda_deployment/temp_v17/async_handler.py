@@ -0,0 +1,181 @@
+"""
+async_handler.py - asyncio版のチャットハンドラー
+
+同期版（lambda_function.lambda_handler）は
+シークレット取得 → PIIサニタイズ → コンテキスト描画 → セッション読み込み → OpenAI呼び出し を順番に行う。
+asyncio版は互いに依存しない処理を並行して行う:
+- OpenAIクライアントの準備（Secrets ManagerからのAPI Key取得・クライアント作成）
+- PIIサニタイズ → データコンテキストの描画 と DynamoDBからのセッション読み込み（描画済みコンテキスト・履歴）
+boto3・サニタイズ等の同期処理はスレッドで実行する（I/O待ちの間はGILが解放されるため重なる）。
+OpenAI呼び出しは AsyncOpenAI（SDK使用時の非ストリーミング）。slimクライアント・ストリーミング・ヘッジ有効時は
+同期クライアントをスレッドで呼ぶ。
+
+各処理の中身は lambda_function の関数をそのまま使う（同期版と応答は同じ）。
+lambda_handler(event, context) のシグネチャはそのまま（ASYNC_HANDLER_ENABLED=true で run_async_handler() に委譲）。
+"""
+
+import asyncio
+import functools
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import lambda_function as chat
+from hedging import OPENAI_HEDGE_ENABLED
+from instrumentation import span
+from rate_limiter import RateBudgetExceeded, reserve_attempt
+from retry_scheduler import OPENAI_MAX_ATTEMPTS, RetryPolicy, call_with_retry_async, start_deadline, with_attempt_timeout
+from structured_logging import end_request, log_debug, log_error, log_warning, start_request
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_client_cache = {"client": None, "api_key": None}
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    ハンドラー用のイベントループ（ウォームスタート間で再利用）
+
+    AsyncOpenAI のコネクションプールは作成時のループに紐づくため、
+    リクエストごとに asyncio.run() で作り直すとkeep-aliveのコネクションが使えない。
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def run_async_handler(event, context) -> Dict:
+    """同期の lambda_handler(event, context) から asyncio版を呼ぶ"""
+    return get_event_loop().run_until_complete(lambda_handler_async(event, context))
+
+
+def _in_thread(fn: Callable, *args) -> "asyncio.Future":
+    """同期関数をデフォルトのスレッドプールで実行"""
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+
+
+def use_async_client() -> bool:
+    """AsyncOpenAI を使うか（SDKのみ。ヘッジはスレッドで行うため同期クライアントを使う）"""
+    return chat.OPENAI_HTTP_CLIENT != 'slim' and not OPENAI_HEDGE_ENABLED
+
+
+async def get_async_openai_client(api_key: str):
+    """AsyncOpenAIクライアント（API Keyが変わった場合のみ作り直す）"""
+    client = _async_client_cache["client"]
+    if client is not None and _async_client_cache["api_key"] == api_key:
+        return client
+
+    if client is not None:
+        # 古いコネクションプールを解放
+        try:
+            await client.close()
+        except Exception as e:
+            log_warning("failed to close previous AsyncOpenAI client", error=str(e))
+
+    with span("clientInit"):
+        from openai import AsyncOpenAI
+        # リトライは retry_scheduler で行う（SDK内蔵のリトライと二重にしない）
+        client = AsyncOpenAI(api_key=api_key, max_retries=0)
+    _async_client_cache["client"] = client
+    _async_client_cache["api_key"] = api_key
+    return client
+
+
+async def prepare_openai_clients(force_refresh: bool = False) -> Tuple[Any, Any]:
+    """
+    OpenAIクライアントを準備（API Keyの取得はスレッドで）
+
+    Returns:
+        (同期クライアント, AsyncOpenAIクライアント または None)
+    """
+    sync_client = await _in_thread(functools.partial(chat.get_openai_client, force_refresh=force_refresh))
+    if not use_async_client():
+        return sync_client, None
+    return sync_client, await get_async_openai_client(chat.get_openai_api_key())
+
+
+async def call_openai_async(client, messages: List[Dict], max_retries: int = OPENAI_MAX_ATTEMPTS) -> str:
+    """call_openai() の AsyncOpenAI 版"""
+    chat.log_openai_request(messages)
+    params = chat.chat_completion_params(messages)
+
+    def create():
+        reserve_attempt()
+        return with_attempt_timeout(client).chat.completions.create(**params)
+
+    response = await call_with_retry_async(create, operation="chat", policy=RetryPolicy(max_attempts=max_retries))
+    return chat.read_chat_completion(response)
+
+
+async def call_with_auth_refresh_async(client, messages: List[Dict]) -> str:
+    """401（キャッシュ済みAPI Keyの失効）時はAPI Keyを再取得して1回だけリトライ"""
+    try:
+        try:
+            return await call_openai_async(client, messages)
+        except chat.openai_auth_error_types() as e:
+            log_warning("OpenAI authentication failed, refreshing API key", error=str(e))
+            _, client = await prepare_openai_clients(force_refresh=True)
+            return await call_openai_async(client, messages)
+    except RateBudgetExceeded as e:
+        raise chat.rate_limited_error(e) from e
+
+
+def _discard_result(future: "asyncio.Future") -> None:
+    # 早期に応答を返した場合の未使用のクライアント準備（例外を未処理のまま残さない）
+    if not future.cancelled():
+        future.exception()
+
+
+async def lambda_handler_async(event, context) -> Dict:
+    """lambda_handler の asyncio版（応答は同期版と同じ）"""
+    request_log = start_request("chat", context)
+    start_deadline(context)
+    status_code = 500
+    # シークレット取得は他の処理と並行して進める
+    clients = asyncio.ensure_future(prepare_openai_clients())
+    try:
+        log_debug("event received", event=lambda: json.dumps(event, ensure_ascii=False)[:200])
+
+        request = chat.parse_chat_request(event, request_log)
+        sanitized = await _in_thread(chat.sanitize_chat_request, request, request_log)
+        route, context_format = chat.resolve_context_options(request, sanitized, request_log)
+        data_contexts, session = await asyncio.gather(
+            _in_thread(chat.render_request_contexts, request, sanitized, route, context_format),
+            _in_thread(chat.load_session, request, sanitized)
+        )
+        prompt = chat.prepare_chat_prompt(request, sanitized, route, context_format, data_contexts, session, request_log)
+        await _in_thread(chat.reserve_openai_budget, prompt.messages)
+
+        try:
+            sync_client, async_client = await clients
+        except Exception as e:
+            log_error("failed to create OpenAI client", error=str(e))
+            raise
+
+        # ストリーミングモード: セクション単位のイベントを同期クライアントでまとめて受け取る
+        if request.stream_mode:
+            events = await _in_thread(lambda: list(chat.stream_chat_events(sync_client, prompt.messages)))
+            result = chat.build_stream_response(prompt, events)
+        else:
+            with span("openaiTotal"):
+                if async_client is None:
+                    response = await _in_thread(chat.call_with_auth_refresh, chat.call_openai, sync_client, prompt.messages)
+                else:
+                    response = await call_with_auth_refresh_async(async_client, prompt.messages)
+            result = chat.build_chat_response(prompt, response, request_log)
+        status_code = 200
+        return result
+
+    except chat.ChatRequestError as e:
+        status_code = e.status_code
+        return e.to_response()
+
+    except Exception as e:
+        return chat.internal_error_response(e)
+
+    finally:
+        if clients.done():
+            _discard_result(clients)
+        else:
+            clients.add_done_callback(_discard_result)
+        end_request(statusCode=status_code)
@@ -0,0 +1,209 @@
+"""
+batch_sanitize.py - リクエストボディの一括サニタイズ（評価用・分析用エクスポート）
+
+sanitize_for_openai() を大量のリクエストボディ（JSONL）にまとめて適用する。
+- 入力: JSONLファイル / 標準入力（-） / S3（s3://bucket/key）を1行ずつ読み込み
+- プロセスプールで並列処理（処理中のチャンク数に上限があるため、入力サイズによらずメモリは一定）
+- 出力: サニタイズ済みのJSONL（入力と同じ順序）
+- レポート: 件数、スループット（records/s）、パターンごとのマスク件数
+
+使い方:
+    cd lambda_deployment/temp_vXX
+    PII_SALT=... python batch_sanitize.py s3://bucket/export/conversations.jsonl --output sanitized.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pii_sanitizer import PIISanitizer, sanitize_for_openai
+
+DEFAULT_CHUNK_SIZE = 256
+
+# マスク後のテキストに現れる置換トークン（例: "[EMAIL]"）
+REPLACEMENT_TOKENS = [replacement for _, replacement in PIISanitizer.PII_PATTERNS]
+
+Record = Union[str, Dict]
+
+
+def count_redactions(original: Dict, sanitized: Dict) -> Counter:
+    """
+    1件のマスク件数をパターン（置換トークン）ごとに数える
+
+    サニタイズ後のテキストに含まれる置換トークン数から、元のテキストに最初から
+    含まれていた数を引く（履歴キャッシュでスキャンが省略された場合も正しく数えられる）。
+    """
+    def texts(body: Dict) -> List[str]:
+        values = [body.get("message") or ""]
+        values.extend(msg.get("content") or "" for msg in body.get("conversationHistory") or [])
+        return values
+
+    original_texts = texts(original)
+    sanitized_texts = texts(sanitized)
+    counts = Counter()
+    for token in REPLACEMENT_TOKENS:
+        found = sum(text.count(token) for text in sanitized_texts) - sum(text.count(token) for text in original_texts)
+        if found > 0:
+            counts[token] = found
+    return counts
+
+
+def sanitize_chunk(records: List[Record]) -> Tuple[List[str], Dict[str, int], int]:
+    """
+    チャンク単位の処理（ワーカープロセスで実行）
+
+    Returns:
+        (出力JSONL行, マスク件数, 読み込めなかった件数)
+    """
+    lines = []
+    counts = Counter()
+    errors = 0
+    for record in records:
+        try:
+            body = json.loads(record) if isinstance(record, str) else record
+            sanitized = sanitize_for_openai(body)
+        except (ValueError, TypeError, AttributeError) as e:
+            if isinstance(e, ValueError) and "PII_SALT" in str(e):
+                raise
+            errors += 1
+            continue
+        counts.update(count_redactions(body, sanitized))
+        lines.append(json.dumps(sanitized, ensure_ascii=False))
+    return lines, dict(counts), errors
+
+
+def _chunks(records: Iterable[Record], chunk_size: int) -> Iterator[List[Record]]:
+    chunk = []
+    for record in records:
+        if isinstance(record, str) and not record.strip():
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BatchSanitizer:
+    """
+    リクエストボディの一括サニタイズ
+
+    使い方:
+        batch = BatchSanitizer(workers=4)
+        for line in batch.run(records):
+            output.write(line + "\\n")
+        print(batch.report())
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE, max_pending_chunks: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # 処理中（結果未回収）のチャンク数の上限 → メモリ使用量の上限
+        self.max_pending_chunks = max_pending_chunks or self.workers * 2
+        self.records = 0
+        self.errors = 0
+        self.redactions = Counter()
+        self.elapsed = 0.0
+
+    def run(self, records: Iterable[Record]) -> Iterator[str]:
+        """
+        サニタイズ済みのJSON行を入力と同じ順序で返す
+
+        Args:
+            records: JSON文字列（JSONLの1行）またはdictのイテレーター
+        """
+        started = time.perf_counter()
+        try:
+            if self.workers == 1:
+                for chunk in _chunks(records, self.chunk_size):
+                    yield from self._collect(sanitize_chunk(chunk))
+                return
+
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                pending = deque()
+                for chunk in _chunks(records, self.chunk_size):
+                    pending.append(executor.submit(sanitize_chunk, chunk))
+                    if len(pending) >= self.max_pending_chunks:
+                        yield from self._collect(pending.popleft().result())
+                while pending:
+                    yield from self._collect(pending.popleft().result())
+        finally:
+            self.elapsed = time.perf_counter() - started
+
+    def _collect(self, result: Tuple[List[str], Dict[str, int], int]) -> List[str]:
+        lines, counts, errors = result
+        self.records += len(lines)
+        self.errors += errors
+        self.redactions.update(counts)
+        return lines
+
+    def report(self) -> Dict:
+        """処理件数・スループット・パターンごとのマスク件数"""
+        return {
+            "records": self.records,
+            "errors": self.errors,
+            "elapsedSeconds": round(self.elapsed, 2),
+            "recordsPerSecond": round(self.records / self.elapsed, 1) if self.elapsed else None,
+            "redactions": {token: self.redactions.get(token, 0) for token in REPLACEMENT_TOKENS},
+        }
+
+
+def read_lines(source: str) -> Iterator[str]:
+    """JSONLを1行ずつ読み込む（ファイル / - / s3://bucket/key）"""
+    if source == "-":
+        yield from sys.stdin
+        return
+
+    if source.startswith("s3://"):
+        import boto3
+        bucket, _, key = source[5:].partition("/")
+        body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"]
+        for line in body.iter_lines():
+            yield line.decode("utf-8")
+        return
+
+    with open(source, encoding="utf-8") as f:
+        yield from f
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="リクエストボディ（JSONL）を一括サニタイズ")
+    parser.add_argument("source", help="入力JSONL（ファイルパス / - / s3://bucket/key）")
+    parser.add_argument("--output", default="-", help="出力JSONL（省略時は標準出力）")
+    parser.add_argument("--workers", type=int, help="ワーカープロセス数（省略時はCPU数）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="1タスクあたりの件数")
+    args = parser.parse_args()
+
+    try:
+        PIISanitizer.get_salt()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    batch = BatchSanitizer(workers=args.workers, chunk_size=args.chunk_size)
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for line in batch.run(read_lines(args.source)):
+            output.write(line + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    report = batch.report()
+    print(
+        f"✅ Sanitized {report['records']} records ({report['errors']} errors) "
+        f"in {report['elapsedSeconds']}s — {report['recordsPerSecond']} records/s",
+        file=sys.stderr
+    )
+    print(f"📊 Redactions: {json.dumps(report['redactions'], ensure_ascii=False)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
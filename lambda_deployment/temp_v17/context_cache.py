@@ -0,0 +1,134 @@
+"""
+context_cache.py - データコンテキスト描画結果のキャッシュ
+
+血液/バイタル/遺伝子データのコンテキスト文字列は、会話中ほぼ同じ入力から
+毎ターン同じ文字列を組み立て直している。サニタイズ済み入力の安定ハッシュを
+キーに描画結果をキャッシュする（コンテンツアドレス方式）。
+- インプロセスLRU（件数上限あり、ウォームスタート間で再利用）
+- 任意で共有ストア（DynamoDB）に保存し、他のインスタンスとも共有
+- 同じ入力には常に同じ文字列を返すため、プロバイダー側のプロンプトキャッシュにも効く
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from lru_cache import LRUCache
+from structured_logging import log_warning
+
+CONTEXT_CACHE_SIZE = int(os.environ.get('CONTEXT_CACHE_SIZE', '256'))
+CONTEXT_CACHE_TABLE = os.environ.get('CONTEXT_CACHE_TABLE', '')
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get('CONTEXT_CACHE_TTL_SECONDS', str(24 * 3600)))
+
+# 描画ロジックを変更したら上げる（古いキャッシュを無効化）
+RENDER_VERSION = "3"
+
+
+def content_hash(data: Any) -> str:
+    """入力データの安定ハッシュ（キー順に依存しない）"""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DynamoDBRenderStore:
+    """
+    描画結果の共有ストア
+
+    DynamoDBテーブル:
+    - パーティションキー: cacheKey (String)
+    - TTL属性: expiresAt (Number, epoch秒)
+    """
+
+    def __init__(self, table_name: str, region_name: str = 'ap-northeast-1', ttl_seconds: int = CONTEXT_CACHE_TTL_SECONDS):
+        import boto3
+        self.table = boto3.resource('dynamodb', region_name=region_name).Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        item = self.table.get_item(Key={"cacheKey": key}).get("Item")
+        if not item or int(item.get("expiresAt", 0)) < time.time():
+            return None
+        return item.get("text")
+
+    def put(self, key: str, text: str) -> None:
+        self.table.put_item(Item={
+            "cacheKey": key,
+            "text": text,
+            "expiresAt": int(time.time()) + self.ttl_seconds,
+        })
+
+
+class ContextRenderCache:
+    """描画結果のコンテンツアドレスキャッシュ"""
+
+    def __init__(self, max_size: int = CONTEXT_CACHE_SIZE, shared_store=None):
+        self.local = LRUCache(max_size=max_size)
+        self.shared_store = shared_store
+        self.shared_hits = 0
+
+    def render(self, kind: str, renderer: Callable[..., str], data: Any, **options) -> str:
+        """
+        キャッシュ経由でコンテキストを描画
+
+        Args:
+            kind: 描画の種類（"blood" など。キーの名前空間）
+            renderer: 実際の描画関数 renderer(data, **options)
+            data: サニタイズ済みの入力データ
+            options: 描画オプション（キーに含める）
+        """
+        key = f"{kind}:{RENDER_VERSION}:{content_hash([data, options])}"
+
+        text = self.local.get(key)
+        if text is not None:
+            return text
+
+        if self.shared_store is not None:
+            try:
+                text = self.shared_store.get(key)
+            except Exception as e:
+                log_warning("context cache shared store read failed", error=str(e))
+                text = None
+            if text is not None:
+                self.shared_hits += 1
+                self.local.put(key, text)
+                return text
+
+        text = renderer(data, **options)
+        self.local.put(key, text)
+
+        if self.shared_store is not None:
+            try:
+                self.shared_store.put(key, text)
+            except Exception as e:
+                log_warning("context cache shared store write failed", error=str(e))
+
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット/ミス数（shared_hitsはローカルミスのうち共有ストアでヒットした数）"""
+        stats = self.local.stats()
+        stats["shared_hits"] = self.shared_hits
+        return stats
+
+
+_default_cache: Optional[ContextRenderCache] = None
+
+
+def get_context_cache() -> ContextRenderCache:
+    """
+    モジュール共通のキャッシュ
+
+    CONTEXT_CACHE_TABLE が設定されている場合はDynamoDBを共有ストアとして使う。
+    """
+    global _default_cache
+    if _default_cache is None:
+        shared_store = DynamoDBRenderStore(CONTEXT_CACHE_TABLE) if CONTEXT_CACHE_TABLE else None
+        _default_cache = ContextRenderCache(shared_store=shared_store)
+    return _default_cache
+
+
+def render_cached(kind: str, renderer: Callable[..., str], data: Any, **options) -> str:
+    """便利関数: モジュール共通のキャッシュで描画"""
+    return get_context_cache().render(kind, renderer, data, **options)
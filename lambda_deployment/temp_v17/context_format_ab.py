@@ -0,0 +1,153 @@
+"""
+context_format_ab.py - データコンテキスト形式のA/B比較（verbose / compact）
+
+記録済みのリクエストボディ（JSONL）から両方の形式でプロンプトを組み立て、
+プロンプトの文字数・トークン数・描画時間を比較する。
+--live を付けると実際にOpenAIへ送り、prompt_tokens（usage）と応答時間も比較する。
+- 入力はハンドラーと同じく sanitize_for_openai() を通してから使う
+- --live では出力を1トークンに制限し、プロンプト処理分のレイテンシを比べる
+- オフラインのトークン数は token_counter.count_messages_tokens()（語彙を同梱していない場合は日本語を考慮した概算）
+
+使い方:
+    cd lambda_deployment/temp_vXX
+    PII_SALT=... python context_format_ab.py recorded_requests.jsonl
+    PII_SALT=... python context_format_ab.py s3://bucket/replay/requests.jsonl --live --limit 50
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from batch_sanitize import read_lines
+from pii_sanitizer import PIISanitizer, sanitize_for_openai
+from token_counter import count_messages_tokens, tokenizer_name
+
+import lambda_function as chat
+
+FORMATS = ("verbose", "compact")
+
+
+def build_prompt(body: Dict, context_format: str) -> List[Dict]:
+    """ハンドラーと同じ手順でプロンプトを組み立てる（セッション・絞り込みなし）"""
+    sanitized = sanitize_for_openai(body)
+    data_contexts = chat.render_data_contexts(
+        sanitized.get("bloodData") if body.get("bloodData") else None,
+        sanitized.get("vitalData") if body.get("vitalData") else None,
+        sanitized.get("geneData") if body.get("geneData") else None,
+        context_format=context_format
+    )
+    return chat.build_chat_messages(
+        user_message=sanitized.get("message", ""),
+        conversation_history=sanitized.get("conversationHistory", []),
+        blood_data=None,
+        vital_data=None,
+        gene_data=None,
+        data_contexts=data_contexts
+    )
+
+
+def measure_live(client, messages: List[Dict]) -> Dict:
+    """OpenAIに送って prompt_tokens と応答時間を測る（出力は1トークン）"""
+    started = time.perf_counter()
+    response = client.chat.completions.create(
+        model=chat.OPENAI_MODEL,
+        messages=messages,
+        max_completion_tokens=1,
+        prompt_cache_key=chat.PROMPT_CACHE_KEY
+    )
+    return {
+        "promptTokens": response.usage.prompt_tokens,
+        "latencyMs": (time.perf_counter() - started) * 1000,
+    }
+
+
+def summarize(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        "mean": round(statistics.mean(ordered), 1),
+        "p50": round(ordered[len(ordered) // 2], 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="データコンテキスト形式（verbose / compact）のA/B比較")
+    parser.add_argument("source", help="記録済みリクエストボディのJSONL（ファイルパス / - / s3://bucket/key）")
+    parser.add_argument("--live", action="store_true", help="OpenAIに送ってprompt_tokensとレイテンシも比較")
+    parser.add_argument("--limit", type=int, help="比較する件数の上限")
+    args = parser.parse_args()
+
+    try:
+        PIISanitizer.get_salt()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    client = chat.get_openai_client() if args.live else None
+    results = {name: {"chars": [], "tokens": [], "renderMs": [], "promptTokens": [], "latencyMs": []} for name in FORMATS}
+    count = 0
+
+    for line in read_lines(args.source):
+        if not line.strip():
+            continue
+        body = json.loads(line)
+        if not body.get("bloodData") and not body.get("vitalData"):
+            continue
+
+        # 形式の順序による偏り（キャッシュ・接続の温まり）を避けるため交互に先行させる
+        order = FORMATS if count % 2 == 0 else tuple(reversed(FORMATS))
+        for name in order:
+            started = time.perf_counter()
+            messages = build_prompt(body, name)
+            render_ms = (time.perf_counter() - started) * 1000
+            chars = sum(len(msg["content"]) for msg in messages)
+            results[name]["chars"].append(chars)
+            results[name]["tokens"].append(count_messages_tokens(messages))
+            results[name]["renderMs"].append(render_ms)
+            if client is not None:
+                live = measure_live(client, messages)
+                results[name]["promptTokens"].append(live["promptTokens"])
+                results[name]["latencyMs"].append(live["latencyMs"])
+
+        count += 1
+        if args.limit and count >= args.limit:
+            break
+
+    if not count:
+        print("⚠️ bloodData / vitalData を含むリクエストがありません", file=sys.stderr)
+        return 1
+
+    report = {
+        name: {metric: summarize(values) for metric, values in metrics.items() if values}
+        for name, metrics in results.items()
+    }
+    print(json.dumps({"requests": count, "tokenizer": tokenizer_name(), **report}, ensure_ascii=False, indent=2))
+
+    baseline = statistics.mean(results["verbose"]["chars"])
+    compact = statistics.mean(results["compact"]["chars"])
+    print(f"📊 Prompt chars: verbose {baseline:.0f} → compact {compact:.0f} ({(compact / baseline - 1) * 100:+.1f}%)", file=sys.stderr)
+    baseline_tokens = statistics.mean(results["verbose"]["tokens"])
+    compact_tokens = statistics.mean(results["compact"]["tokens"])
+    print(
+        f"📊 Prompt tokens ({tokenizer_name()}): verbose {baseline_tokens:.0f} → compact {compact_tokens:.0f} "
+        f"({(compact_tokens / baseline_tokens - 1) * 100:+.1f}%)",
+        file=sys.stderr
+    )
+    if client is not None:
+        baseline_tokens = statistics.mean(results["verbose"]["promptTokens"])
+        compact_tokens = statistics.mean(results["compact"]["promptTokens"])
+        print(
+            f"📊 Prompt tokens (usage): verbose {baseline_tokens:.0f} → compact {compact_tokens:.0f} "
+            f"({(compact_tokens / baseline_tokens - 1) * 100:+.1f}%)",
+            file=sys.stderr
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
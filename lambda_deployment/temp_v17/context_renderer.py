@@ -0,0 +1,520 @@
+"""
+context_renderer.py - 血液・バイタル・遺伝子データのコンテキスト描画
+
+プロンプトに含めるデータコンテキストの描画関数をまとめたもの。
+- 見出し・行の書式はモジュールレベルの定数（テンプレート）として1回だけ定義
+  （項目ごとに繰り返す行は f-string で組み立てる。str.format より速い）
+- 血液項目の判定（異常 / 注意 / 正常）は classify_blood_items() で1回だけ行い、各形式で共有
+- 各描画関数は行を1つのリストに追加し、最後に "\\n".join() で1回だけ連結
+  （文字列の逐次連結やジェネレーターの多段連結をしない。CPythonではこれが最も速い）
+- 遺伝子データはSNP数が多いと巨大になるため、上限（文字数・カテゴリーあたりのSNP行数）を
+  超える場合は build_gene_data_context_bounded() でマーカーごとの要約に切り替える
+- 入力は pii_sanitizer でサニタイズした後のデータ（血液項目は name、バイタルは has_* / *_level の
+  相対評価のみ）。サニタイズ前の形式（nameJp・HealthKitの数値）も従来どおり描画できる
+- 出力は入力の内容だけで決まる（辞書のキー順に依存しない）
+  → context_cache のキー（キー順に依存しないハッシュ）と矛盾せず、プロンプトキャッシュにも効く
+"""
+
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# 遺伝子コンテキストの上限（SNP数が多い場合は要約する）
+GENE_CONTEXT_MAX_CHARS = int(os.environ.get('GENE_CONTEXT_MAX_CHARS', '4000'))
+GENE_SNPS_PER_CATEGORY = int(os.environ.get('GENE_SNPS_PER_CATEGORY', '20'))
+
+# 血液項目のステータス判定
+NORMAL_STATUSES = frozenset(["正常", "normal"])
+ATTENTION_STATUSES = frozenset(["注意", "caution", "要注意"])
+
+# 血液データ
+BLOOD_HEADER = "【ユーザーの血液検査結果】"
+BLOOD_ABNORMAL_HEADER = "\n【要注意】以下の項目が異常値です："
+BLOOD_ATTENTION_HEADER = "\n【注意】以下の項目が基準値外です："
+BLOOD_NORMAL_HEADER = "\n【正常範囲】以下の項目が正常範囲内です："
+BLOOD_NORMAL_SUMMARY = "\n【正常範囲】{count}項目が正常範囲内".format
+BLOOD_OMITTED = "\n（今回の質問に関連しない正常範囲の項目{count}件は省略しています）".format
+
+BLOOD_COMPACT_HEADER = "【血液検査】"
+BLOOD_COMPACT_TABLE_HEADER = "判定|項目|値|基準値"
+BLOOD_COMPACT_NORMAL = "正常{count}項目: {values}".format
+BLOOD_COMPACT_OMITTED = "（質問に関連しない正常項目{count}件は省略）".format
+
+# バイタルデータ
+VITAL_HEADER = "【ユーザーのバイタルデータ（最新7日間）】"
+VITAL_SECTION = "\n【{}】".format
+VITAL_COMPACT = "【バイタル(7日)】{}".format
+
+# バイタルデータの表示項目（セクション → (キー, 表示名, 書式, 倍率)）
+VITAL_SECTIONS = [
+    ("体組成", [
+        ("bodyMass", "体重", "{:.1f} kg", 1),
+        ("height", "身長", "{:.1f} cm", 1),
+        ("bodyFatPercentage", "体脂肪率", "{:.1f}%", 100),
+        ("leanBodyMass", "除脂肪体重", "{:.1f} kg", 1),
+    ]),
+    ("心臓・循環器", [
+        ("restingHeartRate", "安静時心拍数", "{:.0f} bpm", 1),
+        ("vo2Max", "VO2Max", "{:.1f} ml/kg/min", 1),
+        ("heartRateVariability", "心拍変動 (HRV)", "{:.0f} ms", 1),
+        ("heartRate", "心拍数", "{:.0f} bpm", 1),
+    ]),
+    ("活動量", [
+        ("activeEnergyBurned", "アクティブカロリー", "{:.0f} kcal", 1),
+        ("exerciseTime", "エクササイズ時間", "{:.0f} 分", 1),
+        ("stepCount", "歩数", "{:.0f} steps", 1),
+    ]),
+    ("移動距離", [
+        ("walkingRunningDistance", "歩行・ランニング距離", "{:.2f} km", 1),
+        ("cyclingDistance", "サイクリング距離", "{:.2f} km", 1),
+    ]),
+]
+
+# サニタイズ済みバイタルデータ（pii_sanitizer.sanitize_vital_data）の表示項目
+SANITIZED_VITAL_SECTION = "記録状況"
+SANITIZED_VITAL_FLAGS = [
+    ("has_body_composition", "体組成"),
+    ("has_heart_data", "心拍"),
+    ("has_activity_data", "活動量"),
+    ("has_vo2max", "VO2Max"),
+]
+# (キー, 表示名, 値 → 表示, 記録ありの判定に使うフラグ)
+SANITIZED_VITAL_LEVELS = [
+    ("vo2max_level", "VO2Max", {
+        "high": "高い(45超)", "moderate": "標準(35-45)", "low": "低い(35以下)",
+    }, "has_vo2max"),
+    # 心拍データがない場合も "average" になるため、has_heart_data のときだけ表示する
+    ("resting_hr_level", "安静時心拍数", {
+        "athlete": "アスリート水準(55bpm未満)", "good": "良好(55-69bpm)", "average": "平均的(70bpm以上)",
+    }, "has_heart_data"),
+]
+
+# 遺伝子データ
+GENE_HEADER = "【ユーザーの遺伝子データ】"
+GENE_CATEGORY = "\n■ {}".format
+GENE_CATEGORY_EMPTY = "\n■ {}: データが見つかりませんでした（小カテゴリー名が正しいか確認してください）".format
+GENE_UNKNOWN_FORMAT = "  - (不明な形式: {})".format
+GENE_SNPS_OMITTED = "    （他{count}件のSNPは省略）".format
+GENE_MARKERS_OMITTED = "\n（文字数の上限のため、関連度の低いマーカー{count}件は省略しています）".format
+GENE_NOT_FOUND = (
+    "【ユーザーの遺伝子データ】\n要求された遺伝子データがシステムから返されませんでした。"
+    "小カテゴリー名の形式が正しいか確認してください。\n\n"
+    "※ヒント: 小カテゴリーは半角カンマ「,」で区切る必要があります。"
+)
+
+GENE_CATEGORIES_HEADER = "【利用可能な遺伝子データカテゴリー】"
+GENE_CATEGORIES_INTRO = "以下のカテゴリーの遺伝子情報を要求できます："
+GENE_CATEGORIES_FOOTER = "\n必要に応じて「🧬 [カテゴリー名]に関する遺伝子情報」の形式で要求してください。"
+
+
+class BloodPanel(NamedTuple):
+    """ステータス別に分類した血液項目（入力と同じ順序）"""
+    abnormal: List[Dict]
+    attention: List[Dict]
+    normal: List[Dict]
+
+
+def classify_blood_items(blood_data: Iterable[Dict]) -> BloodPanel:
+    """血液項目を異常 / 注意 / 正常に分類"""
+    panel = BloodPanel([], [], [])
+    for item in blood_data:
+        status = item.get('status', '').lower()
+        if status in NORMAL_STATUSES:
+            panel.normal.append(item)
+        elif status in ATTENTION_STATUSES:
+            panel.attention.append(item)
+        else:
+            panel.abnormal.append(item)
+    return panel
+
+
+def _blood_item_name(item: Dict) -> str:
+    # サニタイズ済みの項目は name（nameJp）のみを持つ
+    return item.get('name') or item.get('nameJp') or item.get('key', '')
+
+
+def _blood_item_line(item: Dict) -> str:
+    return f"- {_blood_item_name(item)}: {item.get('value')} {item.get('unit')} (基準値: {item.get('reference')})"
+
+
+def _extend_blood_section(parts: List[str], header: str, items: List[Dict]) -> None:
+    if items:
+        parts.append(header)
+        parts.extend(map(_blood_item_line, items))
+
+
+def build_blood_data_context(blood_data: List[Dict], omitted: int = 0) -> str:
+    """
+    血液データのコンテキスト
+
+    Args:
+        omitted: 質問に関連しないため除いた正常範囲の項目数（intent_router）
+    """
+    panel = classify_blood_items(blood_data)
+    parts = [BLOOD_HEADER]
+    # 異常値を優先表示
+    _extend_blood_section(parts, BLOOD_ABNORMAL_HEADER, panel.abnormal)
+    _extend_blood_section(parts, BLOOD_ATTENTION_HEADER, panel.attention)
+    _extend_blood_section(parts, BLOOD_NORMAL_HEADER, panel.normal)
+    if omitted:
+        parts.append(BLOOD_OMITTED(count=omitted))
+    return "\n".join(parts)
+
+
+def build_blood_data_context_compact(blood_data: List[Dict], omitted: int = 0) -> str:
+    """
+    血液データのコンテキスト（コンパクト形式）
+
+    基準値外の項目は表（判定|項目|値|基準値）、正常範囲の項目は「項目名 値」の1行にまとめる。
+    """
+    panel = classify_blood_items(blood_data)
+    parts = [BLOOD_COMPACT_HEADER]
+    if panel.abnormal or panel.attention:
+        parts.append(BLOOD_COMPACT_TABLE_HEADER)
+        for label, items in (("異常", panel.abnormal), ("注意", panel.attention)):
+            parts.extend(
+                f"{label}|{_blood_item_name(item)}|{item.get('value')} {item.get('unit')}|{item.get('reference')}"
+                for item in items
+            )
+    if panel.normal:
+        parts.append(BLOOD_COMPACT_NORMAL(
+            count=len(panel.normal),
+            values=", ".join([f"{_blood_item_name(item)} {item.get('value')}" for item in panel.normal])
+        ))
+    if omitted:
+        parts.append(BLOOD_COMPACT_OMITTED(count=omitted))
+    return "\n".join(parts)
+
+
+def iter_vital_metrics(vital_data: Dict) -> Iterator[Tuple[str, str, str]]:
+    """
+    値のあるバイタル項目を (セクション, 表示名, 書式済みの値) で返す
+
+    サニタイズ済みのデータ（数値を持たない）は記録の有無と相対評価を返す。
+    """
+    for section, metrics in VITAL_SECTIONS:
+        for key, label, value_format, scale in metrics:
+            if vital_data.get(key):
+                yield section, label, value_format.format(vital_data[key] * scale)
+
+    recorded = [label for key, label in SANITIZED_VITAL_FLAGS if vital_data.get(key)]
+    if recorded:
+        yield SANITIZED_VITAL_SECTION, "記録あり", "/".join(recorded)
+    for key, label, levels, flag in SANITIZED_VITAL_LEVELS:
+        level = vital_data.get(key)
+        if level and vital_data.get(flag):
+            yield SANITIZED_VITAL_SECTION, label, levels.get(level, str(level))
+
+
+def build_vital_data_context(vital_data: Dict) -> str:
+    """バイタルデータ（HealthKitデータ）のコンテキスト"""
+    parts = [VITAL_HEADER]
+    current_section = None
+    for section, label, value in iter_vital_metrics(vital_data):
+        if section != current_section:
+            parts.append(VITAL_SECTION(section))
+            current_section = section
+        parts.append(f"- {label}: {value}")
+    return "\n".join(parts)
+
+
+def build_vital_data_context_compact(vital_data: Dict) -> str:
+    """バイタルデータのコンテキスト（コンパクト形式: セクション見出しなしの1行）"""
+    return VITAL_COMPACT(", ".join([f"{label} {value}" for _, label, value in iter_vital_metrics(vital_data)]))
+
+
+def build_gene_data_context(gene_data: Dict) -> str:
+    """
+    遺伝子データのコンテキスト（2段階抽出対応 + 自動検出対応）
+
+    markers は辞書（自動検出形式: 単一マーカー）または配列（従来形式: 複数マーカー）。
+    2段階抽出: 第1段階はメタデータ（title）のみ、第2段階は genotypes / impact を含む。
+    カテゴリーとSNPはキー順に並べる（クライアントの辞書の順序に依存しない）。
+    SNPが千件単位になりうるため、ジェネレーターではなく1つのリストに追加してから連結する。
+    """
+    parts = [GENE_HEADER]
+    append = parts.append
+    has_data = False
+
+    for category, markers in sorted(gene_data.items()):
+        if not markers:
+            append(GENE_CATEGORY_EMPTY(category))
+            continue
+
+        append(GENE_CATEGORY(category))
+        has_data = True
+
+        # 自動検出形式（辞書1件、titleがなければカテゴリー名）と従来形式（配列）を同じ処理で描画
+        if isinstance(markers, dict):
+            marker_list, default_title = (markers,), category
+        elif isinstance(markers, list):
+            marker_list, default_title = markers, ''
+        else:
+            # 予期しない形式
+            append(GENE_UNKNOWN_FORMAT(type(markers).__name__))
+            continue
+
+        for marker in marker_list:
+            append(f"  - {marker.get('title', default_title)}")
+            if 'impact_level' in marker:
+                # サニタイズ済み（pii_sanitizer.sanitize_gene_data。SNP・遺伝子型は除去済み）
+                append(_sanitized_score_line(marker['impact_level'], marker.get('score_level')))
+                continue
+            if 'genotypes' not in marker:
+                continue
+
+            genotypes = marker.get('genotypes') or {}
+            for snp_id in sorted(genotypes):
+                append(f"    {snp_id}: {genotypes[snp_id]}")
+
+            # 影響スコアがある場合は表示
+            impact = marker.get('impact')
+            if impact:
+                append(
+                    f"    影響: 保護{impact.get('protective', 0)}/リスク{impact.get('risk', 0)}"
+                    f"/中立{impact.get('neutral', 0)} (スコア: {impact.get('score', 0):+d})"
+                )
+
+    # 全カテゴリーが空の場合の明示的なエラーメッセージ
+    if not has_data:
+        return GENE_NOT_FOUND
+
+    return "\n".join(parts)
+
+
+def _sanitized_score_line(score, score_level: Optional[str]) -> str:
+    if score_level:
+        return f"    影響スコア: {score or 0:+} ({score_level})"
+    return f"    影響スコア: {score or 0:+}"
+
+
+class GeneMarker(NamedTuple):
+    """
+    遺伝子マーカー1件（辞書形式・配列形式、サニタイズ前後を共通化したもの）
+
+    サニタイズ済みのマーカーは genotypes が空、impact は {"score": impact_level}、
+    score_level が文字列（サニタイズ前は None）。
+    """
+    category: str
+    title: str
+    genotypes: Dict
+    impact: Dict
+    score_level: Optional[str] = None
+
+
+def _iter_gene_markers(gene_data: Dict) -> Iterator[GeneMarker]:
+    """辞書形式・配列形式のマーカーを同じ形で返す（空・不明な形式のカテゴリーは除く）"""
+    for category, markers in gene_data.items():
+        if isinstance(markers, dict):
+            marker_list, default_title = ((markers,) if markers else ()), category
+        elif isinstance(markers, list):
+            marker_list, default_title = markers, ''
+        else:
+            continue
+        for marker in marker_list:
+            if 'impact_level' in marker:
+                yield GeneMarker(
+                    category,
+                    marker.get('title', default_title),
+                    {},
+                    {'score': marker['impact_level'] or 0},
+                    marker.get('score_level') or ''
+                )
+            else:
+                yield GeneMarker(
+                    category,
+                    marker.get('title', default_title),
+                    marker.get('genotypes') or {},
+                    marker.get('impact') or {}
+                )
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def rank_gene_markers(markers: List[GeneMarker], query: str = "") -> List[GeneMarker]:
+    """
+    マーカーを関連度の高い順に並べる
+
+    1. 質問とカテゴリーが同じ健康ドメイン（intent_router。「お酒」と「アルコール代謝」など言い換えに対応）
+       + 質問とカテゴリー名・タイトルの共通の2文字（日本語でも分かち書き不要）
+    2. リスク因子の数
+    3. 影響スコアの絶対値
+    （同順位はカテゴリー名・タイトル順）
+    """
+    # intent_router は context_renderer を読み込むため、ここで読み込む
+    from intent_router import classify_domains
+
+    query_bigrams = _bigrams(query) if query else set()
+    query_domains = set(classify_domains(query)) if query else set()
+    # ドメインはカテゴリー名で判定する（マーカーが千件単位でもカテゴリーは数十件）
+    shared_domains: Dict[str, int] = {}
+
+    def relevance(marker: GeneMarker) -> int:
+        if not query_bigrams:
+            return 0
+        if marker.category not in shared_domains:
+            shared_domains[marker.category] = (
+                len(query_domains & set(classify_domains(marker.category))) if query_domains else 0
+            )
+        return shared_domains[marker.category] * 2 + len(query_bigrams & _bigrams(marker.category + marker.title))
+
+    def sort_key(marker: GeneMarker):
+        return (
+            -relevance(marker),
+            -(marker.impact.get('risk') or 0),
+            -abs(marker.impact.get('score') or 0),
+            marker.category,
+            marker.title,
+        )
+
+    return sorted(markers, key=sort_key)
+
+
+def _gene_marker_summary_lines(marker: GeneMarker, snp_limit: int) -> List[str]:
+    """マーカー1件の要約（SNP件数・影響の集計 + 上限までのSNP行）"""
+    genotypes = marker.genotypes
+    lines = [f"  - {marker.title}（SNP {len(genotypes)}件）" if genotypes else f"  - {marker.title}"]
+    impact = marker.impact
+    if marker.score_level is not None:
+        lines.append(_sanitized_score_line(impact.get('score'), marker.score_level))
+    elif impact:
+        lines.append(
+            f"    影響: 保護{impact.get('protective', 0)}/リスク{impact.get('risk', 0)}"
+            f"/中立{impact.get('neutral', 0)} (スコア: {impact.get('score', 0):+d})"
+        )
+    snp_ids = sorted(genotypes)
+    lines.extend([f"    {snp_id}: {genotypes[snp_id]}" for snp_id in snp_ids[:snp_limit]])
+    if len(snp_ids) > snp_limit:
+        lines.append(GENE_SNPS_OMITTED(count=len(snp_ids) - snp_limit))
+    return lines
+
+
+def gene_context_within_bounds(
+    gene_data: Dict,
+    full_context: str,
+    max_chars: int = GENE_CONTEXT_MAX_CHARS,
+    snps_per_category: int = GENE_SNPS_PER_CATEGORY
+) -> bool:
+    """
+    build_gene_data_context() の出力（full_context）がそのまま上限内に収まるか
+
+    収まらない場合だけ build_gene_data_summary_context() で要約する。
+    """
+    if len(full_context) > max_chars:
+        return False
+    snp_counts: Dict[str, int] = {}
+    for marker in _iter_gene_markers(gene_data):
+        snp_counts[marker.category] = snp_counts.get(marker.category, 0) + len(marker.genotypes)
+    return all(count <= snps_per_category for count in snp_counts.values())
+
+
+def build_gene_data_context_bounded(
+    gene_data: Dict,
+    query: str = "",
+    max_chars: int = GENE_CONTEXT_MAX_CHARS,
+    snps_per_category: int = GENE_SNPS_PER_CATEGORY
+) -> str:
+    """
+    遺伝子データのコンテキスト（サイズ上限付き）
+
+    上限内に収まる場合は build_gene_data_context() と同じ出力。超える場合は:
+    - マーカーごとに SNP件数と影響（保護/リスク/中立・スコア）を要約
+      （サニタイズ済みのマーカーはタイトルと影響スコアのみ）
+    - SNP行はカテゴリーあたり snps_per_category 件まで（関連度の高いマーカーから割り当て）
+    - マーカーは質問との関連度順に追加し、max_chars を超える前に打ち切る（省略件数を明記）
+    → 出力は最大で max_chars + 省略注記1行に収まる
+
+    Args:
+        query: ユーザーの質問（マーカーの並び順に使う）
+        max_chars: 出力の文字数の上限の目安
+        snps_per_category: カテゴリーあたりのSNP行数の上限
+    """
+    full = build_gene_data_context(gene_data)
+    if gene_context_within_bounds(gene_data, full, max_chars, snps_per_category):
+        return full
+    return build_gene_data_summary_context(gene_data, query, max_chars, snps_per_category)
+
+
+def build_gene_data_summary_context(
+    gene_data: Dict,
+    query: str = "",
+    max_chars: int = GENE_CONTEXT_MAX_CHARS,
+    snps_per_category: int = GENE_SNPS_PER_CATEGORY
+) -> str:
+    """
+    build_gene_data_context_bounded() の要約部分（上限を超えることが分かっている場合に使う）
+
+    呼び出し側が build_gene_data_context() の出力を描画済みで、gene_context_within_bounds() で
+    上限を超えると判定した後に呼ぶ（全体の描画を繰り返さない）。
+    """
+    markers = list(_iter_gene_markers(gene_data))
+
+    # データのないカテゴリーはそのことだけを伝える（1行）
+    blocks: Dict[str, List[List[str]]] = {
+        category: [] for category, category_markers in gene_data.items() if not category_markers
+    }
+    used_chars = len(GENE_HEADER) + sum(len(GENE_CATEGORY_EMPTY(category)) + 1 for category in blocks)
+    omitted = 0
+
+    # カテゴリーごとのSNP行の残り枠を、関連度の高いマーカーから割り当てる
+    snp_budget = {category: snps_per_category for category in gene_data}
+    for marker in rank_gene_markers(markers, query):
+        # タイトル行（"  - {title}\n"）だけでも入らないマーカーは要約を組み立てずに省略
+        if used_chars + len(marker.title) + 5 > max_chars:
+            omitted += 1
+            continue
+        limit = min(len(marker.genotypes), snp_budget[marker.category])
+        lines = _gene_marker_summary_lines(marker, limit)
+        block_chars = sum(len(line) + 1 for line in lines)
+        header_chars = 0 if marker.category in blocks else len(GENE_CATEGORY(marker.category)) + 1
+        if used_chars + header_chars + block_chars > max_chars:
+            omitted += 1
+            continue
+        snp_budget[marker.category] -= limit
+        used_chars += header_chars + block_chars
+        blocks.setdefault(marker.category, []).append(lines)
+
+    parts = [GENE_HEADER]
+    for category in sorted(blocks):
+        if not blocks[category]:
+            parts.append(GENE_CATEGORY_EMPTY(category))
+            continue
+        parts.append(GENE_CATEGORY(category))
+        for lines in blocks[category]:
+            parts.extend(lines)
+    if omitted:
+        parts.append(GENE_MARKERS_OMITTED(count=omitted))
+    return "\n".join(parts)
+
+
+def _extend_available_categories(parts: List[str], available_categories: Iterable[str]) -> None:
+    parts.append(GENE_CATEGORIES_INTRO)
+    parts.extend([f"- {category}" for category in available_categories])
+    parts.append(GENE_CATEGORIES_FOOTER)
+
+
+def build_available_categories_context(available_categories: List[str]) -> str:
+    """利用可能な遺伝子カテゴリーのコンテキスト"""
+    parts = [GENE_CATEGORIES_HEADER]
+    _extend_available_categories(parts, available_categories)
+    return "\n".join(parts)
+
+
+def build_initial_context(blood_data: Optional[List[Dict]], available_gene_categories: List[str]) -> str:
+    """初回メッセージのコンテキスト（血液データ: 正常項目は件数のみ + 遺伝子カテゴリーリスト）"""
+    parts: List[str] = []
+
+    if blood_data:
+        panel = classify_blood_items(blood_data)
+        parts.append(BLOOD_HEADER)
+        _extend_blood_section(parts, BLOOD_ABNORMAL_HEADER, panel.abnormal)
+        _extend_blood_section(parts, BLOOD_ATTENTION_HEADER, panel.attention)
+        if panel.normal:
+            parts.append(BLOOD_NORMAL_SUMMARY(count=len(panel.normal)))
+
+    if available_gene_categories:
+        parts.append("\n\n" + GENE_CATEGORIES_HEADER)
+        _extend_available_categories(parts, available_gene_categories)
+
+    return "\n".join(parts)
@@ -0,0 +1,297 @@
+"""
+conversation_store.py - サーバー側の会話セッション保存
+
+クライアントが毎回会話履歴・血液/バイタル/遺伝子データを全量送信しなくて済むよう、
+サニタイズ済みの会話履歴と描画済みのデータコンテキストをサーバー側に保持する。
+- 永続化: DynamoDB（TTL属性 expiresAt で自動削除）
+- キャッシュ: インプロセスLRU（ウォームスタート時はDynamoDBの読み込みを省略）
+- ローカル/テスト用: InMemoryConversationBackend（DynamoDBの代替）
+
+DynamoDBテーブル:
+- パーティションキー: conversationId (String)
+- TTL属性: expiresAt (Number, epoch秒)
+
+DynamoDBの1アイテム上限は400KB（UTF-8のバイト数）。日本語は1文字3バイトのため、
+保存する履歴は件数ではなくシリアライズ後のバイト数で制限する（古いメッセージから削る）。
+"""
+
+import json
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from lru_cache import LRUCache
+from structured_logging import log_warning
+
+CONVERSATION_TABLE = os.environ.get('CONVERSATION_TABLE', '')
+CONVERSATION_TTL_SECONDS = int(os.environ.get('CONVERSATION_TTL_SECONDS', str(7 * 24 * 3600)))
+# 保存する履歴の最大件数
+CONVERSATION_MAX_MESSAGES = int(os.environ.get('CONVERSATION_MAX_MESSAGES', '200'))
+# 1アイテムに保存する履歴 + コンテキストのバイト数の上限（DynamoDBの400KBから属性名等の余裕を引いた値）
+CONVERSATION_MAX_ITEM_BYTES = int(os.environ.get('CONVERSATION_MAX_ITEM_BYTES', '360000'))
+# DynamoDBの1アイテム上限（InMemoryConversationBackend も同じ上限で拒否する）
+DYNAMODB_ITEM_LIMIT_BYTES = 400 * 1024
+
+
+class ConversationConflictError(Exception):
+    """別のインスタンスが先にセッションを更新した（楽観ロック失敗）"""
+
+
+class ConversationItemTooLargeError(Exception):
+    """セッションがDynamoDBの1アイテム上限を超えたため保存できない"""
+
+
+def _json_bytes(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def fit_history(history: List[Dict], contexts: Dict[str, str], max_bytes: int = CONVERSATION_MAX_ITEM_BYTES) -> List[Dict]:
+    """
+    履歴 + コンテキストのシリアライズ後のバイト数が max_bytes 以下になるまで古いメッセージを削る
+
+    削った後の先頭がアシスタントの応答にならないよう、ターン（ユーザー発言）の境界まで削る。
+    コンテキストだけで上限を超える場合は空の履歴を返す。
+    """
+    # "[" + メッセージ（","区切り） + "]"
+    sizes = [_json_bytes(message) + 1 for message in history]
+    total = _json_bytes(contexts) + 1 + sum(sizes)
+    start = 0
+    while total > max_bytes and start < len(history):
+        total -= sizes[start]
+        start += 1
+    if start:
+        while start < len(history) and history[start].get("role") != "user":
+            start += 1
+    return history[start:]
+
+
+class InMemoryConversationBackend:
+    """DynamoDBの代わりに使うインメモリのバックエンド（ローカル実行・テスト用）"""
+
+    def __init__(self):
+        self._items: Dict[str, str] = {}
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        raw = self._items.get(conversation_id)
+        if raw is None:
+            return None
+        item = json.loads(raw)
+        if item.get("expiresAt", 0) < time.time():
+            # DynamoDBのTTL削除相当
+            del self._items[conversation_id]
+            return None
+        return item
+
+    def put(self, item: Dict, expected_version: Optional[int]) -> None:
+        current = self._items.get(item["conversationId"])
+        current = json.loads(current) if current else None
+        if current is not None and current.get("expiresAt", 0) < time.time():
+            # 期限切れ（TTL削除待ち）は存在しないものとして上書きする
+            current = None
+        current_version = current["version"] if current else None
+        if current_version != expected_version:
+            raise ConversationConflictError(item["conversationId"])
+        raw = json.dumps(item, ensure_ascii=False)
+        if len(raw.encode("utf-8")) > DYNAMODB_ITEM_LIMIT_BYTES:
+            raise ConversationItemTooLargeError(item["conversationId"])
+        # DynamoDBと同様に値としてコピーを保存
+        self._items[item["conversationId"]] = raw
+
+
+class DynamoDBConversationBackend:
+    """DynamoDBテーブルをバックエンドにする"""
+
+    def __init__(self, table_name: str, region_name: str = 'ap-northeast-1'):
+        import boto3
+        self.table = boto3.resource('dynamodb', region_name=region_name).Table(table_name)
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        response = self.table.get_item(
+            Key={"conversationId": conversation_id},
+            ConsistentRead=True
+        )
+        item = response.get("Item")
+        if not item:
+            return None
+        # TTL削除は遅延するため期限切れは自前で除外
+        if int(item.get("expiresAt", 0)) < time.time():
+            return None
+        return {
+            "conversationId": item["conversationId"],
+            "userToken": item.get("userToken", ""),
+            "version": int(item.get("version", 0)),
+            "expiresAt": int(item.get("expiresAt", 0)),
+            "history": json.loads(item.get("history", "[]")),
+            "contexts": json.loads(item.get("contexts", "{}")),
+        }
+
+    def put(self, item: Dict, expected_version: Optional[int]) -> None:
+        from botocore.exceptions import ClientError
+
+        record = {
+            "conversationId": item["conversationId"],
+            "userToken": item["userToken"],
+            "version": item["version"],
+            "expiresAt": item["expiresAt"],
+            # 入れ子のリスト/辞書はJSON文字列として保存（Decimal変換を避ける）
+            "history": json.dumps(item["history"], ensure_ascii=False),
+            "contexts": json.dumps(item["contexts"], ensure_ascii=False),
+        }
+        if expected_version is None:
+            # TTL削除は数日遅れることがあるため、期限切れのアイテムは上書きしてよい
+            condition = "attribute_not_exists(conversationId) OR expiresAt < :now"
+            values = {":now": int(time.time())}
+        else:
+            condition = "version = :expected"
+            values = {":expected": expected_version}
+
+        kwargs = {"Item": record, "ConditionExpression": condition}
+        if values:
+            kwargs["ExpressionAttributeValues"] = values
+        try:
+            self.table.put_item(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise ConversationConflictError(item["conversationId"]) from e
+            if e.response["Error"]["Code"] == "ValidationException" and "size" in e.response["Error"].get("Message", ""):
+                # "Item size has exceeded the maximum allowed size"
+                raise ConversationItemTooLargeError(item["conversationId"]) from e
+            raise
+
+
+class ConversationStore:
+    """
+    会話セッションの読み書き
+
+    セッション:
+    {
+        "conversationId": str,
+        "userToken": str,        # 匿名化済みユーザートークン（所有者チェック用）
+        "version": int,          # 楽観ロック用
+        "expiresAt": int,
+        "history": [{"role", "content"}, ...],   # サニタイズ済み
+        "contexts": {"blood": str, "vital": str, "gene": str}  # 描画済み
+    }
+    """
+
+    def __init__(self, backend=None, cache_size: int = 128, ttl_seconds: int = CONVERSATION_TTL_SECONDS):
+        self.backend = backend if backend is not None else InMemoryConversationBackend()
+        self.cache = LRUCache(max_size=cache_size)
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def new_conversation_id() -> str:
+        return uuid.uuid4().hex
+
+    def new_session(self, conversation_id: str, user_token: str) -> Dict:
+        """未保存の新規セッション（version=None）"""
+        return {
+            "conversationId": conversation_id,
+            "userToken": user_token,
+            "version": None,
+            "expiresAt": 0,
+            "history": [],
+            "contexts": {},
+        }
+
+    def load(
+        self,
+        conversation_id: str,
+        user_token: str,
+        expected_length: Optional[int] = None,
+        accepted_tokens: Optional[List[str]] = None
+    ) -> Optional[Dict]:
+        """
+        セッションを取得（他ユーザーのセッション・期限切れはNone）
+
+        Args:
+            expected_length: クライアントが把握している履歴件数。
+                LRUのセッションと食い違う場合（別インスタンスが更新した場合）はDynamoDBから再読み込み
+            accepted_tokens: user_token 以外に所有者として受け入れるトークン（ソルトのローテーション中の旧トークン）。
+                旧トークンで保存されたセッションは user_token に付け替えて返す（次回保存時に移行）
+        """
+        session = self.cache.get(conversation_id)
+        if session is not None:
+            stale = expected_length is not None and len(session["history"]) != expected_length
+            if session["expiresAt"] < time.time() or stale:
+                session = None
+
+        if session is None:
+            session = self.backend.get(conversation_id)
+            if session is None:
+                return None
+            self.cache.put(conversation_id, session)
+
+        if session["userToken"] != user_token:
+            if session["userToken"] not in (accepted_tokens or []):
+                return None
+            session = {**session, "userToken": user_token}
+        return session
+
+    def save(
+        self,
+        session: Dict,
+        new_messages: List[Dict],
+        contexts: Optional[Dict[str, str]] = None,
+        accepted_tokens: Optional[List[str]] = None
+    ) -> Dict:
+        """
+        会話履歴にメッセージを追加して保存
+
+        別インスタンスと競合した場合は最新を読み直して1回だけ再適用する。
+        履歴は CONVERSATION_MAX_MESSAGES 件・CONVERSATION_MAX_ITEM_BYTES バイトに収まるよう古いものから削る。
+
+        Args:
+            accepted_tokens: session["userToken"] 以外に所有者として受け入れるトークン（load() と同じ）
+
+        Raises:
+            ConversationConflictError: 再適用でも競合した場合、または読み直したセッションが他ユーザーのものだった場合
+            ConversationItemTooLargeError: 履歴を削ってもアイテムの上限を超える場合（コンテキストが大きすぎる）
+        """
+        for attempt in range(2):
+            session_contexts = contexts if contexts is not None else session["contexts"]
+            history = (session["history"] + new_messages)[-CONVERSATION_MAX_MESSAGES:]
+            history = fit_history(history, session_contexts)
+            updated = {
+                "conversationId": session["conversationId"],
+                "userToken": session["userToken"],
+                "version": (session["version"] or 0) + 1,
+                "expiresAt": int(time.time()) + self.ttl_seconds,
+                "history": history,
+                "contexts": session_contexts,
+            }
+            try:
+                self.backend.put(updated, expected_version=session["version"])
+                self.cache.put(updated["conversationId"], updated)
+                return updated
+            except ConversationConflictError:
+                if attempt > 0:
+                    raise
+                log_warning("conversation updated elsewhere, reloading", conversationId=session['conversationId'])
+                latest = self.backend.get(session["conversationId"])
+                if latest is None:
+                    session = self.new_session(session["conversationId"], session["userToken"])
+                elif latest["userToken"] == session["userToken"] or latest["userToken"] in (accepted_tokens or []):
+                    session = {**latest, "userToken": session["userToken"]}
+                else:
+                    # 他ユーザーのセッションには追記しない
+                    log_warning("conversation owned by another user", conversationId=session['conversationId'])
+                    raise
+        return session
+
+
+_default_store: Optional[ConversationStore] = None
+
+
+def get_conversation_store() -> ConversationStore:
+    """
+    モジュール共通のストア（ウォームスタート間でLRUを再利用）
+
+    CONVERSATION_TABLE が未設定の場合はインメモリのバックエンドを使う。
+    """
+    global _default_store
+    if _default_store is None:
+        backend = DynamoDBConversationBackend(CONVERSATION_TABLE) if CONVERSATION_TABLE else None
+        _default_store = ConversationStore(backend=backend)
+    return _default_store
@@ -0,0 +1,315 @@
+"""
+hedging.py - OpenAI呼び出しのヘッジ（テールレイテンシ対策）
+
+最初のトークンが閾値までに届かない場合に2本目のリクエストを送り、先にトークンが届いた方を使う。
+- 閾値はこのインスタンスで観測した最初のトークンまでの時間のパーセンタイル
+  （件数が足りないうちは OPENAI_HEDGE_DELAY_MS）。p95 なら平常時のヘッジ率は約5%
+- 2本目は OPENAI_HEDGE_MODEL（未設定時は同じモデル）に送る
+- 勝敗が決まった時点で、負けた側の最初のトークン待ちを中断する（接続のソケットを shutdown。
+  prime_stream() が実行中の試行にストリームを登録しておく）。ストリームを閉じるのは
+  読み込んでいたワーカースレッド自身（別スレッドから閉じると競合するため）
+- 各リクエストのタイムアウトは呼び出し側で指定する（retry_scheduler.with_attempt_timeout()）
+- ワーカーはモジュール共通のスレッドプール（ウォームスタート間で再利用。
+  slim_openai_client はスレッドごとにkeep-aliveのコネクションを持つ）
+- メトリクス: openaiHedged（0/1、Averageがヘッジ率）、openaiHedgeWon（0/1、2本目が勝った割合）、
+  openaiHedgeDelay（ヘッジした場合の閾値、ms）
+
+使い方:
+    stream = hedged_call(lambda model: prime_stream(client.chat.completions.create(model=model, stream=True, ...)), model)
+"""
+
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from instrumentation import record_count, record_timing
+from structured_logging import current_request, log_info
+
+OPENAI_HEDGE_ENABLED = os.environ.get('OPENAI_HEDGE_ENABLED', 'false').lower() == 'true'
+# 観測値が足りないうちの閾値（ms）
+OPENAI_HEDGE_DELAY_MS = float(os.environ.get('OPENAI_HEDGE_DELAY_MS', '3000'))
+# 閾値の下限（ms）。キャッシュが効いて観測値が小さくなってもヘッジを乱発しない
+OPENAI_HEDGE_MIN_DELAY_MS = float(os.environ.get('OPENAI_HEDGE_MIN_DELAY_MS', '1000'))
+OPENAI_HEDGE_PERCENTILE = float(os.environ.get('OPENAI_HEDGE_PERCENTILE', '95'))
+# パーセンタイルを使い始める観測件数
+OPENAI_HEDGE_MIN_SAMPLES = int(os.environ.get('OPENAI_HEDGE_MIN_SAMPLES', '20'))
+OPENAI_HEDGE_WINDOW_SIZE = int(os.environ.get('OPENAI_HEDGE_WINDOW_SIZE', '200'))
+# 2本目の送り先（未設定時は1本目と同じモデル）
+OPENAI_HEDGE_MODEL = os.environ.get('OPENAI_HEDGE_MODEL', '')
+
+# 負けた側が中断・クローズを終える前に次のリクエストが来ても足りる数
+HEDGE_MAX_WORKERS = 4
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+
+class LatencyWindow:
+    """直近の最初のトークンまでの時間（ms）"""
+
+    def __init__(self, size: int = OPENAI_HEDGE_WINDOW_SIZE):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self._samples.append(elapsed_ms)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class HedgePolicy:
+    """ヘッジするかどうかと閾値・2本目のモデル"""
+
+    def __init__(
+        self,
+        enabled: bool = OPENAI_HEDGE_ENABLED,
+        delay_ms: float = OPENAI_HEDGE_DELAY_MS,
+        min_delay_ms: float = OPENAI_HEDGE_MIN_DELAY_MS,
+        percentile: float = OPENAI_HEDGE_PERCENTILE,
+        min_samples: int = OPENAI_HEDGE_MIN_SAMPLES,
+        hedge_model: str = OPENAI_HEDGE_MODEL
+    ):
+        self.enabled = enabled
+        self.delay_ms = delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.hedge_model = hedge_model
+
+    def threshold_ms(self, window: LatencyWindow) -> float:
+        if len(window) < self.min_samples:
+            return self.delay_ms
+        return max(self.min_delay_ms, window.percentile(self.percentile))
+
+    def model_for_hedge(self, model: str) -> str:
+        return self.hedge_model or model
+
+
+_window = LatencyWindow()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """ヘッジ用のスレッドプール（初回使用時に作成）"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="openai-hedge")
+    return _executor
+
+
+def close_quietly(result: Any) -> None:
+    """負けた側の結果を破棄（ストリームなら閉じる）"""
+    close = getattr(result, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+
+def abort_stream(stream) -> None:
+    """
+    別スレッドが読み込み中のストリームを中断する（読み込み側は接続エラーになる）
+
+    slim_openai_client の EventStream は abort()、openai SDK の Stream は
+    httpx のレスポンスが持つソケット（network_stream 拡張）を shutdown する。
+    """
+    abort = getattr(stream, 'abort', None)
+    try:
+        if abort is not None:
+            abort()
+            return
+        extensions = getattr(getattr(stream, 'response', None), 'extensions', None) or {}
+        network_stream = extensions.get('network_stream')
+        sock = network_stream.get_extra_info('socket') if network_stream is not None else None
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+
+
+class _Attempt:
+    """ヘッジの1本分（最初のトークン待ちのストリームを、勝敗が決まったら中断する）"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self._lock = threading.Lock()
+        self._stream: Any = None
+        self.cancelled = False
+
+    def register(self, stream) -> None:
+        with self._lock:
+            self._stream = stream
+            cancelled = self.cancelled
+        if cancelled:
+            abort_stream(stream)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            stream = self._stream
+        if stream is not None:
+            abort_stream(stream)
+
+
+# ワーカースレッドで実行中の試行（prime_stream() がストリームを登録する）
+_current = threading.local()
+
+
+class PrimedStream:
+    """最初のテキストまで読み進めたストリーム（読み込んだチャンクを先頭に戻して反復できる）"""
+
+    def __init__(self, stream, buffered: List[Any], iterator: Iterator[Any]):
+        self._stream = stream
+        self._buffered = buffered
+        self._iterator = iterator
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from self._buffered
+        self._buffered = []
+        yield from self._iterator
+
+    def close(self) -> None:
+        for target in (self._iterator, self._stream):
+            close = getattr(target, 'close', None)
+            if close is not None:
+                close()
+
+
+def prime_stream(stream) -> PrimedStream:
+    """
+    テキストを含む最初のチャンク（またはストリームの終わり）まで読む
+
+    role だけの先頭チャンクでは「最初のトークンが届いた」とみなさない。
+    ヘッジの試行中であれば、負けた場合に中断できるようストリームを登録する。
+    """
+    attempt = getattr(_current, 'attempt', None)
+    if attempt is not None:
+        attempt.register(stream)
+    iterator = iter(stream)
+    buffered = []
+    for chunk in iterator:
+        buffered.append(chunk)
+        if chunk.choices and chunk.choices[0].delta.content:
+            break
+    return PrimedStream(stream, buffered, iterator)
+
+
+class _Race:
+    """先に成功した方を採用する（負けた側は中断し、ワーカーが自分で閉じる）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+        self.started = 0
+        self.attempts: List[_Attempt] = []
+        self.winner: Optional[str] = None
+        self.result: Any = None
+        self.errors: List[Tuple[str, BaseException]] = []
+        self.started_at = time.perf_counter()
+
+    def launch(self, label: str, fn: Callable[[], Any]) -> bool:
+        with self._lock:
+            if self.done.is_set():
+                return False
+            self.started += 1
+            attempt = _Attempt(label)
+            self.attempts.append(attempt)
+        get_executor().submit(self._run, attempt, fn)
+        return True
+
+    def _run(self, attempt: _Attempt, fn: Callable[[], Any]) -> None:
+        _current.attempt = attempt
+        try:
+            result = fn()
+        except Exception as e:
+            with self._lock:
+                self.errors.append((attempt.label, e))
+                if len(self.errors) >= self.started:
+                    self.done.set()
+            return
+        finally:
+            _current.attempt = None
+
+        with self._lock:
+            won = self.winner is None
+            if won:
+                self.winner = attempt.label
+                self.result = result
+                self.done.set()
+                losers = [other for other in self.attempts if other is not attempt]
+        if not won:
+            close_quietly(result)
+            return
+        # 負けた側の最初のトークン待ちを中断（ワーカーを空け、接続を残さない）
+        for loser in losers:
+            loser.cancel()
+
+
+def hedged_call(
+    start: Callable[[str], Any],
+    model: str,
+    policy: Optional[HedgePolicy] = None,
+    window: Optional[LatencyWindow] = None,
+    operation: str = "chat_stream"
+) -> Any:
+    """
+    start(model) をヘッジ付きで呼び出す
+
+    start は最初のトークンが届くまでブロックして結果を返す関数（prime_stream() を通したストリーム）。
+    両方失敗した場合は1本目の例外をraiseする（リトライは呼び出し側の call_with_retry）。
+
+    Args:
+        start: モデル名を受け取って1回分の呼び出しを行う関数
+        model: 1本目のモデル
+        policy: ヘッジ方針（省略時は環境変数の設定。無効なら start(model) をそのまま呼ぶ）
+        window: 閾値を求める観測値（省略時はモジュール共通）
+    """
+    policy = policy or HedgePolicy()
+    if not policy.enabled:
+        return start(model)
+    window = _window if window is None else window
+
+    threshold_ms = policy.threshold_ms(window)
+    race = _Race()
+    race.launch(PRIMARY, lambda: start(model))
+
+    hedged = False
+    hedge_model = policy.model_for_hedge(model)
+    if not race.done.wait(threshold_ms / 1000):
+        hedged = race.launch(HEDGE, lambda: start(hedge_model))
+        if hedged:
+            log_info("hedging OpenAI call", operation=operation, thresholdMs=round(threshold_ms), hedgeModel=hedge_model)
+    race.done.wait()
+
+    elapsed_ms = (time.perf_counter() - race.started_at) * 1000
+    record_count("openaiHedged", 1 if hedged else 0)
+    if hedged:
+        record_count("openaiHedgeWon", 1 if race.winner == HEDGE else 0)
+        record_timing("openaiHedgeDelay", threshold_ms)
+    request_log = current_request()
+    if request_log is not None and hedged:
+        request_log.set(openaiHedged=True, openaiHedgeWinner=race.winner)
+
+    if race.winner is None:
+        errors = dict(race.errors)
+        raise errors.get(PRIMARY) or errors[HEDGE]
+
+    # ヘッジで2本目が勝った場合、1本目の実際の時間は elapsed_ms 以上（下限として記録）
+    window.add(elapsed_ms)
+    return race.result
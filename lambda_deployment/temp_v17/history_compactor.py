@@ -0,0 +1,177 @@
+"""
+history_compactor.py - 会話履歴のトークン予算管理
+
+長い会話でプロンプトが線形に増え続けないよう、会話履歴をトークン上限内に収める。
+- 直近のターンはそのまま保持
+- それより古いターンは要約（ローリングサマリー）1件に置き換え
+- 要約は「要約したプレフィックスのハッシュ」をキーにキャッシュし、
+  次のターンでは前回の要約に差分だけを追記する
+"""
+
+import hashlib
+import os
+from typing import Callable, Dict, List, Optional
+
+from lru_cache import LRUCache
+from structured_logging import log_info
+from token_counter import count_message_tokens, count_text_tokens
+
+# 会話履歴に使えるトークン数の上限
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', '6000'))
+# 上限のうち要約に割り当てる割合
+HISTORY_SUMMARY_RATIO = float(os.environ.get('HISTORY_SUMMARY_RATIO', '0.25'))
+
+SUMMARY_HEADER = "【これまでの会話の要約】"
+
+# 要約器: (前回までの要約, 新たに要約へ含めるメッセージ) -> 要約本文
+Summarizer = Callable[[Optional[str], List[Dict]], str]
+
+
+def extractive_summarizer(previous_summary: Optional[str], messages: List[Dict]) -> str:
+    """
+    追加のAPI呼び出しなしで作る抽出型の要約
+
+    各メッセージの先頭行（見出し）を短く切り詰めて1行ずつ並べる。
+    """
+    lines = previous_summary.split('\n') if previous_summary else []
+    for msg in messages:
+        content = (msg.get("content") or "").strip()
+        if not content:
+            continue
+        head = next((line.strip() for line in content.split('\n') if line.strip()), "")
+        if len(head) > 80:
+            head = head[:80] + "…"
+        speaker = "ユーザー" if msg.get("role") == "user" else "AI"
+        lines.append(f"- {speaker}: {head}")
+    return '\n'.join(lines)
+
+
+class HistoryCompactor:
+    """会話履歴をトークン上限内に収める"""
+
+    def __init__(
+        self,
+        max_tokens: int = HISTORY_TOKEN_BUDGET,
+        summary_ratio: float = HISTORY_SUMMARY_RATIO,
+        summarizer: Summarizer = extractive_summarizer,
+        cache_size: int = 512
+    ):
+        self.max_tokens = max_tokens
+        self.summary_budget = int(max_tokens * summary_ratio)
+        self.summarizer = summarizer
+        # key: 要約済みプレフィックスのハッシュ, value: 要約本文
+        self.summary_cache = LRUCache(max_size=cache_size)
+
+    def compact(self, history: List[Dict]) -> List[Dict]:
+        """
+        会話履歴を上限内に収めて返す
+
+        上限内であればそのまま返す。超える場合は
+        [要約(system)] + 直近のメッセージ（そのまま）に置き換える。
+        """
+        if not history:
+            return []
+
+        token_counts = [count_message_tokens(msg) for msg in history]
+        if sum(token_counts) <= self.max_tokens:
+            return history
+
+        # 直近のメッセージから、要約枠を除いた予算に収まるだけ残す
+        recent_budget = self.max_tokens - self.summary_budget
+        used = 0
+        split_index = len(history)
+        while split_index > 0 and used + token_counts[split_index - 1] <= recent_budget:
+            split_index -= 1
+            used += token_counts[split_index]
+
+        older = history[:split_index]
+        recent = history[split_index:]
+
+        summary = self._summarize_prefix(older)
+        summary_message = {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"}
+        summary_message["content"] = self._fit_summary(
+            summary_message, self.max_tokens - used
+        )
+
+        log_info(
+            "history compacted",
+            messages=len(history),
+            tokens=sum(token_counts),
+            summarizedMessages=len(older),
+            recentMessages=len(recent),
+            compactedTokens=used
+        )
+        return [summary_message] + recent
+
+    def _summarize_prefix(self, older: List[Dict]) -> str:
+        """
+        古いメッセージの要約を返す（キャッシュ済みの最長プレフィックスから差分だけ要約）
+        """
+        prefix_hashes = _prefix_hashes(older)
+        key = prefix_hashes[-1]
+
+        cached = self.summary_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # 前回ターンの要約（キャッシュにある最長のプレフィックス）を起点にする
+        start = 0
+        previous_summary = None
+        for index in range(len(older) - 1, 0, -1):
+            previous = self.summary_cache.peek(prefix_hashes[index - 1])
+            if previous is not None:
+                start = index
+                previous_summary = previous
+                break
+
+        summary = self.summarizer(previous_summary, older[start:])
+        self.summary_cache.put(key, summary)
+        return summary
+
+    def _fit_summary(self, summary_message: Dict, budget: int) -> str:
+        """要約が予算を超える場合は古い行から削る"""
+        content = summary_message["content"]
+        if count_message_tokens(summary_message) <= budget:
+            return content
+
+        header, _, body = content.partition('\n')
+        lines = body.split('\n')
+        overhead = count_message_tokens({"role": "system", "content": header}) + 1
+        kept: List[str] = []
+        used = overhead
+        for line in reversed(lines):
+            line_tokens = count_text_tokens(line) + 1
+            if used + line_tokens > budget:
+                break
+            kept.append(line)
+            used += line_tokens
+        kept.reverse()
+        return '\n'.join([header] + kept)
+
+
+def _prefix_hashes(messages: List[Dict]) -> List[str]:
+    """各プレフィックス messages[:i+1] のハッシュ（ハッシュチェーン）"""
+    hashes: List[str] = []
+    running = hashlib.sha256()
+    for msg in messages:
+        running.update((msg.get("role") or "").encode('utf-8'))
+        running.update(b'\x00')
+        running.update((msg.get("content") or "").encode('utf-8'))
+        running.update(b'\x1e')
+        hashes.append(running.copy().hexdigest())
+    return hashes
+
+
+_default_compactor: Optional[HistoryCompactor] = None
+
+
+def compact_history(history: List[Dict]) -> List[Dict]:
+    """
+    便利関数: モジュール共通のコンパクターで会話履歴を上限内に収める
+
+    要約キャッシュはウォームスタート間で再利用される。
+    """
+    global _default_compactor
+    if _default_compactor is None:
+        _default_compactor = HistoryCompactor()
+    return _default_compactor.compact(history)
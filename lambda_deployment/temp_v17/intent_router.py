@@ -0,0 +1,225 @@
+"""
+intent_router.py - 質問内容に応じたデータコンテキストの絞り込み
+
+ユーザーのメッセージをキーワードで健康ドメイン（SCORE_ENGINE_SPEC.md の4ドメイン）に分類し、
+そのドメインのスコアに使うメトリックだけをデータコンテキストに含める（プロンプト短縮）。
+- 分類はローカルのキーワード検索のみ（keyword_matcher、ネットワーク呼び出しなし）
+- 基準値外（注意・異常）の血液項目は質問に関係なく常に含める
+- ドメインを判定できない質問は絞り込まない（全項目を含める）
+- 絞り込むのは pii_sanitizer でサニタイズした後のデータ（血液項目は key を持たないため項目名で、
+  バイタルは has_* / *_level のフラグで判定する）
+- クライアントから contextScope で上書きできる:
+    "auto"（既定）/ "all"（絞り込まない）/ ["recovery", ...]（ドメインを指定）
+
+ドメイン → メトリックの対応は SCORE_ENGINE_SPEC.md と合わせること。
+"""
+
+import os
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from context_renderer import NORMAL_STATUSES
+from keyword_matcher import KeywordMatcher
+
+INTENT_ROUTING_ENABLED = os.environ.get('INTENT_ROUTING_ENABLED', 'true').lower() == 'true'
+
+# ドメイン → 血液検査メトリック / HealthKitメトリック（SCORE_ENGINE_SPEC.md「4つの健康ドメイン」）
+DOMAIN_METRICS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "metabolic": {
+        "blood": ("HbA1c", "TG", "HDL", "LDL"),
+        "healthkit": ("bmi", "vo2max", "activeCalories"),
+    },
+    "inflammation": {
+        "blood": ("CRP", "AST", "ALT", "GGT"),
+        "healthkit": ("hrv", "sleepHours"),
+    },
+    "recovery": {
+        "blood": ("CRP", "CK", "ferritin", "ALB"),
+        "healthkit": ("hrv", "rhr", "sleepHours"),
+    },
+    "aging": {
+        "blood": ("HbA1c", "CRP", "ALB", "CRE", "eGFR"),
+        "healthkit": ("hrv", "vo2max", "bmi"),
+    },
+}
+
+# 仕様書のスコアには使わないが、ドメインの質問に答えるのに必要な関連項目（同じ検査分類）
+DOMAIN_RELATED_BLOOD: Dict[str, Tuple[str, ...]] = {
+    "metabolic": ("FBG", "insulin", "TC", "nonHDL", "LH_ratio", "UA"),
+    "inflammation": ("ALP", "TBIL", "WBC"),
+    "recovery": ("LDH", "Hb", "RBC", "Ht"),
+    "aging": ("UA", "TP", "AG_ratio", "BUN"),
+}
+
+# 血液データのキーの別名（アプリ側のキー → 仕様書のID）
+BLOOD_KEY_ALIASES: Dict[str, str] = {
+    "fpg": "FBG",
+    "ins": "insulin",
+}
+
+# 血液項目の表示名（アプリの nameJp）→ アプリ側のキー（BloodTestService）
+# サニタイズ済みの血液項目は key を除去して name だけを持つため、項目名からキーを求める
+BLOOD_NAME_KEYS: Dict[str, str] = {
+    "ヘモグロビンA1c": "HbA1c",
+    "空腹時血糖": "FPG",
+    "中性脂肪": "TG",
+    "HDLコレステロール": "HDL",
+    "LDLコレステロール": "LDL",
+    "総コレステロール": "TC",
+    "C反応性タンパク": "CRP",
+    "AST(GOT)": "AST",
+    "ALT(GPT)": "ALT",
+    "γ-GTP": "GGT",
+    "ALP": "ALP",
+    "総蛋白": "TP",
+    "アルブミン": "ALB",
+    "尿素窒素": "BUN",
+    "クレアチニン": "CRE",
+    "尿酸": "UA",
+    "白血球数": "WBC",
+    "赤血球数": "RBC",
+    "ヘモグロビン": "Hb",
+    "ヘマトクリット": "Ht",
+    "血小板数": "PLT",
+    "クレアチンキナーゼ": "CK",
+    "乳酸脱水素酵素": "LDH",
+    "フェリチン": "Ferritin",
+    "インスリン": "INS",
+}
+
+# HealthKitメトリックID → サニタイズ済み vitalData のキー（pii_sanitizer.sanitize_vital_data）
+# 睡眠はサニタイズ後のデータに含まれないため対応するキーがない
+HEALTHKIT_VITAL_KEYS: Dict[str, Tuple[str, ...]] = {
+    "bmi": ("has_body_composition",),
+    "hrv": ("has_heart_data",),
+    "rhr": ("has_heart_data", "resting_hr_level"),
+    "vo2max": ("has_vo2max", "vo2max_level"),
+    "dailySteps": ("has_activity_data",),
+    "activeCalories": ("has_activity_data",),
+    "sleepHours": (),
+}
+
+# ドメイン判定のキーワード
+DOMAIN_KEYWORDS: Dict[str, List[str]] = {
+    "metabolic": [
+        "代謝", "血糖", "糖質", "糖尿", "炭水化物", "インスリン", "コレステロール", "中性脂肪",
+        "脂質", "体重", "ダイエット", "痩せ", "やせ", "太る", "太り", "太った", "肥満", "メタボ", "体脂肪", "カロリー",
+        "食事", "食べ", "ごはん", "食生活", "甘い", "間食",
+    ],
+    "inflammation": [
+        "炎症", "肝臓", "肝機能", "脂肪肝", "お酒", "飲酒", "アルコール", "免疫", "風邪",
+        "感染", "アレルギー", "腫れ", "肌荒れ", "ニキビ",
+    ],
+    "recovery": [
+        "回復", "疲れ", "疲労", "だるい", "倦怠", "睡眠", "眠", "寝", "不眠", "ストレス",
+        "筋肉", "筋トレ", "筋肉痛", "運動", "トレーニング", "ランニング", "貧血", "鉄分",
+    ],
+    "aging": [
+        "老化", "アンチエイジング", "エイジング", "加齢", "若返", "若さ", "寿命", "長生き",
+        "腎臓", "腎機能", "シワ", "しわ", "たるみ", "更年期",
+    ],
+}
+
+
+class IntentRoute(NamedTuple):
+    """分類結果（blood_keys は小文字化した血液項目のキー、vital_keys はサニタイズ済み vitalData のキー）"""
+    domains: Tuple[str, ...]
+    blood_keys: FrozenSet[str]
+    vital_keys: FrozenSet[str]
+    source: str  # "auto" / "override"
+
+
+_domain_matcher: Optional[KeywordMatcher] = None
+
+
+def get_domain_matcher() -> KeywordMatcher:
+    """ドメインキーワードの検索オートマトン（初回使用時に作成）"""
+    global _domain_matcher
+    if _domain_matcher is None:
+        _domain_matcher = KeywordMatcher.from_groups(DOMAIN_KEYWORDS)
+    return _domain_matcher
+
+
+def classify_domains(message: str) -> Tuple[str, ...]:
+    """メッセージに関連するドメイン（一致数の多い順、なければ空）"""
+    counts = get_domain_matcher().count_by_payload(message or "")
+    return tuple(sorted(counts, key=lambda domain: counts[domain], reverse=True))
+
+
+def _normalize_blood_key(key: str) -> str:
+    return BLOOD_KEY_ALIASES.get(key.lower(), key).lower()
+
+
+def blood_item_key(item: Dict) -> str:
+    """
+    血液項目の正規化したキー（小文字）
+
+    サニタイズ前の項目は key、サニタイズ済みの項目は name（nameJp）から求める。
+    表にない項目名はそのまま使う（「ALP」など項目名がキーと同じもの）。
+    """
+    key = item.get('key')
+    if not key:
+        name = str(item.get('name') or item.get('nameJp') or '')
+        key = BLOOD_NAME_KEYS.get(name, name)
+    return _normalize_blood_key(str(key))
+
+
+def build_route(domains: Tuple[str, ...], source: str = "auto") -> IntentRoute:
+    """ドメインから含めるメトリックのキーを求める"""
+    blood_keys = set()
+    vital_keys = set()
+    for domain in domains:
+        metrics = DOMAIN_METRICS[domain]
+        blood_keys.update(key.lower() for key in metrics["blood"])
+        blood_keys.update(key.lower() for key in DOMAIN_RELATED_BLOOD.get(domain, ()))
+        for metric in metrics["healthkit"]:
+            vital_keys.update(HEALTHKIT_VITAL_KEYS.get(metric, ()))
+    return IntentRoute(domains, frozenset(blood_keys), frozenset(vital_keys), source)
+
+
+def route_intent(message: str, scope=None, auto: bool = True) -> Optional[IntentRoute]:
+    """
+    データコンテキストの絞り込み方を決める
+
+    Args:
+        message: ユーザーのメッセージ（サニタイズ済み）
+        scope: クライアントの指定（contextScope）。"all" / "auto" / ドメイン名のリスト
+        auto: scope未指定時にメッセージから自動判定するか
+
+    Returns:
+        IntentRoute（絞り込まない場合は None）
+    """
+    if isinstance(scope, (list, tuple)):
+        domains = tuple(domain for domain in scope if domain in DOMAIN_METRICS)
+        return build_route(domains, source="override") if domains else None
+
+    if scope == "all" or not auto or not INTENT_ROUTING_ENABLED:
+        return None
+
+    domains = classify_domains(message)
+    return build_route(domains) if domains else None
+
+
+def filter_blood_items(blood_data: List[Dict], route: Optional[IntentRoute]) -> Tuple[List[Dict], int]:
+    """
+    関連しない正常範囲の血液項目を除く（サニタイズ済み・サニタイズ前のどちらの項目も可）
+
+    Returns:
+        (含める項目, 除いた項目数)
+    """
+    if route is None or not blood_data:
+        return blood_data, 0
+
+    kept = []
+    for item in blood_data:
+        # 正常範囲以外（注意・異常）は常に含める
+        status = str(item.get('status', '')).lower()
+        if status not in NORMAL_STATUSES or blood_item_key(item) in route.blood_keys:
+            kept.append(item)
+    return kept, len(blood_data) - len(kept)
+
+
+def filter_vital_data(vital_data: Dict, route: Optional[IntentRoute]) -> Dict:
+    """関連しないバイタル項目を除く（サニタイズ済みの vitalData）"""
+    if route is None or not vital_data:
+        return vital_data
+    return {key: value for key, value in vital_data.items() if key in route.vital_keys}
@@ -0,0 +1,136 @@
+"""
+intent_router_replay.py - 質問内容によるデータコンテキスト絞り込み（intent_router）の効果測定
+
+記録済みのリクエストボディ（JSONL）から、ハンドラーと同じ手順（サニタイズ → 絞り込みの判定 →
+コンテキスト描画 → プロンプト構築）で2通りのプロンプトを組み立て、プロンプトのトークン数を比較する。
+- routed: リクエストのまま（contextScope 未指定なら質問内容から自動判定）
+- all: contextScope: "all"（絞り込まない）
+- トークン数は token_counter.count_messages_tokens()（語彙を同梱していない場合は概算。tokenizer に出力）
+- セッションは使わない（conversationId などは取り除いてステートレスなリクエストとして組み立てる）
+- リクエストごとの結果をJSON 1行ずつ、最後に合計を標準出力へ出力
+
+使い方:
+    cd lambda_deployment/temp_vXX
+    PII_SALT=... python intent_router_replay.py recorded_requests.jsonl
+    PII_SALT=... python intent_router_replay.py s3://bucket/replay/requests.jsonl --limit 200
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from batch_sanitize import read_lines
+from pii_sanitizer import PIISanitizer
+from structured_logging import RequestLog
+from token_counter import count_messages_tokens, tokenizer_name
+
+import lambda_function as chat
+
+# セッションモードにしないため、リプレイ時に取り除くフィールド
+SESSION_FIELDS = ("conversationId", "historySequence", "historyLength")
+
+
+def build_prompt(body: Dict, scope=None) -> Tuple[Optional[Tuple[str, ...]], List[Dict]]:
+    """
+    ハンドラーと同じ手順でプロンプトを組み立てる
+
+    Args:
+        body: 記録済みのリクエストボディ
+        scope: contextScope を上書きする場合に指定（"all" など）
+
+    Returns:
+        (絞り込んだドメイン（絞り込まない場合は None）, OpenAIへ送るメッセージ)
+    """
+    body = {key: value for key, value in body.items() if key not in SESSION_FIELDS}
+    if scope is not None:
+        body["contextScope"] = scope
+
+    request_log = RequestLog("intent_router_replay")
+    request = chat.parse_chat_request({"body": json.dumps(body, ensure_ascii=False)}, request_log)
+    sanitized = chat.sanitize_chat_request(request, request_log)
+    route, context_format = chat.resolve_context_options(request, sanitized, request_log)
+    data_contexts = chat.render_request_contexts(request, sanitized, route, context_format)
+    prompt = chat.prepare_chat_prompt(request, sanitized, route, context_format, data_contexts, None, request_log)
+    return (tuple(route.domains) if route is not None else None), prompt.messages
+
+
+def compare(body: Dict) -> Dict:
+    """1リクエスト分の比較（絞り込みあり / contextScope: "all" のプロンプトトークン数）"""
+    domains, routed = build_prompt(body)
+    _, unrouted = build_prompt(body, scope="all")
+    routed_tokens = count_messages_tokens(routed)
+    all_tokens = count_messages_tokens(unrouted)
+    return {
+        "domains": list(domains) if domains else None,
+        "routedTokens": routed_tokens,
+        "allTokens": all_tokens,
+        "savedTokens": all_tokens - routed_tokens,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="intent_router による絞り込みのプロンプトトークン削減量を測定")
+    parser.add_argument("source", help="記録済みリクエストボディのJSONL（ファイルパス / - / s3://bucket/key）")
+    parser.add_argument("--limit", type=int, help="比較する件数の上限")
+    args = parser.parse_args()
+
+    try:
+        PIISanitizer.get_salt()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    count = routed_count = routed_total = all_total = errors = 0
+
+    for line in read_lines(args.source):
+        if not line.strip():
+            continue
+        body = json.loads(line)
+        # 絞り込みの対象は血液・バイタルデータのみ
+        if not body.get("bloodData") and not body.get("vitalData"):
+            continue
+
+        try:
+            # 処理中のログ（構造化ログ）は結果と混ざらないよう標準エラー出力へ
+            with contextlib.redirect_stdout(sys.stderr):
+                result = compare(body)
+        except chat.ChatRequestError as e:
+            errors += 1
+            print(f"⚠️ skipped request {count + errors}: {e.error}", file=sys.stderr)
+            continue
+
+        count += 1
+        routed_count += result["domains"] is not None
+        routed_total += result["routedTokens"]
+        all_total += result["allTokens"]
+        print(json.dumps({"request": count, **result}, ensure_ascii=False))
+        if args.limit and count >= args.limit:
+            break
+
+    if not count:
+        print("⚠️ bloodData / vitalData を含むリクエストがありません", file=sys.stderr)
+        return 1
+
+    saved = all_total - routed_total
+    print(json.dumps({
+        "requests": count,
+        "routedRequests": routed_count,
+        "skipped": errors,
+        "tokenizer": tokenizer_name(),
+        "routedTokens": routed_total,
+        "allTokens": all_total,
+        "savedTokens": saved,
+        "savedPercent": round(saved / all_total * 100, 1) if all_total else 0.0,
+    }, ensure_ascii=False))
+    print(
+        f"📊 Prompt tokens ({tokenizer_name()}): all {all_total} → routed {routed_total} "
+        f"({-saved / all_total * 100 if all_total else 0.0:+.1f}%, {routed_count}/{count} requests routed)",
+        file=sys.stderr
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
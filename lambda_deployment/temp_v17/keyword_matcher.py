@@ -0,0 +1,126 @@
+"""
+keyword_matcher.py - 複数キーワードの一括検索（Aho–Corasick法）
+
+多数のキーワードのどれがテキストのどこに含まれているかを、テキストを1回走査するだけで求める。
+キーワード数に関係なく、走査はテキスト長に比例する。
+- オートマトンは最初の検索時に1回だけ構築し、ウォームスタート間で再利用
+- 各キーワードに任意のデータ（カテゴリ名など）を付けられる → 一致結果からカテゴリ分類
+- 英字は大文字小文字を区別しない（str.lower()）。位置は元のテキストの文字位置
+- 重なった一致もすべて返す（例: 「頭痛」と「痛」）
+
+使い方:
+    matcher = KeywordMatcher.from_groups({"痛み": ["痛い", "頭痛"], "睡眠": ["眠れない"]})
+    matcher.find_all("頭痛で眠れない")
+    # → [KeywordMatch(keyword='頭痛', start=0, end=2, payload='痛み'), ...]
+"""
+
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class KeywordMatch(NamedTuple):
+    keyword: str
+    start: int
+    end: int
+    payload: Any = None
+
+
+class KeywordMatcher:
+    """Aho–Corasickオートマトンによる複数キーワード検索"""
+
+    def __init__(self, keywords: Optional[Iterable[Tuple[str, Any]]] = None):
+        """
+        Args:
+            keywords: (キーワード, データ) のイテレーター
+        """
+        self._entries: List[Tuple[str, Any]] = []
+        self._built = False
+        # ノードごとの遷移・失敗リンク・出力（ノード0がルート）
+        self._goto: List[Dict[str, int]] = []
+        self._fail: List[int] = []
+        self._output: List[List[Tuple[str, int, Any]]] = []
+        for keyword, payload in keywords or []:
+            self.add(keyword, payload)
+
+    @classmethod
+    def from_groups(cls, groups: Dict[Any, Iterable[str]]) -> "KeywordMatcher":
+        """{グループ名: [キーワード, ...]} から作成（一致結果の payload がグループ名になる）"""
+        return cls((keyword, group) for group, keywords in groups.items() for keyword in keywords)
+
+    def add(self, keyword: str, payload: Any = None) -> None:
+        """キーワードを追加（次回の検索時にオートマトンを作り直す）"""
+        if not keyword:
+            raise ValueError("keyword must not be empty")
+        self._entries.append((keyword, payload))
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _build(self) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        output: List[List[Tuple[str, int, Any]]] = [[]]
+
+        # トライ木
+        for keyword, payload in self._entries:
+            node = 0
+            normalized = keyword.lower()
+            for char in normalized:
+                next_node = goto[node].get(char)
+                if next_node is None:
+                    next_node = len(goto)
+                    goto[node][char] = next_node
+                    goto.append({})
+                    output.append([])
+                node = next_node
+            output[node].append((keyword, len(normalized), payload))
+
+        # 失敗リンク（幅優先）。出力は失敗先の出力も含める
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                output[child] = output[child] + output[fail[child]]
+
+        self._goto, self._fail, self._output = goto, fail, output
+        self._built = True
+
+    def _scan(self, text: str) -> Iterator[KeywordMatch]:
+        if not self._built:
+            self._build()
+        goto, fail, output = self._goto, self._fail, self._output
+
+        node = 0
+        for index, original_char in enumerate(text):
+            for char in original_char.lower():
+                while node and char not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(char, 0)
+                for keyword, length, payload in output[node]:
+                    # 開始位置は元のテキスト基準（lower()で文字数が変わる一部の文字を含む場合は近似）
+                    yield KeywordMatch(keyword, max(0, index + 1 - length), index + 1, payload)
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """すべての一致（重なりを含む、終了位置順）"""
+        if not text or not self._entries:
+            return []
+        return list(self._scan(text))
+
+    def contains_any(self, text: str) -> bool:
+        """いずれかのキーワードを含むか（最初の一致で打ち切り）"""
+        if not text or not self._entries:
+            return False
+        return next(self._scan(text), None) is not None
+
+    def count_by_payload(self, text: str) -> Dict[Any, int]:
+        """payload（カテゴリ）ごとの一致数"""
+        counts: Dict[Any, int] = {}
+        for match in self.find_all(text):
+            counts[match.payload] = counts.get(match.payload, 0) + 1
+        return counts
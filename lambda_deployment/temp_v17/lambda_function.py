@@ -9,237 +9,713 @@ TUUN AI Chat Lambda Function (改善版 v2.0)
 - フレンドリーで詳細な応答
 """
 
-print("=" * 80)
-print("[INIT] lambda_function.py initialization started")
-print("=" * 80)
+from __future__ import annotations
 
-print("[IMPORT] json...")
-import json
-print("  ✅ json")
-
-print("[IMPORT] boto3...")
-import boto3
-print("  ✅ boto3")
+import time
+_INIT_STARTED_AT = time.perf_counter()
 
-print("[IMPORT] os...")
+import json
+import math
 import os
-print("  ✅ os")
-
-print("[IMPORT] datetime...")
 from datetime import datetime
-print("  ✅ datetime")
-
-print("[IMPORT] typing...")
-from typing import Dict, List, Optional, Any
-print("  ✅ typing")
-
-print("[IMPORT] re...")
-import re
-print("  ✅ re")
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
-print("[IMPORT] time...")
-import time
-print("  ✅ time")
+from structured_logging import (
+    end_request, log_debug, log_error, log_info, log_warning, start_request,
+)
+from instrumentation import record_timing, span, time_first_item
 
-print("[IMPORT] pii_sanitizer...")
 try:
-    from pii_sanitizer import PIISanitizer, sanitize_for_openai
-    print("  ✅ pii_sanitizer")
+    from pii_sanitizer import PIISanitizer, StreamingRedactor, get_history_cache, sanitize_for_openai
     PII_SANITIZER_AVAILABLE = True
 except ImportError as e:
-    print(f"  ⚠️ pii_sanitizer not available: {e}")
+    log_warning("pii_sanitizer not available", error=str(e))
     PII_SANITIZER_AVAILABLE = False
 
-print("[IMPORT] openai...")
-try:
+from section_splitter import SectionSplitter, split_sections
+from history_compactor import compact_history
+from conversation_store import ConversationConflictError, ConversationItemTooLargeError, get_conversation_store
+from context_cache import get_context_cache, render_cached
+from keyword_matcher import KeywordMatcher
+from context_renderer import (
+    build_available_categories_context, build_blood_data_context, build_blood_data_context_compact,
+    build_gene_data_context, build_gene_data_summary_context, build_vital_data_context,
+    build_vital_data_context_compact, gene_context_within_bounds,
+)
+from retry_scheduler import OPENAI_MAX_ATTEMPTS, RetryPolicy, call_with_retry, start_deadline, with_attempt_timeout
+from hedging import OPENAI_HEDGE_ENABLED, hedged_call, prime_stream
+from rate_limiter import RateBudgetExceeded, clear_budget, get_rate_limiter, reserve_attempt, start_budget
+from token_counter import count_messages_tokens, message_token_counts, tokenizer_name
+from intent_router import IntentRoute, filter_blood_items, filter_vital_data, route_intent
+
+# boto3 / openai SDK は重いため初回使用時に読み込む（コールドスタート短縮）
+if TYPE_CHECKING:
     from openai import OpenAI
-    import openai
-    print(f"  ✅ openai (version: {openai.__version__})")
-except ImportError as e:
-    print(f"  ❌ Failed to import openai: {e}")
-    raise
 
-print("[INIT] Creating Secrets Manager client...")
-secretsmanager = boto3.client('secretsmanager', region_name='ap-northeast-1')
-print("  ✅ Secrets Manager client created")
+# OpenAI HTTPクライアント: "sdk"（openaiパッケージ）または "slim"（標準ライブラリのみ、slim_openai_client）
+OPENAI_HTTP_CLIENT = os.environ.get('OPENAI_HTTP_CLIENT', 'sdk').lower()
+# Secrets Manager を Lambda拡張（AWS Parameters and Secrets Lambda Extension）経由で取得する（boto3不要）
+SECRETS_EXTENSION_ENABLED = os.environ.get('SECRETS_EXTENSION_ENABLED', 'false').lower() == 'true'
+SECRETS_EXTENSION_PORT = os.environ.get('PARAMETERS_SECRETS_EXTENSION_HTTP_PORT', '2773')
+
+log_info(
+    "lambda_function initialized",
+    initMs=round((time.perf_counter() - _INIT_STARTED_AT) * 1000, 1),
+    openaiClient=OPENAI_HTTP_CLIENT
+)
+
+# ウォームスタート間で再利用するキャッシュ
+# Lambdaの実行環境はリクエスト間で再利用されるため、モジュールレベルに保持する
+OPENAI_SECRET_NAME = "tuunapp/openai-api-key"
+API_KEY_CACHE_TTL_SECONDS = int(os.environ.get('OPENAI_API_KEY_CACHE_TTL', '300'))
+
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-5.1-chat-latest')
+# v8: 3レイヤー応答に対応するため増加（1500→2500）
+MAX_COMPLETION_TOKENS = 2500
+
+# プロバイダー側のプロンプトキャッシュのルーティングキー（静的な先頭部分が共通のリクエストをまとめる）
+PROMPT_CACHE_KEY = os.environ.get('OPENAI_PROMPT_CACHE_KEY', 'tuun-chat')
+# 血液・バイタルデータのコンテキスト形式の既定値（リクエストの contextFormat で上書き可）
+CONTEXT_FORMATS = ("verbose", "compact")
+CONTEXT_FORMAT = os.environ.get('CONTEXT_FORMAT', 'verbose').lower()
+# モデルの応答からも連絡先のPII（メールアドレス・電話番号・ID番号）をマスクしてからクライアントへ返す（rs番号は残す）
+REDACT_MODEL_OUTPUT = os.environ.get('REDACT_MODEL_OUTPUT', 'true').lower() == 'true'
+
+_api_key_cache = {"value": None, "fetched_at": 0.0}
+_openai_client_cache = {"client": None, "api_key": None}
+_secretsmanager_client = None
+
+
+def get_secretsmanager_client():
+    """Secrets Managerクライアント（初回使用時にboto3を読み込んで作成）"""
+    global _secretsmanager_client
+    if _secretsmanager_client is None:
+        import boto3
+        _secretsmanager_client = boto3.client('secretsmanager', region_name='ap-northeast-1')
+    return _secretsmanager_client
+
+
+@span("secretFetch")
+def fetch_secret_string(secret_id: str) -> str:
+    """
+    シークレット文字列を取得
+
+    SECRETS_EXTENSION_ENABLED=true の場合はLambda拡張のローカルHTTPエンドポイントを使う
+    （boto3の読み込みとSecrets ManagerへのTLS接続が不要）。
+    """
+    if SECRETS_EXTENSION_ENABLED:
+        import urllib.parse
+        import urllib.request
+        url = (
+            f"http://localhost:{SECRETS_EXTENSION_PORT}/secretsmanager/get"
+            f"?secretId={urllib.parse.quote(secret_id, safe='')}"
+        )
+        request = urllib.request.Request(
+            url, headers={"X-Aws-Parameters-Secrets-Token": os.environ.get('AWS_SESSION_TOKEN', '')}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return json.loads(response.read())['SecretString']
+
+    response = get_secretsmanager_client().get_secret_value(SecretId=secret_id)
+    return response['SecretString']
 
-print("[INIT] Initialization complete")
-print("=" * 80)
 
 # OpenAI API Keyを取得
-def get_openai_api_key():
-    """Secrets ManagerからOpenAI API Keyを取得"""
+def get_openai_api_key(force_refresh: bool = False) -> str:
+    """
+    Secrets ManagerからOpenAI API Keyを取得（TTL付きキャッシュ）
+
+    Args:
+        force_refresh: Trueの場合はキャッシュを無視して再取得（401発生時など）
+    """
+    cached_key = _api_key_cache["value"]
+    age = time.monotonic() - _api_key_cache["fetched_at"]
+    if cached_key and not force_refresh and age < API_KEY_CACHE_TTL_SECONDS:
+        return cached_key
+
     try:
-        secret_name = "tuunapp/openai-api-key"
-        response = secretsmanager.get_secret_value(SecretId=secret_name)
-        secret = json.loads(response['SecretString'])
+        secret = json.loads(fetch_secret_string(OPENAI_SECRET_NAME))
 
         # デバッグ: シークレットの構造を確認
-        print(f"🔑 Secret keys available: {list(secret.keys())}")
+        log_debug("secret keys available", keys=lambda: list(secret.keys()))
 
         # 'api_key' または 'OPENAI_API_KEY' を試す
         if 'api_key' in secret:
-            return secret['api_key']
+            api_key = secret['api_key']
         elif 'OPENAI_API_KEY' in secret:
-            return secret['OPENAI_API_KEY']
+            api_key = secret['OPENAI_API_KEY']
         elif 'openai_api_key' in secret:
-            return secret['openai_api_key']
+            api_key = secret['openai_api_key']
         else:
             # キーが見つからない場合、全てのキーを表示
-            print(f"❌ [ERROR] No API key found. Available keys: {list(secret.keys())}")
+            log_error("no API key found in secret", keys=list(secret.keys()))
             raise KeyError(f"No valid API key found in secret. Available keys: {list(secret.keys())}")
     except Exception as e:
-        print(f"❌ [ERROR] Failed to get OpenAI API key: {str(e)}")
+        log_error("failed to get OpenAI API key", error=str(e))
         raise
 
+    _api_key_cache["value"] = api_key
+    _api_key_cache["fetched_at"] = time.monotonic()
+    log_info("OpenAI API key fetched", forceRefresh=force_refresh)
+    return api_key
 
-def lambda_handler(event, context):
-    """Lambda メインハンドラー"""
-    try:
-        print("\n" + "=" * 80)
-        print("[HANDLER] Request received")
-        print("=" * 80)
 
-        # OpenAIクライアントを作成（Secrets Managerから取得）
-        print("[AUTH] Creating OpenAI client...")
+def get_openai_client(force_refresh: bool = False) -> OpenAI:
+    """
+    OpenAIクライアントを取得（ウォームスタート間で再利用）
+
+    クライアントを使い回すことで、httpxのkeep-aliveコネクションプール
+    （TLSセッション）が次のリクエストでも再利用される。
+    API Keyがローテーションされた場合のみ作り直す。
+    """
+    api_key = get_openai_api_key(force_refresh=force_refresh)
+
+    client = _openai_client_cache["client"]
+    if client is not None and _openai_client_cache["api_key"] == api_key:
+        return client
+
+    if client is not None:
+        # 古いコネクションプールを解放
         try:
-            api_key = get_openai_api_key()
-            openai_client = OpenAI(api_key=api_key)
-            print("  ✅ OpenAI client created with API key from Secrets Manager")
+            client.close()
         except Exception as e:
-            print(f"  ❌ Failed to create OpenAI client: {e}")
-            raise
+            log_warning("failed to close previous OpenAI client", error=str(e))
+
+    client = create_openai_client(api_key)
+    _openai_client_cache["client"] = client
+    _openai_client_cache["api_key"] = api_key
+    return client
+
+
+@span("clientInit")
+def create_openai_client(api_key: str):
+    """OPENAI_HTTP_CLIENT に応じてクライアントを作成（SDKはここで初めてimport）"""
+    if OPENAI_HTTP_CLIENT == 'slim':
+        from slim_openai_client import SlimOpenAI
+        return SlimOpenAI(api_key=api_key)
+
+    from openai import OpenAI
+    # リトライは retry_scheduler で行う（SDK内蔵のリトライと二重にしない）
+    return OpenAI(api_key=api_key, max_retries=0)
+
+
+def openai_auth_error_types() -> tuple:
+    """使用中のクライアントの401エラー型"""
+    if OPENAI_HTTP_CLIENT == 'slim':
+        from slim_openai_client import AuthenticationError
+        return (AuthenticationError,)
+
+    import openai
+    return (openai.AuthenticationError,)
+
+
+def call_with_auth_refresh(call_fn: Callable, client: OpenAI, messages: List[Dict]) -> Any:
+    """
+    OpenAI APIを呼び出し、401（キャッシュ済みAPI Keyの失効）時は
+    Secrets Managerから再取得して1回だけリトライ
 
-        print(f"[REQUEST] Event: {json.dumps(event, ensure_ascii=False)[:200]}...")
+    リトライ・ヘッジの2本目の予算が無い場合（rate_limiter）は 429 / RATE_LIMITED を返す。
 
-        # リクエストボディを解析
-        print("[PARSE] Parsing request body...")
+    Args:
+        call_fn: call_openai または open_openai_stream
+    """
+    try:
+        try:
+            return call_fn(client, messages)
+        except openai_auth_error_types() as e:
+            log_warning("OpenAI authentication failed, refreshing API key", error=str(e))
+            client = get_openai_client(force_refresh=True)
+            return call_fn(client, messages)
+    except RateBudgetExceeded as e:
+        raise rate_limited_error(e) from e
+
+
+ASYNC_HANDLER_ENABLED = os.environ.get('ASYNC_HANDLER_ENABLED', 'false').lower() == 'true'
+# "stream": true のリクエストにNDJSON（セクション単位のイベント）で応答する。
+# Pythonのマネージドランタイムはreturnまで何も送れないため、イベントはまとめて届く（最初のバイトまでの時間は変わらない）。
+# 行単位で転送できる前段（Function URL + Lambda Web Adapter等）を用意した場合のみ有効にする
+STREAM_MODE_ENABLED = os.environ.get('STREAM_MODE_ENABLED', 'false').lower() == 'true'
+
+
+class ChatRequestError(Exception):
+    """クライアントへエラー応答を返して処理を終える（ステータスコードとerrorCode付き）"""
+
+    def __init__(
+        self, status_code: int, error: str, error_code: str,
+        details: Optional[str] = None, retry_after: Optional[float] = None
+    ):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+        self.error_code = error_code
+        self.details = details
+        # 再試行できるエラーの場合、再試行までの秒数（Retry-After ヘッダーと retryAfter で返す）
+        self.retry_after = retry_after
+
+    def to_response(self) -> Dict:
+        payload = {'error': self.error, 'errorCode': self.error_code}
+        if self.details is not None:
+            payload['details'] = self.details
+        headers = cors_headers()
+        if self.retry_after is not None:
+            retry_after = max(1, math.ceil(self.retry_after))
+            payload['retryAfter'] = retry_after
+            headers['Retry-After'] = str(retry_after)
+        return {
+            'statusCode': self.status_code,
+            'headers': headers,
+            'body': json.dumps(payload)
+        }
+
+
+class ChatRequest(NamedTuple):
+    """リクエストボディから取り出した値"""
+    body: Dict
+    user_id: Optional[str]
+    message: Optional[str]
+    stream_mode: bool
+    session_mode: bool
+    conversation_id: Optional[str]
+    trusted_history_length: int
+    conversation_history: List[Dict]
+    blood_data: Any
+    vital_data: Any
+    gene_data: Any
+
+
+class SanitizedRequest(NamedTuple):
+    """OpenAIへ送るためにPIIを除去した値"""
+    message: str
+    blood: Any
+    vital: Any
+    gene: Any
+    history: List[Dict]
+    user_token: str
+    accepted_user_tokens: List[str]
+
+
+class ChatPrompt(NamedTuple):
+    """OpenAIへ送るメッセージと、応答後のセッション保存に使う値"""
+    messages: List[Dict]
+    session: Optional[Dict]
+    conversation_id: Optional[str]
+    data_contexts: Dict[str, str]
+    user_message: str
+    accepted_user_tokens: List[str]
+
+
+def parse_chat_request(event, request_log) -> ChatRequest:
+    """リクエストボディを解析して検証（userId / message がなければ400）"""
+    with span("bodyParse"):
         body = json.loads(event.get('body', '{}'))
 
-        user_id = body.get('userId')
-        message = body.get('message')
-        topic = body.get('topic', 'general_health')
-
-        # 会話履歴を取得
-        conversation_history = body.get('conversationHistory', [])
-
-        # データを取得（ユーザーが選択した場合のみ）
-        blood_data = body.get('bloodData', None)
-        vital_data = body.get('vitalData', None)
-        gene_data = body.get('geneData', None)
-
-        print(f"  ✅ userId: {user_id}")
-        print(f"  ✅ message: {len(message) if message else 0} chars")
-        print(f"  ✅ topic: {topic}")
-        print(f"  ✅ conversationHistory: {len(conversation_history)} messages")
-        if blood_data:
-            print(f"  ✅ bloodData: {len(blood_data)} items")
-        if vital_data:
-            print(f"  ✅ vitalData: included")
-        if gene_data:
-            available_cats = gene_data.get('availableCategories', [])
-            if available_cats:
-                if len(available_cats) > 0:
-                    print(f"  ✅ geneData: {len(available_cats)} available categories")
-                else:
-                    print(f"  ⚠️ geneData: empty availableCategories (skipping)")
-                    gene_data = None  # 空の場合はNoneに設定して無視
+    user_id = body.get('userId')
+    message = body.get('message')
+    topic = body.get('topic', 'general_health')
+    # ストリーミングモード（NDJSONのイベント形式。STREAM_MODE_ENABLED=false の場合は通常のJSONで応答）
+    stream_requested = bool(body.get('stream', False))
+    stream_mode = stream_requested and STREAM_MODE_ENABLED
+    # セッションモード: conversationIdを送ると会話履歴・データコンテキストをサーバー側で保持
+    session_mode = 'conversationId' in body
+    conversation_id = body.get('conversationId')
+    # サーバー側セッションに保存済み（サニタイズ済み）の履歴件数。セッションで検証できた場合のみ信頼する
+    history_sequence = body.get('historySequence') if session_mode and conversation_id else None
+    trusted_history_length = history_sequence if isinstance(history_sequence, int) and history_sequence > 0 else 0
+
+    # 会話履歴を取得
+    conversation_history = body.get('conversationHistory', [])
+
+    # データを取得（ユーザーが選択した場合のみ）
+    blood_data = body.get('bloodData', None)
+    vital_data = body.get('vitalData', None)
+    gene_data = body.get('geneData', None)
+
+    request_log.set(
+        messageChars=len(message) if message else 0,
+        topic=topic,
+        historyMessages=len(conversation_history),
+        stream=stream_mode,
+        bloodItems=len(blood_data) if blood_data else 0,
+        vital=bool(vital_data),
+    )
+    if stream_requested and not stream_mode:
+        request_log.set(streamRequested=True)
+    if session_mode:
+        request_log.set(conversationId=conversation_id or "(new)")
+    if gene_data:
+        available_cats = gene_data.get('availableCategories', [])
+        if available_cats:
+            if len(available_cats) > 0:
+                request_log.set(geneAvailableCategories=len(available_cats))
             else:
-                print(f"  ✅ geneData: {len(gene_data)} categories")
-
-        if not user_id or not message:
-            print("  ❌ Validation failed: userId or message missing")
-            return {
-                'statusCode': 400,
-                'headers': cors_headers(),
-                'body': json.dumps({
-                    'error': 'userId and message are required',
-                    'errorCode': 'INVALID_REQUEST'
-                })
-            }
-
-        # PIIサニタイズ処理（OpenAI送信前に個人情報を除去）
-        print("[PII] Sanitizing PII before OpenAI submission...")
-        if PII_SANITIZER_AVAILABLE:
-            try:
-                sanitized = sanitize_for_openai(body)
-                sanitized_message = sanitized.get("message", message)
-                sanitized_blood = sanitized.get("bloodData") if blood_data else None
-                sanitized_vital = sanitized.get("vitalData") if vital_data else None
-                sanitized_gene = sanitized.get("geneData") if gene_data else None
-                sanitized_history = sanitized.get("conversationHistory", conversation_history)
-                print(f"  ✅ PII sanitization complete")
-                print(f"    - user_token: {sanitized.get('user_token', 'N/A')}")
-            except ValueError as e:
-                print(f"  ❌ PII sanitization error: {e}")
-                return {
-                    'statusCode': 500,
-                    'headers': cors_headers(),
-                    'body': json.dumps({
-                        'error': 'Server configuration error',
-                        'errorCode': 'PII_SALT_MISSING',
-                        'details': str(e)
-                    })
-                }
+                log_warning("geneData has empty availableCategories (skipping)")
+                gene_data = None  # 空の場合はNoneに設定して無視
+        else:
+            request_log.set(geneCategories=len(gene_data))
+
+    if not user_id or not message:
+        log_warning("validation failed: userId or message missing")
+        raise ChatRequestError(400, 'userId and message are required', 'INVALID_REQUEST')
+
+    return ChatRequest(
+        body, user_id, message, stream_mode, session_mode, conversation_id, trusted_history_length,
+        conversation_history, blood_data, vital_data, gene_data
+    )
+
+
+def sanitize_chat_request(request: ChatRequest, request_log) -> SanitizedRequest:
+    """PIIサニタイズ処理（OpenAI送信前に個人情報を除去）"""
+    if not PII_SANITIZER_AVAILABLE:
+        log_warning("PII sanitizer not available, using original data")
+        return SanitizedRequest(
+            request.message, request.blood_data, request.vital_data, request.gene_data,
+            request.conversation_history, request.user_id, [request.user_id]
+        )
+
+    try:
+        with span("piiSanitize"):
+            sanitized = sanitize_for_openai(request.body, trusted_history_length=request.trusted_history_length)
+        user_token = sanitized.get("user_token", request.user_id)
+        result = SanitizedRequest(
+            sanitized.get("message", request.message),
+            sanitized.get("bloodData") if request.blood_data else None,
+            sanitized.get("vitalData") if request.vital_data else None,
+            sanitized.get("geneData") if request.gene_data else None,
+            sanitized.get("conversationHistory", request.conversation_history),
+            user_token,
+            PIISanitizer.accepted_user_tokens(request.user_id)
+        )
+        request_log.set(userToken=user_token, piiHistoryCache=lambda: get_history_cache().stats())
+        return result
+    except ValueError as e:
+        log_error("PII sanitization error", error=str(e))
+        raise ChatRequestError(500, 'Server configuration error', 'PII_SALT_MISSING', details=str(e))
+
+
+def resolve_context_options(request: ChatRequest, sanitized: SanitizedRequest, request_log) -> Tuple[Optional[IntentRoute], str]:
+    """データコンテキストの絞り込み（contextScope）と形式（contextFormat）を決める"""
+    # 質問内容に関連するデータだけをプロンプトに含める（contextScope で上書き可）
+    # セッションモードは保存するコンテキストを毎ターン同じに保つため、明示指定時のみ絞り込む
+    route = route_intent(sanitized.message, scope=request.body.get('contextScope'), auto=not request.session_mode)
+    if route is not None:
+        request_log.set(intentDomains=list(route.domains), intentSource=route.source)
+
+    context_format = request.body.get('contextFormat') or CONTEXT_FORMAT
+    if context_format not in CONTEXT_FORMATS:
+        context_format = "verbose"
+    request_log.set(contextFormat=context_format)
+    return route, context_format
+
+
+def render_request_contexts(
+    request: ChatRequest, sanitized: SanitizedRequest, route: Optional[IntentRoute], context_format: str
+) -> Dict[str, str]:
+    """描画済みデータコンテキスト（今回送られてきたデータ分）"""
+    with span("promptBuild"):
+        return render_data_contexts(
+            sanitized.blood, sanitized.vital, sanitized.gene,
+            route=None if request.session_mode else route,
+            context_format=context_format,
+            query=sanitized.message
+        )
+
+
+def load_session(request: ChatRequest, sanitized: SanitizedRequest) -> Optional[Dict]:
+    """保存済みのセッションを読み込む（セッションモードで conversationId がある場合のみ）"""
+    if not (request.session_mode and request.conversation_id):
+        return None
+    with span("sessionLoad"):
+        return get_conversation_store().load(
+            request.conversation_id, sanitized.user_token,
+            expected_length=request.body.get('historyLength'),
+            accepted_tokens=sanitized.accepted_user_tokens
+        )
+
+
+def prepare_chat_prompt(
+    request: ChatRequest,
+    sanitized: SanitizedRequest,
+    route: Optional[IntentRoute],
+    context_format: str,
+    data_contexts: Dict[str, str],
+    session: Optional[Dict],
+    request_log
+) -> ChatPrompt:
+    """セッションの履歴・コンテキストを合わせてOpenAIへ送るメッセージを組み立てる"""
+    conversation_id = request.conversation_id
+    history = sanitized.history
+
+    # セッションモード: 保存済みの履歴・コンテキストを使用
+    if request.session_mode:
+        store = get_conversation_store()
+        if session is None:
+            if conversation_id and request.body.get('historyLength') and not request.conversation_history:
+                # セッションが期限切れ等で見つからない: クライアントに履歴の再送を依頼
+                log_warning("conversation not found", conversationId=conversation_id)
+                raise ChatRequestError(409, 'Conversation not found. Resend conversationHistory.', 'CONVERSATION_NOT_FOUND')
+            if request.trusted_history_length and PII_SANITIZER_AVAILABLE:
+                # セッションがないため historySequence は検証できない: 履歴全体をサニタイズし直す
+                # （既に走査したメッセージはキャッシュから返る）
+                with span("piiSanitize"):
+                    history = PIISanitizer.sanitize_conversation_history(request.conversation_history)
+            # 新しいセッションは常にサーバーで採番する（クライアントが送ったIDは期限切れか他ユーザーのもの）
+            if conversation_id:
+                request_log.set(previousConversationId=conversation_id)
+            conversation_id = store.new_conversation_id()
+            session = store.new_session(conversation_id, sanitized.user_token)
+            # クライアントが送った履歴（サニタイズ済み）でセッションを開始
+            session["history"] = history
+            request_log.set(conversationId=conversation_id, sessionCreated=True)
+        else:
+            history = session["history"]
+            request_log.set(sessionHistoryMessages=len(history), sessionContexts=list(session['contexts'].keys()))
+
+        # 保存済みコンテキストに今回送られたデータを上書き
+        data_contexts = {**session["contexts"], **data_contexts}
+
+    # プロンプト用のコンテキスト（セッションには絞り込み前のものを保存する）
+    # 質問ごとに変わる絞り込み済みのコンテキストは、プロンプトキャッシュの共通部分を崩さないよう会話履歴の後に置く
+    prompt_contexts = data_contexts
+    routed_contexts: Dict[str, str] = {}
+    if route is not None:
+        if request.session_mode:
+            with span("promptBuild"):
+                routed_contexts = render_data_contexts(
+                    sanitized.blood, sanitized.vital, None, route=route, context_format=context_format
+                )
         else:
-            print("  ⚠️ PII sanitizer not available, using original data")
-            sanitized_message = message
-            sanitized_blood = blood_data
-            sanitized_vital = vital_data
-            sanitized_gene = gene_data
-            sanitized_history = conversation_history
-
-        # プロンプトを構築（サニタイズ済みデータを使用）
-        print("[BUILD] Building chat messages...")
+            routed_contexts = {key: data_contexts[key] for key in ROUTED_CONTEXT_KEYS if key in data_contexts}
+        prompt_contexts = {key: value for key, value in data_contexts.items() if key not in routed_contexts}
+
+    # プロンプトを構築（サニタイズ済みデータを使用）
+    with span("promptBuild"):
         messages = build_chat_messages(
-            user_message=sanitized_message,
-            conversation_history=sanitized_history,
-            blood_data=sanitized_blood,
-            vital_data=sanitized_vital,
-            gene_data=sanitized_gene
+            user_message=sanitized.message,
+            conversation_history=history,
+            blood_data=None,
+            vital_data=None,
+            gene_data=None,
+            data_contexts=prompt_contexts,
+            routed_contexts=routed_contexts
         )
-        print(f"  ✅ Built {len(messages)} messages")
-        for i, msg in enumerate(messages):
-            print(f"    {i+1}. {msg['role']}: {len(msg['content'])} chars")
+    request_log.set(promptMessages=len(messages), contextCache=get_context_cache().stats())
+    log_debug("prompt messages", sizes=lambda: [f"{msg['role']}:{len(msg['content'])}" for msg in messages])
 
-        # OpenAI APIを呼び出し
-        print("[OPENAI] Calling OpenAI API...")
-        response = call_openai(openai_client, messages)
-        print(f"  ✅ Response received: {len(response)} chars")
+    return ChatPrompt(
+        messages, session if request.session_mode else None, conversation_id, data_contexts, sanitized.message,
+        sanitized.accepted_user_tokens
+    )
 
-        print("[HANDLER] Request completed successfully")
-        print("=" * 80 + "\n")
 
-        # レスポンスをチャンクに分割
-        chunks = split_response_into_chunks(response)
-        print(f"  ✅ Response split into {len(chunks)} chunks")
+def reserve_openai_budget(messages: List[Dict]) -> None:
+    """
+    共有のレート制限の予算からOpenAI呼び出し1回分を予約（rate_limiter）
 
-        return {
-            'statusCode': 200,
-            'headers': cors_headers(),
-            'body': json.dumps({
-                'response': response,  # 後方互換
-                'chunks': chunks,
-                'chunked': True,
-                'timestamp': datetime.now().isoformat(),
-                'disclaimer': 'この情報は参考情報です。医療的な判断は医師にご相談ください。'
-            }, ensure_ascii=False)
-        }
+    予算を超える場合は待たずに 429 / RATE_LIMITED（retryAfter 秒後に再試行可）を返す。
+    リトライ・ヘッジの2本目は各試行の直前に同じトークン数を追加で予約する（reserve_attempt()）。
+    """
+    clear_budget()
+    limiter = get_rate_limiter()
+    if not limiter.enabled:
+        return
+    tokens = count_messages_tokens(messages) + MAX_COMPLETION_TOKENS
+    try:
+        limiter.acquire(tokens)
+    except RateBudgetExceeded as e:
+        raise rate_limited_error(e) from e
+    start_budget(limiter, tokens)
+
+
+def rate_limited_error(e: RateBudgetExceeded) -> ChatRequestError:
+    """予算超過を 429 / RATE_LIMITED の応答にする"""
+    log_warning("OpenAI rate budget exceeded", limit=e.limit, retryAfter=round(e.retry_after, 1))
+    return ChatRequestError(429, 'Too many requests. Please retry later.', 'RATE_LIMITED', retry_after=e.retry_after)
+
+
+def build_stream_response(prompt: ChatPrompt, events: List[Dict]) -> Dict:
+    """ストリーミングモードの応答（NDJSON。全イベントを1つのボディで返す。行単位の転送は前段が行う）"""
+    if prompt.session is not None:
+        done = events[-1]
+        save_conversation_turn(prompt, done['response'])
+        done['conversationId'] = prompt.conversation_id
+    with span("responseSerialize"):
+        ndjson_body = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+    return {
+        'statusCode': 200,
+        'headers': cors_headers('application/x-ndjson'),
+        'body': ndjson_body
+    }
+
+
+def build_chat_response(prompt: ChatPrompt, response: str, request_log) -> Dict:
+    """非ストリーミングの応答（セッション保存・チャンク分割）"""
+    response = redact_model_output(response)
+    request_log.set(responseChars=len(response))
+
+    if prompt.session is not None:
+        save_conversation_turn(prompt, response)
+
+    # レスポンスをチャンクに分割
+    chunks = split_response_into_chunks(response)
+    request_log.set(chunks=len(chunks))
+
+    envelope = build_response_envelope(response, chunks)
+    if prompt.session is not None:
+        envelope['conversationId'] = prompt.conversation_id
+
+    with span("responseSerialize"):
+        response_body = json.dumps(envelope, ensure_ascii=False)
+
+    return {
+        'statusCode': 200,
+        'headers': cors_headers(),
+        'body': response_body
+    }
+
+
+def internal_error_response(e: Exception) -> Dict:
+    import traceback
+    log_error("exception in lambda_handler", error=str(e), traceback=traceback.format_exc())
+
+    return {
+        'statusCode': 500,
+        'headers': cors_headers(),
+        'body': json.dumps({
+            'error': 'Internal server error',
+            'errorCode': 'INTERNAL_ERROR',
+            'details': str(e)
+        })
+    }
+
+
+def lambda_handler(event, context):
+    """
+    Lambda メインハンドラー
+
+    ASYNC_HANDLER_ENABLED=true の場合は asyncio 版（async_handler）に委譲する。
+    """
+    if ASYNC_HANDLER_ENABLED:
+        from async_handler import run_async_handler
+        return run_async_handler(event, context)
+
+    request_log = start_request("chat", context)
+    start_deadline(context)
+    status_code = 500
+    try:
+        # OpenAIクライアントを取得（ウォームスタート時はキャッシュを再利用）
+        try:
+            openai_client = get_openai_client()
+        except Exception as e:
+            log_error("failed to create OpenAI client", error=str(e))
+            raise
+
+        log_debug("event received", event=lambda: json.dumps(event, ensure_ascii=False)[:200])
+
+        request = parse_chat_request(event, request_log)
+        sanitized = sanitize_chat_request(request, request_log)
+        route, context_format = resolve_context_options(request, sanitized, request_log)
+        data_contexts = render_request_contexts(request, sanitized, route, context_format)
+        session = load_session(request, sanitized)
+        prompt = prepare_chat_prompt(request, sanitized, route, context_format, data_contexts, session, request_log)
+        reserve_openai_budget(prompt.messages)
+
+        # ストリーミングモード: セクション単位のイベントをまとめてNDJSONで返す
+        if request.stream_mode:
+            result = build_stream_response(prompt, list(stream_chat_events(openai_client, prompt.messages)))
+        else:
+            # OpenAI APIを呼び出し
+            with span("openaiTotal"):
+                response = call_with_auth_refresh(call_openai, openai_client, prompt.messages)
+            result = build_chat_response(prompt, response, request_log)
+        status_code = 200
+        return result
+
+    except ChatRequestError as e:
+        status_code = e.status_code
+        return e.to_response()
 
     except Exception as e:
-        print(f"❌ [ERROR] Exception in lambda_handler: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        return internal_error_response(e)
 
-        return {
-            'statusCode': 500,
-            'headers': cors_headers(),
-            'body': json.dumps({
-                'error': 'Internal server error',
-                'errorCode': 'INTERNAL_ERROR',
-                'details': str(e)
-            })
-        }
+    finally:
+        end_request(statusCode=status_code)
+
+
+@span("sessionSave")
+def save_conversation_turn(prompt: ChatPrompt, response: str) -> None:
+    """
+    今回のターン（サニタイズ済みユーザーメッセージ + 応答）をセッションに保存
+
+    別リクエストとの競合を解決できない場合（他ユーザーのセッションを含む）は 409 / CONVERSATION_CONFLICT。
+    アイテムの上限を超えて保存できない場合は警告を出して保存せずに応答を返す。
+    """
+    try:
+        saved = get_conversation_store().save(
+            prompt.session,
+            [
+                {"role": "user", "content": prompt.user_message},
+                {"role": "assistant", "content": response},
+            ],
+            contexts=prompt.data_contexts,
+            accepted_tokens=prompt.accepted_user_tokens
+        )
+    except ConversationConflictError:
+        raise ChatRequestError(409, 'Conversation was updated by another request. Please retry.', 'CONVERSATION_CONFLICT')
+    except ConversationItemTooLargeError:
+        log_warning("session too large to save", conversationId=prompt.conversation_id)
+        return
+    log_info("session saved", messages=len(saved['history']), version=saved['version'])
+
+
+# 症状相談キーワード（カテゴリ → キーワード）
+SYMPTOM_KEYWORDS: Dict[str, List[str]] = {
+    "痛み": ["痛い", "痛み", "痛", "いたい"],
+    "症状": [
+        "症状", "発熱", "熱", "吐き気", "めまい", "しびれ",
+        "頭痛", "腹痛", "胸痛", "背中が痛", "関節痛",
+        "息苦しい", "息切れ", "咳", "鼻水", "下痢", "便秘",
+    ],
+    "体調不良": [
+        "体調不良", "調子が悪い", "具合が悪い", "気分が悪い",
+        "だるい", "倦怠感", "疲れ", "眠れない", "不眠",
+    ],
+    "病気": ["病気", "疾患", "診断", "受診", "医者"],
+    "その他": ["赤い", "腫れ", "かゆい", "発疹", "しこり"],
+}
+
+# カテゴリの重み（症状分類のスコア用。汎用的な語が多いカテゴリは低め）
+SYMPTOM_CATEGORY_WEIGHTS: Dict[str, float] = {
+    "痛み": 1.0,
+    "症状": 1.0,
+    "体調不良": 0.8,
+    "病気": 0.6,
+    "その他": 0.5,
+}
+
+_symptom_matcher: Optional[KeywordMatcher] = None
+
+
+def get_symptom_matcher() -> KeywordMatcher:
+    """症状キーワードの検索オートマトン（初回使用時に作成し、ウォームスタート間で再利用）"""
+    global _symptom_matcher
+    if _symptom_matcher is None:
+        _symptom_matcher = KeywordMatcher.from_groups(SYMPTOM_KEYWORDS)
+    return _symptom_matcher
+
+
+def classify_symptoms(user_message: str) -> Dict[str, float]:
+    """
+    症状キーワードのカテゴリ別スコア（メッセージを1回走査）
+
+    Returns:
+        {カテゴリ: 一致数 × 重み}（スコアの高い順。一致なしは空dict）
+    """
+    counts = get_symptom_matcher().count_by_payload(user_message)
+    scores = {
+        category: count * SYMPTOM_CATEGORY_WEIGHTS.get(category, 1.0)
+        for category, count in counts.items()
+    }
+    return dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
 
 
 def detect_symptoms_consultation(user_message: str) -> bool:
@@ -252,24 +728,7 @@ def detect_symptoms_consultation(user_message: str) -> bool:
     Returns:
         bool: 症状関連キーワードが含まれている場合 True
     """
-    symptoms_keywords = [
-        # 痛み系
-        "痛い", "痛み", "痛", "いたい",
-        # 症状系
-        "症状", "発熱", "熱", "吐き気", "めまい", "しびれ",
-        "頭痛", "腹痛", "胸痛", "背中が痛", "関節痛",
-        "息苦しい", "息切れ", "咳", "鼻水", "下痢", "便秘",
-        # 体調不良系
-        "体調不良", "調子が悪い", "具合が悪い", "気分が悪い",
-        "だるい", "倦怠感", "疲れ", "眠れない", "不眠",
-        # 病気系
-        "病気", "疾患", "診断", "受診", "医者",
-        # その他
-        "赤い", "腫れ", "かゆい", "発疹", "しこり"
-    ]
-
-    user_message_lower = user_message.lower()
-    return any(keyword in user_message_lower for keyword in symptoms_keywords)
+    return get_symptom_matcher().contains_any(user_message)
 
 
 def build_chat_messages(
@@ -277,70 +736,144 @@ def build_chat_messages(
     conversation_history: List[Dict],
     blood_data: Optional[Dict],
     vital_data: Optional[Dict],
-    gene_data: Optional[Dict]
+    gene_data: Optional[Dict],
+    data_contexts: Optional[Dict[str, str]] = None,
+    routed_contexts: Optional[Dict[str, str]] = None
 ) -> List[Dict]:
-    """チャットメッセージを構築（v8完全版: 基本改善 + 症状相談 + テーマ別）"""
+    """
+    チャットメッセージを構築（v8完全版: 基本改善 + 症状相談 + テーマ別）
+
+    プロンプトキャッシュが効くよう、変化しにくい順に並べる:
+    1. システムプロンプト（静的・全リクエストでバイト単位で同一）
+    2. データコンテキスト（会話中はほぼ不変）
+    3. 会話履歴（ターンごとに末尾へ追加されるだけ）
+    4. 質問内容で絞り込んだデータコンテキスト（メッセージごとに変化）
+    5. 症状ヒント（メッセージごとに変化）
+    6. ユーザーメッセージ
+
+    Args:
+        data_contexts: 描画済みのデータコンテキスト（セッション保存分など）。
+            blood_data/vital_data/gene_data が指定された場合はそちらで上書きする
+        routed_contexts: 質問内容で絞り込んだデータコンテキスト（intent_router）
+    """
 
     messages = []
 
-    # システムプロンプト（完全版）
+    # システムプロンプト（完全版）: 必ず先頭に置き、前に可変要素を挟まない
     system_prompt = build_system_prompt()
     messages.append({
         "role": "system",
         "content": system_prompt
     })
 
-    # 症状相談キーワード検出（ヒント）
-    if detect_symptoms_consultation(user_message):
+    # データコンテキスト（血液 → バイタル → 遺伝子の固定順）
+    contexts = dict(data_contexts or {})
+    contexts.update(render_data_contexts(blood_data, vital_data, gene_data))
+    for key in DATA_CONTEXT_KEYS:
+        if contexts.get(key):
+            messages.append({
+                "role": "system",
+                "content": contexts[key]
+            })
+
+    # 会話履歴を追加（トークン上限を超える古いターンは要約に置き換え）
+    for msg in compact_history(conversation_history):
         messages.append({
-            "role": "system",
-            "content": "【ヒント】ユーザーのメッセージに症状関連のキーワードが含まれています。症状相談モードの適用を検討してください。"
+            "role": msg.get("role"),
+            "content": msg.get("content")
         })
 
-    # 血液データが提供された場合、コンテキストを追加
-    if blood_data:
-        blood_context = build_blood_data_context(blood_data)
+    # 絞り込み済みのデータコンテキスト: 今回のメッセージ依存のため会話履歴の後に置く
+    for key in DATA_CONTEXT_KEYS:
+        if routed_contexts and routed_contexts.get(key):
+            messages.append({
+                "role": "system",
+                "content": routed_contexts[key]
+            })
+
+    # 症状相談キーワード検出（ヒント）: 今回のメッセージ依存のため末尾側に置く
+    symptom_scores = classify_symptoms(user_message)
+    if symptom_scores:
+        categories = "、".join(symptom_scores)
         messages.append({
             "role": "system",
-            "content": blood_context
+            "content": (
+                "【ヒント】ユーザーのメッセージに症状関連のキーワードが含まれています"
+                f"（{categories}）。症状相談モードの適用を検討してください。"
+            )
         })
 
+    # ユーザーメッセージを追加
+    messages.append({
+        "role": "user",
+        "content": user_message
+    })
+
+    return messages
+
+
+# データコンテキストの並び順（プロンプトキャッシュのため固定）
+DATA_CONTEXT_KEYS = ("blood", "vital", "gene")
+# 質問内容で絞り込むデータコンテキスト（intent_router）
+ROUTED_CONTEXT_KEYS = ("blood", "vital")
+
+
+def render_data_contexts(
+    blood_data: Optional[Dict],
+    vital_data: Optional[Dict],
+    gene_data: Optional[Dict],
+    route: Optional[IntentRoute] = None,
+    context_format: str = "verbose",
+    query: str = ""
+) -> Dict[str, str]:
+    """
+    提供されたデータのコンテキスト文字列を描画（キー: blood / vital / gene）
+
+    同じ入力の描画結果はキャッシュから返す（context_cache）。
+
+    Args:
+        route: 質問内容による絞り込み（intent_router）。指定時は関連しない正常範囲の
+            血液項目とバイタル項目を除く
+        context_format: 血液・バイタルデータの形式（"verbose" / "compact"）
+        query: ユーザーの質問。遺伝子データが上限を超えて要約する場合のみ、マーカーの並び順に使う
+    """
+    contexts = {}
+    compact = context_format == "compact"
+
+    # 血液データが提供された場合、コンテキストを追加
+    if blood_data:
+        blood_items, omitted = filter_blood_items(blood_data, route)
+        kind, renderer = ("blood_compact", build_blood_data_context_compact) if compact else ("blood", build_blood_data_context)
+        if omitted:
+            contexts["blood"] = render_cached(kind, renderer, blood_items, omitted=omitted)
+        else:
+            contexts["blood"] = render_cached(kind, renderer, blood_items)
+
     # バイタルデータが提供された場合、コンテキストを追加
+    vital_data = filter_vital_data(vital_data, route)
     if vital_data:
-        vital_context = build_vital_data_context(vital_data)
-        messages.append({
-            "role": "system",
-            "content": vital_context
-        })
+        if compact:
+            contexts["vital"] = render_cached("vital_compact", build_vital_data_context_compact, vital_data)
+        else:
+            contexts["vital"] = render_cached("vital", build_vital_data_context, vital_data)
 
     # 遺伝子データが提供された場合、コンテキストを追加
     if gene_data:
         available_categories = gene_data.get('availableCategories')
         if available_categories:
             # 利用可能なカテゴリーリストのみ提供
-            gene_context = build_available_categories_context(available_categories)
+            contexts["gene"] = render_cached("gene_categories", build_available_categories_context, available_categories)
         else:
-            # 実際の遺伝子データ提供
-            gene_context = build_gene_data_context(gene_data)
-        messages.append({
-            "role": "system",
-            "content": gene_context
-        })
-
-    # 会話履歴を追加
-    for msg in conversation_history:
-        messages.append({
-            "role": msg.get("role"),
-            "content": msg.get("content")
-        })
-
-    # ユーザーメッセージを追加
-    messages.append({
-        "role": "user",
-        "content": user_message
-    })
+            # 実際の遺伝子データ提供（上限を超える場合だけ質問に応じて要約する。
+            # 質問はキャッシュキーに入るため、上限内のデータでは渡さない）
+            full = render_cached("gene", build_gene_data_context, gene_data)
+            if gene_context_within_bounds(gene_data, full):
+                contexts["gene"] = full
+            else:
+                # 全体の描画は済んでいるため要約だけを行う
+                contexts["gene"] = render_cached("gene_bounded", build_gene_data_summary_context, gene_data, query=query)
 
-    return messages
+    return contexts
 
 
 def build_system_prompt() -> str:
@@ -923,308 +1456,194 @@ def build_system_prompt() -> str:
 """
 
 
-def build_initial_context(blood_data: Optional[List[Dict]], available_gene_categories: List[str]) -> str:
-    """初回メッセージのコンテキスト（血液データ + 遺伝子カテゴリーリスト）"""
-    context_parts = []
+def chat_completion_params(messages: List[Dict]) -> Dict:
+    """Chat Completions（非ストリーミング）のパラメーター（同期版・asyncio版で共通）"""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": messages,
+        "max_completion_tokens": MAX_COMPLETION_TOKENS,
+        "prompt_cache_key": PROMPT_CACHE_KEY,
+    }
 
-    # 血液データ
-    if blood_data:
-        context_parts.append("【ユーザーの血液検査結果】")
 
-        normal_items = []
-        attention_items = []
-        abnormal_items = []
+def log_openai_request(messages: List[Dict]) -> None:
+    # プロンプトのトークン数（token_counter。語彙を同梱していない場合は日本語を考慮した概算）
+    log_info(
+        "calling OpenAI", messages=len(messages),
+        promptTokensCounted=count_messages_tokens(messages), tokenizer=tokenizer_name()
+    )
+    log_debug("prompt message tokens", tokens=lambda: message_token_counts(messages))
 
-        for item in blood_data:
-            status = item.get('status', '').lower()
-            item_text = f"- {item.get('nameJp', item.get('key'))}: {item.get('value')} {item.get('unit')} (基準値: {item.get('reference')})"
 
-            if status in ['正常', 'normal']:
-                normal_items.append(item_text)
-            elif status in ['注意', 'caution', '要注意']:
-                attention_items.append(item_text)
-            else:
-                abnormal_items.append(item_text)
-
-        # 異常値を優先表示
-        if abnormal_items:
-            context_parts.append("\n【要注意】以下の項目が異常値です：")
-            context_parts.extend(abnormal_items)
-
-        if attention_items:
-            context_parts.append("\n【注意】以下の項目が基準値外です：")
-            context_parts.extend(attention_items)
-
-        if normal_items:
-            context_parts.append(f"\n【正常範囲】{len(normal_items)}項目が正常範囲内")
-
-    # 利用可能な遺伝子カテゴリー
-    if available_gene_categories:
-        context_parts.append("\n\n【利用可能な遺伝子データカテゴリー】")
-        context_parts.append("以下のカテゴリーの遺伝子情報を要求できます：")
-        for category in available_gene_categories:
-            context_parts.append(f"- {category}")
-        context_parts.append("\n必要に応じて「🧬 [カテゴリー名]に関する遺伝子情報」の形式で要求してください。")
-
-    return "\n".join(context_parts)
-
-
-def build_gene_data_context(gene_data: Dict) -> str:
-    """遺伝子データのコンテキスト（2段階抽出対応 + 自動検出対応）"""
-    context_parts = ["【ユーザーの遺伝子データ】"]
-    has_data = False
-
-    for category, markers in gene_data.items():
-        # 空のマーカーリストを検出
-        if not markers:
-            context_parts.append(f"\n■ {category}: データが見つかりませんでした（小カテゴリー名が正しいか確認してください）")
-            continue
-
-        context_parts.append(f"\n■ {category}")
-        has_data = True
-
-        # 自動検出形式: markers が辞書（単一マーカー）の場合
-        # 従来形式: markers が配列（複数マーカー）の場合
-        if isinstance(markers, dict):
-            # 自動検出形式: {title, genotypes, impact} の辞書
-            marker = markers
-            title = marker.get('title', category)  # titleがなければカテゴリー名を使用
-
-            if 'genotypes' in marker:
-                genotypes = marker.get('genotypes', {})
-                impact = marker.get('impact', {})
-
-                context_parts.append(f"  - {title}")
-
-                # 遺伝子型を表示
-                for snp_id, genotype in genotypes.items():
-                    context_parts.append(f"    {snp_id}: {genotype}")
-
-                # 影響スコアがある場合は表示
-                if impact:
-                    protective = impact.get('protective', 0)
-                    risk = impact.get('risk', 0)
-                    neutral = impact.get('neutral', 0)
-                    score = impact.get('score', 0)
-
-                    context_parts.append(f"    影響: 保護{protective}/リスク{risk}/中立{neutral} (スコア: {score:+d})")
-            else:
-                context_parts.append(f"  - {title}")
-        elif isinstance(markers, list):
-            # 従来形式: マーカーの配列
-            for marker in markers:
-                title = marker.get('title', '')
-
-                # 2段階抽出対応: メタデータのみ vs SNPsデータ
-                if 'genotypes' in marker:
-                    # Pattern 1: SNPsデータが含まれる場合（第2段階）
-                    genotypes = marker.get('genotypes', {})
-                    impact = marker.get('impact', {})
-
-                    context_parts.append(f"  - {title}")
-
-                    # 遺伝子型を表示
-                    for snp_id, genotype in genotypes.items():
-                        context_parts.append(f"    {snp_id}: {genotype}")
-
-                    # 影響スコアがある場合は表示
-                    if impact:
-                        protective = impact.get('protective', 0)
-                        risk = impact.get('risk', 0)
-                        neutral = impact.get('neutral', 0)
-                        score = impact.get('score', 0)
-
-                        context_parts.append(f"    影響: 保護{protective}/リスク{risk}/中立{neutral} (スコア: {score:+d})")
-                else:
-                    # Pattern 2: メタデータのみの場合（第1段階）
-                    # タイトルのみを簡潔にリスト表示
-                    context_parts.append(f"  - {title}")
-        else:
-            # 予期しない形式
-            context_parts.append(f"  - (不明な形式: {type(markers).__name__})")
+def read_chat_completion(response) -> str:
+    """応答本文を取り出し、使用トークン数をログ出力"""
+    assistant_message = response.choices[0].message.content
 
-    # 全カテゴリーが空の場合の明示的なエラーメッセージ
-    if not has_data:
-        return "【ユーザーの遺伝子データ】\n要求された遺伝子データがシステムから返されませんでした。小カテゴリー名の形式が正しいか確認してください。\n\n※ヒント: 小カテゴリーは半角カンマ「,」で区切る必要があります。"
+    # 使用トークン数をログ出力
+    usage = response.usage
+    log_prompt_cache_usage(usage)
 
-    return "\n".join(context_parts)
+    return assistant_message
 
 
-def build_blood_data_context(blood_data: Dict) -> str:
-    """血液データのコンテキスト"""
-    context_parts = ["【ユーザーの血液検査結果】"]
+def call_openai(client: OpenAI, messages: List[Dict], max_retries: int = OPENAI_MAX_ATTEMPTS) -> str:
+    """OpenAI APIを呼び出し（429 / 5xx / 接続エラーはリトライ。retry_scheduler。ヘッジ有効時は hedging）"""
+    log_openai_request(messages)
 
-    normal_items = []
-    attention_items = []
-    abnormal_items = []
+    if OPENAI_HEDGE_ENABLED:
+        # ヘッジは最初のトークンで勝敗を決めるため、内部ではストリーミングで受け取る
+        return "".join(open_openai_stream(client, messages, max_retries=max_retries))
 
-    # 配列形式の血液データに対応
-    for item in blood_data:
-        key = item.get('key', '')
-        status = item.get('status', '').lower()
-        item_text = f"- {item.get('nameJp', key)}: {item.get('value')} {item.get('unit')} (基準値: {item.get('reference')})"
+    params = chat_completion_params(messages)
 
-        if status in ['正常', 'normal']:
-            normal_items.append(item_text)
-        elif status in ['注意', 'caution', '要注意']:
-            attention_items.append(item_text)
-        else:
-            abnormal_items.append(item_text)
-
-    # 異常値を優先表示
-    if abnormal_items:
-        context_parts.append("\n【要注意】以下の項目が異常値です：")
-        context_parts.extend(abnormal_items)
-
-    if attention_items:
-        context_parts.append("\n【注意】以下の項目が基準値外です：")
-        context_parts.extend(attention_items)
-
-    if normal_items:
-        context_parts.append("\n【正常範囲】以下の項目が正常範囲内です：")
-        context_parts.extend(normal_items)
-
-    return "\n".join(context_parts)
-
-
-def build_vital_data_context(vital_data: Dict) -> str:
-    """バイタルデータ（HealthKitデータ）のコンテキスト"""
-    context_parts = ["【ユーザーのバイタルデータ（最新7日間）】"]
-
-    # 体組成系
-    body_metrics = []
-    if vital_data.get('bodyMass'):
-        body_metrics.append(f"- 体重: {vital_data['bodyMass']:.1f} kg")
-    if vital_data.get('height'):
-        body_metrics.append(f"- 身長: {vital_data['height']:.1f} cm")
-    if vital_data.get('bodyFatPercentage'):
-        body_metrics.append(f"- 体脂肪率: {vital_data['bodyFatPercentage']*100:.1f}%")
-    if vital_data.get('leanBodyMass'):
-        body_metrics.append(f"- 除脂肪体重: {vital_data['leanBodyMass']:.1f} kg")
-    if body_metrics:
-        context_parts.append("\n【体組成】")
-        context_parts.extend(body_metrics)
-
-    # 心臓・循環器系
-    cardiac_metrics = []
-    if vital_data.get('restingHeartRate'):
-        cardiac_metrics.append(f"- 安静時心拍数: {vital_data['restingHeartRate']:.0f} bpm")
-    if vital_data.get('vo2Max'):
-        cardiac_metrics.append(f"- VO2Max: {vital_data['vo2Max']:.1f} ml/kg/min")
-    if vital_data.get('heartRateVariability'):
-        cardiac_metrics.append(f"- 心拍変動 (HRV): {vital_data['heartRateVariability']:.0f} ms")
-    if vital_data.get('heartRate'):
-        cardiac_metrics.append(f"- 心拍数: {vital_data['heartRate']:.0f} bpm")
-    if cardiac_metrics:
-        context_parts.append("\n【心臓・循環器】")
-        context_parts.extend(cardiac_metrics)
-
-    # 活動量系
-    activity_metrics = []
-    if vital_data.get('activeEnergyBurned'):
-        activity_metrics.append(f"- アクティブカロリー: {vital_data['activeEnergyBurned']:.0f} kcal")
-    if vital_data.get('exerciseTime'):
-        activity_metrics.append(f"- エクササイズ時間: {vital_data['exerciseTime']:.0f} 分")
-    if vital_data.get('stepCount'):
-        activity_metrics.append(f"- 歩数: {vital_data['stepCount']:.0f} steps")
-    if activity_metrics:
-        context_parts.append("\n【活動量】")
-        context_parts.extend(activity_metrics)
-
-    # 移動距離系
-    distance_metrics = []
-    if vital_data.get('walkingRunningDistance'):
-        distance_metrics.append(f"- 歩行・ランニング距離: {vital_data['walkingRunningDistance']:.2f} km")
-    if vital_data.get('cyclingDistance'):
-        distance_metrics.append(f"- サイクリング距離: {vital_data['cyclingDistance']:.2f} km")
-    if distance_metrics:
-        context_parts.append("\n【移動距離】")
-        context_parts.extend(distance_metrics)
-
-    return "\n".join(context_parts)
-
-
-def build_available_categories_context(available_categories: List[str]) -> str:
-    """利用可能な遺伝子カテゴリーのコンテキスト"""
-    context_parts = ["【利用可能な遺伝子データカテゴリー】"]
-    context_parts.append("以下のカテゴリーの遺伝子情報を要求できます：")
-    for category in available_categories:
-        context_parts.append(f"- {category}")
-    context_parts.append("\n必要に応じて「🧬 [カテゴリー名]に関する遺伝子情報」の形式で要求してください。")
-    return "\n".join(context_parts)
-
-
-def call_openai(client: OpenAI, messages: List[Dict], max_retries: int = 3) -> str:
-    """OpenAI APIを呼び出し（レートリミット対策付き）"""
-    print(f"🤖 Calling OpenAI API with {len(messages)} messages")
-
-    # メッセージのトークン数を概算（デバッグ用）
-    total_chars = sum(len(msg.get('content', '')) for msg in messages)
-    estimated_tokens = total_chars // 4
-    print(f"📊 Estimated tokens: ~{estimated_tokens}")
-
-    last_error = None
-
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
-                model="gpt-5.1-chat-latest",
-                messages=messages,
-                max_completion_tokens=2500  # v8: 3レイヤー応答に対応するため増加（1500→2500）
-            )
+    def create():
+        # 試行ごとにレート制限の予算を予約し（rate_limiter）、タイムアウトはLambdaの残り時間から決める（retry_scheduler）
+        reserve_attempt()
+        return with_attempt_timeout(client).chat.completions.create(**params)
 
-            assistant_message = response.choices[0].message.content
+    response = call_with_retry(create, operation="chat", policy=RetryPolicy(max_attempts=max_retries))
+    return read_chat_completion(response)
 
-            # 使用トークン数をログ出力
-            usage = response.usage
-            print(f"📊 Token usage: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, total={usage.total_tokens}")
 
-            return assistant_message
+def open_openai_stream(client: OpenAI, messages: List[Dict], max_retries: int = OPENAI_MAX_ATTEMPTS) -> Iterator[str]:
+    """
+    OpenAI APIをストリーミングで呼び出し、テキスト差分のイテレーターを返す
 
-        except Exception as e:
-            last_error = e
-            error_str = str(e).lower()
-
-            # レートリミットエラーの場合はリトライ
-            if "rate_limit" in error_str or "429" in str(e) or "rate limit" in error_str:
-                wait_time = (2 ** attempt) + 1  # 1秒, 3秒, 5秒
-                print(f"⚠️ Rate limit hit (attempt {attempt + 1}/{max_retries}), waiting {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-
-            # その他のエラーはすぐにraise
-            print(f"❌ OpenAI API error: {str(e)}")
-            raise
+    リトライはストリーム開始前（create呼び出し）のみ行う。
+    一度テキストを受信し始めた後のエラーはそのままraiseする。
+    ヘッジ有効時（OPENAI_HEDGE_ENABLED）は最初のテキストが届くまでを1回の試行とし、
+    閾値を過ぎたら2本目のリクエストを送って先に届いた方を使う（hedging）。
+    """
+    log_info("streaming OpenAI", messages=len(messages), hedging=OPENAI_HEDGE_ENABLED)
+
+    def create(model: str):
+        # 試行（ヘッジの各リクエストを含む）ごとにレート制限の予算を予約し、タイムアウトはLambdaの残り時間から決める
+        reserve_attempt()
+        return with_attempt_timeout(client).chat.completions.create(
+            model=model,
+            messages=messages,
+            max_completion_tokens=MAX_COMPLETION_TOKENS,
+            prompt_cache_key=PROMPT_CACHE_KEY,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
 
-    # 最大リトライ回数を超えた場合
-    print(f"❌ Max retries ({max_retries}) exceeded. Last error: {str(last_error)}")
-    raise last_error
+    if OPENAI_HEDGE_ENABLED:
+        call = lambda: hedged_call(lambda model: prime_stream(create(model)), OPENAI_MODEL)
+    else:
+        call = lambda: create(OPENAI_MODEL)
+
+    stream = call_with_retry(call, operation="chat_stream", policy=RetryPolicy(max_attempts=max_retries))
+    return _iter_stream_deltas(stream)
+
+
+def _iter_stream_deltas(stream) -> Iterator[str]:
+    """ストリームのチャンクからテキスト差分のみを取り出す"""
+    for chunk in stream:
+        if chunk.choices:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+        # include_usage指定時は最後のチャンクにusageが入る
+        usage = getattr(chunk, 'usage', None)
+        if usage:
+            log_prompt_cache_usage(usage)
+
+
+def log_prompt_cache_usage(usage) -> None:
+    """トークン使用量とプロンプトキャッシュのヒット状況（キャッシュ済み/未キャッシュのプロンプトトークン数）をログ出力"""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (getattr(details, 'cached_tokens', None) or 0) if details else 0
+    prompt_tokens = usage.prompt_tokens or 0
+    uncached_tokens = prompt_tokens - cached_tokens
+    hit_rate = (cached_tokens / prompt_tokens * 100) if prompt_tokens else 0.0
+    log_info(
+        "token usage",
+        promptTokens=prompt_tokens,
+        completionTokens=usage.completion_tokens,
+        totalTokens=usage.total_tokens,
+        cachedPromptTokens=cached_tokens,
+        uncachedPromptTokens=uncached_tokens,
+        promptCacheHitRate=round(hit_rate, 1)
+    )
+
+
+def iter_response_sections(deltas: Iterable[str]) -> Iterator[str]:
+    """
+    テキスト差分を受け取り、「---」区切りのセクションが完成するたびに返す
+
+    区切りがデルタをまたぐ場合やテーブル行の扱いはSectionSplitterが処理する。
+    """
+    splitter = SectionSplitter()
+    for delta in deltas:
+        yield from splitter.feed(delta)
+
+    for section in splitter.close():
+        if section:
+            yield section
 
 
+def stream_chat_events(client: OpenAI, messages: List[Dict]) -> Iterator[Dict]:
+    """
+    ストリーミング応答のイベント列を生成
+
+    - {"type": "chunk", "index": n, "content": "..."}: セクションが完成するたびに出力
+    - {"type": "done", ...}: 最後に従来形式の response/chunks を含むエンベロープを出力（後方互換）
+    """
+    started_at = time.perf_counter()
+    deltas = time_first_item(
+        call_with_auth_refresh(open_openai_stream, client, messages), "openaiFirstToken", started_at
+    )
+    if REDACT_MODEL_OUTPUT and PII_SANITIZER_AVAILABLE:
+        deltas = StreamingRedactor().redact(deltas)
+    received = []
+
+    def recording(source: Iterable[str]) -> Iterator[str]:
+        for delta in source:
+            received.append(delta)
+            yield delta
+
+    for index, section in enumerate(iter_response_sections(recording(deltas))):
+        yield {'type': 'chunk', 'index': index, 'content': section}
+
+    record_timing("openaiTotal", (time.perf_counter() - started_at) * 1000)
+    response = "".join(received)
+    log_info("streamed response", responseChars=len(response))
+    envelope = build_response_envelope(response, split_response_into_chunks(response))
+    envelope['type'] = 'done'
+    yield envelope
+
+
+def redact_model_output(response: str) -> str:
+    """モデルの応答（非ストリーミング）から連絡先のPIIをマスク"""
+    if not (REDACT_MODEL_OUTPUT and PII_SANITIZER_AVAILABLE):
+        return response
+    return PIISanitizer.redact_output(response)
+
+
+def build_response_envelope(response: str, chunks: List[str]) -> Dict:
+    """クライアントへ返すレスポンス本体（非ストリーミング / ストリーミング最終イベント共通）"""
+    return {
+        'response': response,  # 後方互換
+        'chunks': chunks,
+        'chunked': True,
+        'timestamp': datetime.now().isoformat(),
+        'disclaimer': 'この情報は参考情報です。医療的な判断は医師にご相談ください。'
+    }
+
+
+@span("chunkSplit")
 def split_response_into_chunks(response_text: str) -> list:
     """セクション区切り「---」でチャンク分割。失敗時は全体を1チャンクに"""
-    # 「---」でセクション分割
-    if '---' in response_text:
-        chunks = [chunk.strip() for chunk in response_text.split('---') if chunk.strip()]
-        # 【セクションX:】のラベルを除去（出力には不要）
-        cleaned_chunks = []
-        for chunk in chunks:
-            # 【セクション1: あなたの分析】のような行を除去
-            lines = chunk.split('\n')
-            filtered_lines = [line for line in lines if not line.strip().startswith('【セクション')]
-            cleaned_chunk = '\n'.join(filtered_lines).strip()
-            if cleaned_chunk:
-                cleaned_chunks.append(cleaned_chunk)
-        return cleaned_chunks if cleaned_chunks else [response_text.strip()]
-
-    # 「---」がない場合は全体を1チャンクに
-    return [response_text.strip()]
-
-
-def cors_headers():
+    # 【セクションX:】のラベル除去とテーブル行の判定はSectionSplitterで1パス処理
+    return split_sections(response_text)
+
+
+def cors_headers(content_type: str = 'application/json'):
     """CORS ヘッダー"""
     return {
-        'Content-Type': 'application/json',
+        'Content-Type': content_type,
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Headers': 'Content-Type,Authorization',
         'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
@@ -0,0 +1,83 @@
+"""
+lru_cache.py - サイズ上限付きのインプロセスLRUキャッシュ
+
+Lambdaのウォームスタート間で再利用されるモジュールレベルのキャッシュ用。
+- 最大件数を超えると最も古く使われたエントリーから削除
+- ヒット/ミス数を保持（ログ・メトリクス出力用）
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """スレッドセーフなサイズ上限付きLRUキャッシュ"""
+
+    def __init__(self, max_size: int = 256):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """値を取得（ヒット時は最新として扱う）"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """値を保存（上限を超えた分は古い順に削除）"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """キャッシュにあれば返し、なければ計算して保存"""
+        sentinel = _MISSING
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """ヒット/ミス数やLRU順序を変えずに値を参照"""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def clear(self) -> None:
+        """全エントリーとカウンターをリセット"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """ヒット/ミス数とヒット率"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else None,
+        }
+
+
+_MISSING = object()
@@ -2,15 +2,180 @@
 pii_sanitizer.py - OpenAI送信前のPII除去モジュール
 
 OpenAI APIへ送信する前に、個人識別情報（PII）を除去またはマスクする。
-- ユーザーID: ソルト付きハッシュで匿名化
+- ユーザーID: ソルト付きHMACで匿名化（user_tokenizer.py）
 - メールアドレス/電話番号: マスク
 - 遺伝子データ: SNP rs番号を除去し、影響スコアのみ保持
+- 会話履歴: メッセージ内容のハッシュをキーにサニタイズ結果をキャッシュ（新しいターンだけ走査）
+- モデルの応答: 連絡先（メールアドレス・電話番号・ID番号）のみマスク。StreamingRedactor でストリーミング中の
+  テキスト差分にも適用（rs番号・日付は回答の本文として残す）
 """
 
 import hashlib
 import re
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from lru_cache import LRUCache
+from user_tokenizer import ANONYMOUS_TOKEN, get_user_tokenizer
+
+# 会話履歴のサニタイズ結果キャッシュの件数上限（メッセージ単位）
+PII_HISTORY_CACHE_SIZE = int(os.environ.get('PII_HISTORY_CACHE_SIZE', '2048'))
+
+# どのPIIパターンも数字か「@」を含む（rs番号も数字が必須）。含まない文字列は走査不要
+PII_CANDIDATE = re.compile(r'[\d@]')
+# PIIパターンに現れうる記号（英数字・アンダースコア以外）
+PII_PATTERN_PUNCTUATION = frozenset('._%+-−/@|')
+# PIIの一致に含まれうる文字: ASCII英数字・Unicodeの数字・上記の記号
+# + IGNORECASEで [A-Za-z] に一致する非ASCII文字（ſ, K(ケルビン), İ, ı）
+PII_MATCHABLE_EXTRA = PII_PATTERN_PUNCTUATION | frozenset('ſ\u212aİı')
+
+
+class PIIScrubber:
+    """
+    PIIパターンを事前コンパイルし、1回の走査でまとめて置換するエンジン
+
+    全パターンを名前付きグループの1つの選択（alternation）に結合して走査する。
+    従来の「パターンごとに順番に re.sub」と結果が変わりうるのは、異なるパターンの
+    候補が重なる・隣接する場合（例: "123-0456-7890-1234"）だけなので、
+    そのような一致を検出したときだけ従来どおりの順次置換にフォールバックする。
+    """
+
+    def __init__(self, patterns: List[Tuple[str, str]]):
+        self.replacements = [replacement for _, replacement in patterns]
+        self.compiled = [re.compile(pattern, re.IGNORECASE) for pattern, _ in patterns]
+        self.combined = re.compile(_combine_patterns([pattern for pattern, _ in patterns]), re.IGNORECASE)
+
+    def scrub(self, text: str) -> str:
+        """テキストからPIIパターンを除去（sanitize_textの本体）"""
+        if not text:
+            return ""
+        if not PII_CANDIDATE.search(text):
+            return text
+
+        parts = []
+        last_end = 0
+        for match in self.combined.finditer(text):
+            index = int(match.lastgroup[1:])
+            if not self._is_isolated(text, match, index):
+                return self.scrub_sequential(text)
+            parts.append(text[last_end:match.start()])
+            parts.append(self.replacements[index])
+            last_end = match.end()
+
+        if not parts:
+            return text
+        parts.append(text[last_end:])
+        return "".join(parts)
+
+    def scrub_sequential(self, text: str) -> str:
+        """パターンを優先順に1つずつ適用（従来の処理と同じ結果）"""
+        result = text
+        for compiled, replacement in zip(self.compiled, self.replacements):
+            result = compiled.sub(replacement, result)
+        return result
+
+    def _is_isolated(self, text: str, match: re.Match, index: int) -> bool:
+        """
+        一致箇所を単独で置換しても順次置換と同じ結果になるか
+
+        - 前後の文字がどのパターンにも含まれえない文字（空白、句読点など）である
+        - 優先度の高いパターンが一致箇所の内側で一致しない
+        """
+        start, end = match.span()
+        if start > 0 and _is_pattern_char(text[start - 1]):
+            return False
+        if end < len(text) and _is_pattern_char(text[end]):
+            return False
+        if index > 0:
+            span_text = text[start:end]
+            return not any(compiled.search(span_text) for compiled in self.compiled[:index])
+        return True
+
+
+def _combine_patterns(patterns: List[str]) -> str:
+    """
+    パターンを名前付きグループ（p0, p1, ...）の選択に結合
+
+    全パターンが \\b で始まる場合は先頭に括り出す（単語境界以外の位置で
+    各パターンを試さずに済む）。
+    """
+    prefix = ''
+    if all(pattern.startswith(r'\b') for pattern in patterns):
+        prefix = r'\b'
+        patterns = [pattern[2:] for pattern in patterns]
+    alternation = "|".join(f"(?P<p{index}>{pattern})" for index, pattern in enumerate(patterns))
+    return f"{prefix}(?:{alternation})"
+
+
+def _is_pattern_char(char: str) -> bool:
+    return char.isalnum() or char == '_' or char in PII_PATTERN_PUNCTUATION
+
+
+def _can_be_in_match(char: str) -> bool:
+    """PIIパターンの一致に含まれうる文字か（日本語の文字・空白・句読点は含まれない）"""
+    return (char.isascii() and char.isalnum()) or char.isdecimal() or char in PII_MATCHABLE_EXTRA
+
+
+class StreamingRedactor:
+    """
+    ストリーミング応答のテキスト差分からPIIをマスク（既定は OUTPUT_PII_PATTERNS）
+
+    PIIの一致は「一致に含まれうる文字」（ASCII英数字・数字・一部記号）の連続の中にしか
+    現れないため、末尾のその連続部分（まだメールアドレスや電話番号に育つ可能性がある部分）
+    だけを保留し、それより前は即座にマスクして返す。
+    - 日本語の文字や空白で区切られた時点で確定するため、通常の保留は数文字
+    - 保留は最大 max_hold_chars 文字（超えた場合はその時点の内容でマスクして出力）
+    - 確定部分は直前の1文字を文脈として付けてマスクする（\\b の判定を全文と同じにするため）
+
+    使い方:
+        redactor = StreamingRedactor()
+        for delta in deltas:
+            yield redactor.feed(delta)
+        yield redactor.close()
+    """
+
+    DEFAULT_MAX_HOLD_CHARS = 256
+
+    def __init__(self, scrubber: Optional[PIIScrubber] = None, max_hold_chars: int = DEFAULT_MAX_HOLD_CHARS):
+        self.scrubber = scrubber or get_output_scrubber()
+        self.max_hold_chars = max_hold_chars
+        self._pending = ""
+        # 出力済みテキストの最後の1文字（一致に含まれない文字の場合のみ）
+        self._context = ""
+
+    def feed(self, delta: str) -> str:
+        """テキスト差分を追加し、マスク済みで確定した部分を返す（なければ空文字）"""
+        self._pending += delta
+        split = len(self._pending)
+        while split > 0 and _can_be_in_match(self._pending[split - 1]):
+            split -= 1
+        if len(self._pending) - split > self.max_hold_chars:
+            split = len(self._pending)
+        if split == 0:
+            return ""
+        ready, self._pending = self._pending[:split], self._pending[split:]
+        return self._scrub(ready)
+
+    def close(self) -> str:
+        """ストリーム終了時に保留中のテキストをマスクして返す"""
+        ready, self._pending = self._pending, ""
+        return self._scrub(ready) if ready else ""
+
+    def redact(self, deltas: Iterable[str]) -> Iterator[str]:
+        """テキスト差分のイテレーターをマスク済みの差分のイテレーターに変換"""
+        for delta in deltas:
+            safe = self.feed(delta)
+            if safe:
+                yield safe
+        tail = self.close()
+        if tail:
+            yield tail
+
+    def _scrub(self, text: str) -> str:
+        context = self._context
+        scrubbed = self.scrubber.scrub(context + text)[len(context):]
+        self._context = text[-1] if not _can_be_in_match(text[-1]) else ""
+        return scrubbed
 
 
 class PIISanitizer:
@@ -25,6 +190,8 @@ class PIISanitizer:
         # SNP rs番号パターン（遺伝子データ用）
         (r'\brs\d+\b', '[SNP]'),
     ]
+    # モデルの応答でマスクするパターン（rs番号・日付は公開情報・回答の本文のため残す）
+    OUTPUT_PII_PATTERNS = [pattern for pattern in PII_PATTERNS if pattern[1] in ('[EMAIL]', '[PHONE]', '[ID]')]
 
     @staticmethod
     def get_salt() -> str:
@@ -40,26 +207,30 @@ class PIISanitizer:
     @classmethod
     def anonymize_user_id(cls, user_id: str) -> str:
         """
-        ユーザーIDをソルト付きハッシュで匿名トークンに変換
+        ユーザーIDをソルト付きHMACで匿名トークンに変換（user_tokenizer.UserTokenizer）
 
         重要: ソルトなしハッシュは禁止（レインボーテーブル攻撃対策）
         """
         if not user_id:
-            return "anonymous"
+            return ANONYMOUS_TOKEN
+        return get_user_tokenizer().token(user_id)
 
-        salt = cls.get_salt()
-        salted_id = f"{salt}:{user_id}"
-        return f"user_{hashlib.sha256(salted_id.encode()).hexdigest()[:12]}"
+    @classmethod
+    def accepted_user_tokens(cls, user_id: str) -> List[str]:
+        """同一ユーザーとして受け入れるトークン（ソルトのローテーション期間中の旧トークンを含む）"""
+        if not user_id:
+            return [ANONYMOUS_TOKEN]
+        return get_user_tokenizer().accepted_tokens(user_id)
 
     @staticmethod
     def sanitize_text(text: str) -> str:
-        """テキストからPIIパターンを除去"""
-        if not text:
-            return ""
-        result = text
-        for pattern, replacement in PIISanitizer.PII_PATTERNS:
-            result = re.sub(pattern, replacement, result, flags=re.IGNORECASE)
-        return result
+        """テキストからPIIパターンを除去（事前コンパイル済みエンジンで1回走査）"""
+        return get_pii_scrubber().scrub(text)
+
+    @staticmethod
+    def redact_output(text: str) -> str:
+        """モデルの応答から連絡先のPIIをマスク（OUTPUT_PII_PATTERNS）"""
+        return get_output_scrubber().scrub(text)
 
     @staticmethod
     def sanitize_blood_data(blood_data: List[Dict]) -> List[Dict]:
@@ -160,21 +331,36 @@ class PIISanitizer:
         }
 
     @staticmethod
-    def sanitize_conversation_history(history: List[Dict]) -> List[Dict]:
-        """会話履歴からPIIを除去"""
+    def sanitize_conversation_history(history: List[Dict], trusted_length: int = 0) -> List[Dict]:
+        """
+        会話履歴からPIIを除去
+
+        過去のターンは毎リクエスト送られてくるため、メッセージ内容のハッシュをキーに
+        結果をキャッシュし、実際に走査するのは初めて見るメッセージだけにする。
+
+        Args:
+            trusted_length: 先頭から何件をサーバー側でサニタイズ済みとして扱うか。
+                この件数分は走査せず、戻り値にも含めない（呼び出し側がサーバー側の
+                サニタイズ済み履歴で補う）
+        """
         if not history:
             return []
         return [
             {
                 "role": msg.get("role", ""),
-                "content": PIISanitizer.sanitize_text(msg.get("content", ""))
+                "content": sanitize_history_text(msg.get("content", ""))
             }
-            for msg in history
+            for msg in history[trusted_length:]
         ]
 
     @classmethod
-    def sanitize_request(cls, request_data: Dict) -> Dict:
-        """OpenAI送信前の統合サニタイズ処理"""
+    def sanitize_request(cls, request_data: Dict, trusted_history_length: int = 0) -> Dict:
+        """
+        OpenAI送信前の統合サニタイズ処理
+
+        Args:
+            trusted_history_length: sanitize_conversation_history の trusted_length
+        """
         sanitized = {
             "user_token": cls.anonymize_user_id(request_data.get("userId", "")),
             "message": cls.sanitize_text(request_data.get("message", "")),
@@ -192,18 +378,61 @@ class PIISanitizer:
 
         if "conversationHistory" in request_data and request_data["conversationHistory"]:
             sanitized["conversationHistory"] = cls.sanitize_conversation_history(
-                request_data["conversationHistory"]
+                request_data["conversationHistory"], trusted_length=trusted_history_length
             )
 
         return sanitized
 
 
-def sanitize_for_openai(body: Dict) -> Dict:
+_default_scrubber: Optional[PIIScrubber] = None
+
+
+def get_pii_scrubber() -> PIIScrubber:
+    """PIISanitizer.PII_PATTERNS をコンパイルしたエンジン（初回使用時に作成）"""
+    global _default_scrubber
+    if _default_scrubber is None:
+        _default_scrubber = PIIScrubber(PIISanitizer.PII_PATTERNS)
+    return _default_scrubber
+
+
+_output_scrubber: Optional[PIIScrubber] = None
+
+
+def get_output_scrubber() -> PIIScrubber:
+    """PIISanitizer.OUTPUT_PII_PATTERNS をコンパイルしたエンジン（モデルの応答用。初回使用時に作成）"""
+    global _output_scrubber
+    if _output_scrubber is None:
+        _output_scrubber = PIIScrubber(PIISanitizer.OUTPUT_PII_PATTERNS)
+    return _output_scrubber
+
+
+_history_cache: Optional[LRUCache] = None
+
+
+def get_history_cache() -> LRUCache:
+    """会話履歴のサニタイズ結果キャッシュ（ウォームスタート間で再利用）"""
+    global _history_cache
+    if _history_cache is None:
+        _history_cache = LRUCache(max_size=PII_HISTORY_CACHE_SIZE)
+    return _history_cache
+
+
+def sanitize_history_text(text: str) -> str:
+    """履歴メッセージ1件をサニタイズ（内容のハッシュでキャッシュ）"""
+    if not text:
+        return ""
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    return get_history_cache().get_or_compute(key, lambda: PIISanitizer.sanitize_text(text))
+
+
+def sanitize_for_openai(body: Dict, trusted_history_length: int = 0) -> Dict:
     """
     便利関数: Lambda handlerから直接呼び出し可能
 
     Args:
         body: リクエストボディ
+        trusted_history_length: 会話履歴の先頭から何件をサニタイズ済みとして扱うか
+            （サーバー側セッションで検証できる場合のみ指定する）
 
     Returns:
         サニタイズ済みデータ
@@ -211,4 +440,4 @@ def sanitize_for_openai(body: Dict) -> Dict:
     Raises:
         ValueError: PII_SALT環境変数が設定されていない場合
     """
-    return PIISanitizer.sanitize_request(body)
+    return PIISanitizer.sanitize_request(body, trusted_history_length=trusted_history_length)
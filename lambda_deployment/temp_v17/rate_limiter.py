@@ -0,0 +1,272 @@
+"""
+rate_limiter.py - OpenAI呼び出しの共有レート制限（requests/min・tokens/min）
+
+多数のLambdaインスタンスが同時にOpenAIを呼ぶと組織全体の上限で429になり、
+リトライの待ち時間でLambdaの実行時間を消費する。呼び出し前に全インスタンス共通の予算から
+リクエスト数とトークン数（プロンプト + max_completion_tokens。OpenAI側の数え方と同じ）を予約し、
+予算を超える場合は待たずに RateBudgetExceeded を返す（ハンドラーは 429 / RATE_LIMITED を返す）。
+
+- 予算は直近60秒のスライディングウィンドウの近似: 今の1分の使用量 + 前の1分の使用量 × 前の1分が
+  直近60秒に残っている割合（固定の1分窓だけでは、窓の境目の前後で予算の最大2倍が通る）。
+  前の1分の中では均等に使われたとみなすため、偏りがあると境目付近で予算をわずかに超えうる
+- 前の1分の使用量は確定済みのため、インスタンスごとに1分に1回だけ読み込んでキャッシュする
+- 予約は試行ごと: リトライ・ヘッジの2本目もOpenAIの上限を消費するため、1回目（ハンドラーで予約）以降の
+  試行は reserve_attempt() で追加で予約する。予算が無ければリトライ・ヘッジをしない
+- 共有: DynamoDBの条件付きアトミックカウンター（UpdateItem の ADD を1回。読み込み・ロック不要）
+- 未設定時・ローカル/テスト用: InMemoryRateLimitBackend（インスタンス内のみ）
+- DynamoDBのエラー時は制限せずに通す（レート制限のためにチャット自体を止めない）
+
+DynamoDBテーブル:
+- パーティションキー: bucketKey (String)  例: "openai#29012345"（キー#エポック分）
+- TTL属性: expiresAt (Number, epoch秒)
+"""
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from structured_logging import log_warning
+
+OPENAI_RATE_LIMIT_RPM = int(os.environ.get('OPENAI_RATE_LIMIT_RPM', '0'))
+OPENAI_RATE_LIMIT_TPM = int(os.environ.get('OPENAI_RATE_LIMIT_TPM', '0'))
+OPENAI_RATE_LIMIT_TABLE = os.environ.get('OPENAI_RATE_LIMIT_TABLE', '')
+# 予算を共有する単位（同じ組織・プロジェクトのAPI Keyを使う関数で揃える）
+OPENAI_RATE_LIMIT_KEY = os.environ.get('OPENAI_RATE_LIMIT_KEY', 'openai')
+
+WINDOW_SECONDS = 60
+# 窓のアイテムを残す時間（TTL削除は遅延するため、窓の判定はキーで行う）
+WINDOW_TTL_SECONDS = 300
+
+
+class RateBudgetExceeded(Exception):
+    """今の窓の予算を超える（retry_after 秒後の次の窓で再試行できる）"""
+
+    def __init__(self, retry_after: float, limit: str):
+        super().__init__(f"OpenAI rate budget exceeded ({limit}), retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.limit = limit
+
+
+class InMemoryRateLimitBackend:
+    """DynamoDBの代わりに使うインメモリのバックエンド（ローカル実行・テスト用）"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._windows: Dict[str, Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def reserve(self, bucket_key: str, requests: int, tokens: int,
+                max_requests: Optional[int], max_tokens: Optional[int], expires_at: int) -> bool:
+        with self._lock:
+            if bucket_key not in self._windows:
+                # DynamoDBのTTL削除相当
+                now = self._clock()
+                self._windows = {key: value for key, value in self._windows.items() if value[2] >= now}
+            used_requests, used_tokens, expires_at = self._windows.get(bucket_key, (0, 0, expires_at))
+            if max_requests is not None and used_requests + requests > max_requests:
+                return False
+            if max_tokens is not None and used_tokens + tokens > max_tokens:
+                return False
+            self._windows[bucket_key] = (used_requests + requests, used_tokens + tokens, expires_at)
+            return True
+
+    def usage(self, bucket_key: str) -> Tuple[int, int]:
+        with self._lock:
+            used_requests, used_tokens, _ = self._windows.get(bucket_key, (0, 0, 0))
+        return used_requests, used_tokens
+
+
+class DynamoDBRateLimitBackend:
+    """DynamoDBテーブルをバックエンドにする（全インスタンスで共有）"""
+
+    def __init__(self, table_name: str, region_name: str = 'ap-northeast-1'):
+        import boto3
+        self.table = boto3.resource('dynamodb', region_name=region_name).Table(table_name)
+
+    def reserve(self, bucket_key: str, requests: int, tokens: int,
+                max_requests: Optional[int], max_tokens: Optional[int], expires_at: int) -> bool:
+        from botocore.exceptions import ClientError
+
+        # 加算後も上限以内のときだけ加算する（条件の判定と加算が1回のUpdateItemでアトミック）
+        conditions = []
+        values = {":requests": requests, ":tokens": tokens, ":expires": expires_at}
+        if max_requests is not None:
+            conditions.append("(attribute_not_exists(requests) OR requests <= :requestLimit)")
+            values[":requestLimit"] = max_requests - requests
+        if max_tokens is not None:
+            conditions.append("(attribute_not_exists(tokens) OR tokens <= :tokenLimit)")
+            values[":tokenLimit"] = max_tokens - tokens
+
+        kwargs = {
+            "Key": {"bucketKey": bucket_key},
+            "UpdateExpression": "SET expiresAt = if_not_exists(expiresAt, :expires) ADD requests :requests, tokens :tokens",
+            "ExpressionAttributeValues": values,
+        }
+        if conditions:
+            kwargs["ConditionExpression"] = " AND ".join(conditions)
+        try:
+            self.table.update_item(**kwargs)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def usage(self, bucket_key: str) -> Tuple[int, int]:
+        item = self.table.get_item(Key={"bucketKey": bucket_key}).get("Item") or {}
+        return int(item.get("requests", 0)), int(item.get("tokens", 0))
+
+
+class RateLimiter:
+    """requests/min・tokens/min の予算（どちらも0なら無効）"""
+
+    def __init__(
+        self,
+        requests_per_minute: int = OPENAI_RATE_LIMIT_RPM,
+        tokens_per_minute: int = OPENAI_RATE_LIMIT_TPM,
+        backend=None,
+        key: str = OPENAI_RATE_LIMIT_KEY,
+        clock: Callable[[], float] = time.time
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.backend = backend if backend is not None else InMemoryRateLimitBackend(clock)
+        self.key = key
+        self._clock = clock
+        # 前の1分の使用量 (窓, リクエスト数, トークン数)
+        self._previous: Optional[Tuple[int, int, int]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+    def acquire(self, tokens: int) -> None:
+        """
+        1リクエスト分とトークン数を直近60秒の予算から予約
+
+        Raises:
+            RateBudgetExceeded: 予算を超える場合（待たずにすぐ返す）
+        """
+        if not self.enabled:
+            return
+
+        now = self._clock()
+        window = int(now // WINDOW_SECONDS)
+        max_requests = self.requests_per_minute or None
+        max_tokens = self.tokens_per_minute or None
+        if max_tokens is not None:
+            # 1リクエストで窓の予算全体を超える場合は、空の窓でなら通せるよう上限で予約する
+            tokens = min(tokens, max_tokens)
+
+        # 前の1分のうち直近60秒に残っている割合の分だけ、今の1分の予算から差し引く（切り上げ）
+        previous_requests, previous_tokens = self._previous_usage(window)
+        carried = 1.0 - (now - window * WINDOW_SECONDS) / WINDOW_SECONDS
+        if max_requests is not None:
+            max_requests -= math.ceil(previous_requests * carried)
+        if max_tokens is not None:
+            max_tokens -= math.ceil(previous_tokens * carried)
+
+        if (max_requests is not None and max_requests < 1) or (max_tokens is not None and max_tokens < tokens):
+            reserved = False
+        else:
+            try:
+                reserved = self.backend.reserve(
+                    f"{self.key}#{window}", 1, tokens, max_requests, max_tokens,
+                    expires_at=(window + 1) * WINDOW_SECONDS + WINDOW_TTL_SECONDS
+                )
+            except Exception as e:
+                log_warning("rate limiter unavailable, allowing request", error=str(e))
+                return
+
+        if not reserved:
+            # 目安（次の1分の始まり。前の1分の使用量が多い場合はそれ以降も断られうる）
+            retry_after = (window + 1) * WINDOW_SECONDS - now
+            raise RateBudgetExceeded(retry_after, self._limit_name())
+
+    def _previous_usage(self, window: int) -> Tuple[int, int]:
+        """前の1分の使用量（確定済みのため1分に1回だけ読み込む。エラー時は0とみなす）"""
+        previous = self._previous
+        if previous is not None and previous[0] == window:
+            return previous[1], previous[2]
+        try:
+            requests, tokens = self.backend.usage(f"{self.key}#{window - 1}")
+        except Exception as e:
+            log_warning("rate limiter unavailable, ignoring previous window", error=str(e))
+            return 0, 0
+        self._previous = (window, requests, tokens)
+        return requests, tokens
+
+    def _limit_name(self) -> str:
+        names = []
+        if self.requests_per_minute:
+            names.append(f"{self.requests_per_minute} requests/min")
+        if self.tokens_per_minute:
+            names.append(f"{self.tokens_per_minute} tokens/min")
+        return " or ".join(names)
+
+
+_default_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    モジュール共通のレートリミッター
+
+    OPENAI_RATE_LIMIT_TABLE が未設定の場合はインメモリ（インスタンスごとの予算）を使う。
+    """
+    global _default_limiter
+    if _default_limiter is None:
+        backend = None
+        if OPENAI_RATE_LIMIT_TABLE and (OPENAI_RATE_LIMIT_RPM or OPENAI_RATE_LIMIT_TPM):
+            backend = DynamoDBRateLimitBackend(OPENAI_RATE_LIMIT_TABLE)
+        _default_limiter = RateLimiter(backend=backend)
+    return _default_limiter
+
+
+class AttemptBudget:
+    """
+    1リクエスト内のOpenAI呼び出しの試行ごとの予約
+
+    1回目の試行はハンドラーで予約済み（reserve_openai_budget）。リトライとヘッジの2本目は
+    試行の直前に同じトークン数を追加で予約する（ヘッジのワーカースレッドからも呼ばれる）。
+    """
+
+    def __init__(self, limiter: RateLimiter, tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.attempts = 0
+        self._lock = threading.Lock()
+
+    def reserve_attempt(self) -> None:
+        with self._lock:
+            self.attempts += 1
+            first = self.attempts == 1
+        if not first:
+            self.limiter.acquire(self.tokens)
+
+
+_budget: Optional[AttemptBudget] = None
+
+
+def start_budget(limiter: RateLimiter, tokens: int) -> AttemptBudget:
+    """リクエストの試行ごとの予約を開始（1回目を予約した後に呼ぶ）"""
+    global _budget
+    _budget = AttemptBudget(limiter, tokens)
+    return _budget
+
+
+def clear_budget() -> None:
+    global _budget
+    _budget = None
+
+
+def reserve_attempt() -> None:
+    """
+    OpenAI呼び出しの試行の直前に呼ぶ（レート制限が無効なら何もしない）
+
+    Raises:
+        RateBudgetExceeded: 2回目以降の試行で予算を超える場合
+    """
+    if _budget is not None:
+        _budget.reserve_attempt()
@@ -0,0 +1,288 @@
+"""
+retry_scheduler.py - OpenAI呼び出しのリトライとデッドライン管理
+
+- エラーは型（openai SDK / slim_openai_client の例外クラス）とHTTPステータスで分類
+  （文字列の部分一致はしない）。リトライするのは 429 / 5xx / 408 / 409 / 接続エラー・タイムアウトのみ
+- 待ち時間は decorrelated jitter: min(上限, random(基準, 前回の待ち時間 × 3))
+  → 同時に429を受けた複数のLambdaが同じタイミングで再送しない
+- サーバーの指示（Retry-After / retry-after-ms ヘッダー）があればそれ以上待つ
+- Lambdaの残り時間（context.get_remaining_time_in_millis()）で次の試行が終わらない場合は
+  待たずに諦める（Lambda全体のタイムアウトより先に、エラー応答を返せるようにする）
+- 各試行のタイムアウトも残り時間から決める（with_attempt_timeout()。SDKの既定600秒・slimの60秒を
+  そのまま使うと、応答の遅い1回の試行がデッドラインを越えてLambdaごとタイムアウトする）
+
+使い方:
+    start_deadline(context)   # ハンドラーの先頭で
+    result = call_with_retry(lambda: with_attempt_timeout(client).chat.completions.create(...), operation="chat")
+    result = await call_with_retry_async(lambda: with_attempt_timeout(async_client).chat.completions.create(...), operation="chat")
+"""
+
+import os
+import random
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from structured_logging import current_request, log_error, log_warning
+
+OPENAI_MAX_ATTEMPTS = int(os.environ.get('OPENAI_MAX_ATTEMPTS', '3'))
+OPENAI_RETRY_BASE_SECONDS = float(os.environ.get('OPENAI_RETRY_BASE_SECONDS', '1.0'))
+OPENAI_RETRY_MAX_SECONDS = float(os.environ.get('OPENAI_RETRY_MAX_SECONDS', '20.0'))
+# 次の試行に最低限必要と見込む時間（これより残り時間が少なければ諦める）
+OPENAI_MIN_ATTEMPT_SECONDS = float(os.environ.get('OPENAI_MIN_ATTEMPT_SECONDS', '5.0'))
+# エラー応答を返すためにLambdaの残り時間から差し引いておく時間
+DEADLINE_SAFETY_MARGIN_SECONDS = float(os.environ.get('DEADLINE_SAFETY_MARGIN_SECONDS', '1.0'))
+# 1回の試行のタイムアウトの上限（デッドラインの残り時間の方が短ければそちら）
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_TIMEOUT_SECONDS', '60.0'))
+# 残り時間がほぼない場合でも試行には最低限この時間を与える（0以下のタイムアウトを渡さない）
+MIN_ATTEMPT_TIMEOUT_SECONDS = 0.1
+
+RETRYABLE_STATUS_CODES = frozenset([408, 409, 429])
+
+# エラーの分類
+RATE_LIMIT = "rate_limit"
+SERVER_ERROR = "server_error"
+CONNECTION_ERROR = "connection_error"
+FATAL = "fatal"
+
+
+def _connection_error_types() -> tuple:
+    """接続エラー・タイムアウトの型（SDKは読み込み済みの場合のみ。分類のためだけにimportしない）"""
+    types = []
+    slim = sys.modules.get('slim_openai_client')
+    if slim is not None:
+        types.append(slim.APIConnectionError)
+    openai = sys.modules.get('openai')
+    if openai is not None and hasattr(openai, 'APIConnectionError'):
+        types.append(openai.APIConnectionError)  # APITimeoutError はこのサブクラス
+    return tuple(types)
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    例外をリトライ可否で分類
+
+    Returns:
+        RATE_LIMIT / SERVER_ERROR / CONNECTION_ERROR（リトライ対象）、FATAL（リトライしない）
+    """
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int):
+        if status_code == 429:
+            return RATE_LIMIT
+        if status_code >= 500 or status_code in RETRYABLE_STATUS_CODES:
+            return SERVER_ERROR
+        return FATAL
+
+    connection_types = _connection_error_types()
+    if connection_types and isinstance(error, connection_types):
+        return CONNECTION_ERROR
+    return FATAL
+
+
+def _error_headers(error: BaseException) -> Dict[str, str]:
+    """エラー応答のヘッダー（slim: error.headers、SDK: error.response.headers）"""
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+    if not headers:
+        return {}
+    return {str(key).lower(): value for key, value in headers.items()}
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """サーバーが指示した待ち時間（retry-after-ms / Retry-After: 秒 または HTTP日付）"""
+    headers = _error_headers(error)
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Deadline:
+    """Lambdaの残り時間（context なしの場合は無制限）"""
+
+    def __init__(self, remaining_ms_fn: Optional[Callable[[], int]] = None, safety_margin: float = DEADLINE_SAFETY_MARGIN_SECONDS):
+        self._remaining_ms_fn = remaining_ms_fn
+        self.safety_margin = safety_margin
+
+    @classmethod
+    def from_context(cls, context) -> "Deadline":
+        return cls(getattr(context, 'get_remaining_time_in_millis', None))
+
+    def remaining(self) -> Optional[float]:
+        """使える残り時間（秒、安全マージンを差し引き済み）。無制限の場合は None"""
+        if self._remaining_ms_fn is None:
+            return None
+        return self._remaining_ms_fn() / 1000 - self.safety_margin
+
+    def can_afford(self, seconds: float) -> bool:
+        remaining = self.remaining()
+        return remaining is None or remaining >= seconds
+
+    def attempt_timeout(self, limit: float = OPENAI_TIMEOUT_SECONDS) -> float:
+        """次の試行のタイムアウト（秒）: limit と残り時間の短い方"""
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        return max(MIN_ATTEMPT_TIMEOUT_SECONDS, min(limit, remaining))
+
+
+_deadline = Deadline()
+
+
+def start_deadline(context) -> Deadline:
+    """リクエストのデッドラインを設定（ハンドラーの先頭で呼ぶ）"""
+    global _deadline
+    _deadline = Deadline.from_context(context)
+    return _deadline
+
+
+def current_deadline() -> Deadline:
+    return _deadline
+
+
+def with_attempt_timeout(client, deadline: Optional[Deadline] = None):
+    """
+    1回の試行用のクライアント（client.with_options(timeout=...)）
+
+    試行の直前に呼ぶ（リトライの待ち時間の分だけ残り時間が減っているため）。
+    openai SDK（OpenAI / AsyncOpenAI）と slim_openai_client のどちらも with_options を持ち、
+    コネクションプールは元のクライアントと共有する。
+    """
+    return client.with_options(timeout=(deadline or current_deadline()).attempt_timeout())
+
+
+class RetryPolicy:
+    """試行回数と decorrelated jitter の待ち時間"""
+
+    def __init__(
+        self,
+        max_attempts: int = OPENAI_MAX_ATTEMPTS,
+        base_delay: float = OPENAI_RETRY_BASE_SECONDS,
+        max_delay: float = OPENAI_RETRY_MAX_SECONDS,
+        min_attempt_seconds: float = OPENAI_MIN_ATTEMPT_SECONDS,
+        rng: Optional[random.Random] = None
+    ):
+        # 0以下だと1回も呼び出さずに None を返してしまうため、設定ミスとして扱う
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1 (got {max_attempts})")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_attempt_seconds = min_attempt_seconds
+        self._rng = rng or random.Random()
+
+    def next_delay(self, previous_delay: float) -> float:
+        upper = max(self.base_delay, previous_delay * 3)
+        return min(self.max_delay, self._rng.uniform(self.base_delay, upper))
+
+
+def _retry_delay(
+    error: BaseException, attempt: int, previous_delay: float, operation: str, policy: RetryPolicy, deadline: Deadline
+) -> Optional[float]:
+    """次の試行までの待ち時間（リトライしない場合は None。ログもここで出す）"""
+    error_class = classify_error(error)
+    if error_class == FATAL:
+        log_error("OpenAI API error", operation=operation, error=str(error))
+        return None
+
+    if attempt >= policy.max_attempts:
+        log_error("max retries exceeded", operation=operation, attempts=attempt, errorClass=error_class, error=str(error))
+        return None
+
+    delay = policy.next_delay(previous_delay)
+    server_hint = retry_after_seconds(error)
+    if server_hint is not None:
+        delay = max(delay, server_hint)
+
+    remaining = deadline.remaining()
+    if not deadline.can_afford(delay + policy.min_attempt_seconds):
+        log_error(
+            "retry abandoned: not enough time left", operation=operation, attempt=attempt,
+            errorClass=error_class, waitSeconds=round(delay, 2),
+            remainingSeconds=round(remaining, 2) if remaining is not None else None, error=str(error)
+        )
+        return None
+
+    log_warning(
+        "retrying OpenAI call", operation=operation, attempt=attempt, maxAttempts=policy.max_attempts,
+        errorClass=error_class, waitSeconds=round(delay, 2), retryAfter=server_hint,
+        remainingSeconds=round(remaining, 2) if remaining is not None else None
+    )
+    request_log = current_request()
+    if request_log is not None:
+        request_log.set(openaiRetries=attempt)
+    return delay
+
+
+def call_with_retry(
+    fn: Callable[[], Any],
+    operation: str = "openai",
+    policy: Optional[RetryPolicy] = None,
+    deadline: Optional[Deadline] = None,
+    sleep: Callable[[float], None] = time.sleep
+) -> Any:
+    """
+    fn() をリトライ付きで呼び出す
+
+    リトライしないエラー、試行回数の上限、残り時間不足の場合は最後の例外をそのままraiseする。
+
+    Args:
+        fn: 1回分の呼び出し
+        operation: ログ用の名前
+        policy: リトライ方針（省略時は環境変数の設定）
+        deadline: デッドライン（省略時は start_deadline() で設定したもの）
+    """
+    policy = policy or RetryPolicy()
+    deadline = deadline or current_deadline()
+    delay = 0.0
+
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, delay, operation, policy, deadline)
+            if delay is None:
+                raise
+            sleep(delay)
+
+
+async def call_with_retry_async(
+    fn: Callable[[], Awaitable[Any]],
+    operation: str = "openai",
+    policy: Optional[RetryPolicy] = None,
+    deadline: Optional[Deadline] = None
+) -> Any:
+    """call_with_retry() の asyncio 版（fn はコルーチンを返す関数。待機中はイベントループを止めない）"""
+    # asyncio のimportは約50ms。同期版ハンドラーのコールドスタートに含めないよう、ここで読み込む
+    import asyncio
+
+    policy = policy or RetryPolicy()
+    deadline = deadline or current_deadline()
+    delay = 0.0
+
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, delay, operation, policy, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
@@ -0,0 +1,118 @@
+"""
+section_splitter.py - 応答テキストの「---」区切りセクション分割
+
+OpenAIの応答（全文またはストリーミングの差分）を1パスで走査し、
+セクションが完成するたびにクリーンなテキストを返す。
+- 「---」がデルタ（差分）の境界をまたいでも検出する
+- Markdownテーブルの区切り行（|---|---|）はセクション区切りとみなさない
+- 【セクションX: ...】のラベル行はその場で除去する
+"""
+
+from typing import List, Optional
+
+
+class SectionSplitter:
+    """「---」区切りのステートフルなセクション分割器"""
+
+    SEPARATOR = '---'
+    LABEL_PREFIX = '【セクション'
+
+    def __init__(self):
+        # 改行がまだ来ていない行（次のデルタと連結して処理）
+        self._partial = ""
+        # 現在のセクションの行（ラベル行は除去済み）
+        self._lines: List[str] = []
+        self._has_separator = False
+        self._emitted = False
+        # 最初のセクションを出力するまでの原文（区切りなし・全セクション空の場合のフォールバック用）
+        self._raw_lines: Optional[List[str]] = []
+
+    def feed(self, delta: str) -> List[str]:
+        """
+        テキスト差分を追加し、完成したセクションを返す
+
+        Args:
+            delta: 応答テキストの差分
+
+        Returns:
+            このデルタで完成したセクションのリスト（空の場合あり）
+        """
+        if not delta:
+            return []
+
+        if '\n' not in delta:
+            self._partial += delta
+            return []
+
+        lines = (self._partial + delta).split('\n')
+        self._partial = lines.pop()
+
+        completed: List[str] = []
+        for line in lines:
+            self._process_line(line, completed)
+        return completed
+
+    def close(self) -> List[str]:
+        """
+        ストリーム終了時に残りのセクションを返す
+
+        「---」が一度も現れなかった場合、またはすべてのセクションが空だった場合は、
+        応答全体を1チャンクとして返す（split_response_into_chunksの従来動作）。
+        """
+        completed: List[str] = []
+        self._process_line(self._partial, completed)
+        self._partial = ""
+
+        if self._has_separator:
+            self._close_section(completed)
+
+        if not self._emitted:
+            completed.append('\n'.join(self._raw_lines or []).strip())
+            self._raw_lines = None
+
+        return completed
+
+    def _process_line(self, line: str, completed: List[str]) -> None:
+        """1行分を処理（行内の「---」ごとにセクションを確定）"""
+        if self._raw_lines is not None:
+            self._raw_lines.append(line)
+
+        # Markdownテーブル行の「---」は区切りではない
+        if self.SEPARATOR not in line or line.lstrip().startswith('|'):
+            self._append_fragment(line)
+            return
+
+        fragments = line.split(self.SEPARATOR)
+        self._append_fragment(fragments[0])
+        for fragment in fragments[1:]:
+            self._has_separator = True
+            self._close_section(completed)
+            self._append_fragment(fragment)
+
+    def _append_fragment(self, fragment: str) -> None:
+        """セクションに1行追加（ラベル行は除去）"""
+        if not fragment.strip().startswith(self.LABEL_PREFIX):
+            self._lines.append(fragment)
+
+    def _close_section(self, completed: List[str]) -> None:
+        """現在のセクションを確定し、空でなければ出力"""
+        section = '\n'.join(self._lines).strip()
+        self._lines = []
+        if section:
+            completed.append(section)
+            self._emitted = True
+            self._raw_lines = None
+
+
+def split_sections(response_text: str) -> List[str]:
+    """
+    便利関数: 応答全体をセクションに分割
+
+    Args:
+        response_text: 応答テキスト全体
+
+    Returns:
+        クリーンなセクションのリスト（最低1要素）
+    """
+    splitter = SectionSplitter()
+    return splitter.feed(response_text) + splitter.close()
@@ -0,0 +1,250 @@
+"""
+slim_openai_client.py - Chat Completions専用の軽量HTTPクライアント
+
+openai SDK（pydantic / httpx / 1,000以上の型定義ファイル）を読み込まずに
+/v1/chat/completions だけを呼び出す。コールドスタート短縮用（OPENAI_HTTP_CLIENT=slim）。
+- 標準ライブラリ（http.client）のみ使用
+- keep-aliveコネクションをスレッドごとに保持し、ウォームスタート間で再利用
+- SDKと同じ形（client.chat.completions.create(...)、response.choices[0].message.content）で使える
+- client.with_options(timeout=...) で試行ごとのタイムアウトを指定できる（コネクションは共有）
+"""
+
+import copy
+import http.client
+import json
+import socket
+import ssl
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_TIMEOUT_SECONDS = 60.0
+
+
+class APIError(Exception):
+    """OpenAI APIのエラー応答（メッセージ形式はSDKに合わせる）"""
+
+    def __init__(self, status_code: int, body: str, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        super().__init__(f"Error code: {status_code} - {body}")
+
+
+class AuthenticationError(APIError):
+    """401: API Keyが無効"""
+
+
+class RateLimitError(APIError):
+    """429: レートリミット"""
+
+
+class InternalServerError(APIError):
+    """5xx: サーバーエラー"""
+
+
+class APIConnectionError(Exception):
+    """接続エラー・タイムアウト"""
+
+
+def _error_for_status(status_code: int, body: str, headers: Dict[str, str]) -> APIError:
+    if status_code == 401:
+        return AuthenticationError(status_code, body, headers)
+    if status_code == 429:
+        return RateLimitError(status_code, body, headers)
+    if status_code >= 500:
+        return InternalServerError(status_code, body, headers)
+    return APIError(status_code, body, headers)
+
+
+def _to_namespace(value: Any) -> Any:
+    """JSONをSDKのレスポンスと同じように属性アクセスできる形に変換"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_to_namespace(item) for item in value]
+    return value
+
+
+class _Completions:
+    def __init__(self, client: "SlimOpenAI"):
+        self._client = client
+
+    def create(self, **params) -> Any:
+        """
+        Chat Completionsを呼び出す
+
+        stream=True の場合はチャンクのイテレーターを返す（SDKのStreamと同様に反復できる）。
+        """
+        if params.get("stream"):
+            return self._client._stream("/chat/completions", params)
+        return _to_namespace(self._client._post("/chat/completions", params))
+
+
+class _Chat:
+    def __init__(self, client: "SlimOpenAI"):
+        self.completions = _Completions(client)
+
+
+class SlimOpenAI:
+    """openai.OpenAI の chat.completions 部分のみを実装した軽量クライアント"""
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL, timeout: float = DEFAULT_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        parsed = urlparse(base_url)
+        self._secure = parsed.scheme == "https"
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._base_path = parsed.path.rstrip('/')
+        self._timeout = timeout
+        self._ssl_context = ssl.create_default_context()
+        self._local = threading.local()
+        self.chat = _Chat(self)
+
+    def with_options(self, timeout: Optional[float] = None) -> "SlimOpenAI":
+        """
+        設定を変えたクライアント（SDKの with_options と同様）
+
+        keep-aliveのコネクション（スレッドごと）とSSLコンテキストは元のクライアントと共有する。
+        """
+        client = copy.copy(self)
+        if timeout is not None:
+            client._timeout = timeout
+        client.chat = _Chat(client)
+        return client
+
+    def close(self) -> None:
+        """このスレッドのコネクションを閉じる"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._secure:
+                conn = http.client.HTTPSConnection(
+                    self._host, self._port, timeout=self._timeout, context=self._ssl_context
+                )
+            else:
+                # ローカルのスタブサーバー用
+                conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, path: str, params: Dict) -> http.client.HTTPResponse:
+        body = json.dumps(params, ensure_ascii=False).encode('utf-8')
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream" if params.get("stream") else "application/json",
+        }
+
+        # keep-aliveのコネクションがサーバー側で切られていた場合は1回だけ張り直す
+        for attempt in range(2):
+            conn = self._connection()
+            # 共有しているコネクションにこのクライアントのタイムアウトを設定（接続済みならソケットにも）
+            conn.timeout = self._timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(self._timeout)
+            try:
+                conn.request("POST", self._base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                self.close()
+                if attempt == 0:
+                    continue
+                raise APIConnectionError(str(e)) from e
+            except (socket.timeout, OSError, http.client.HTTPException) as e:
+                self.close()
+                raise APIConnectionError(str(e)) from e
+
+            if response.status >= 400:
+                error_body = response.read().decode('utf-8', errors='replace')
+                raise _error_for_status(
+                    response.status, error_body, {k.lower(): v for k, v in response.getheaders()}
+                )
+            return response
+
+        raise APIConnectionError("unreachable")
+
+    def _post(self, path: str, params: Dict) -> Dict:
+        response = self._request(path, params)
+        try:
+            body = response.read()
+        except (socket.timeout, OSError, http.client.HTTPException) as e:
+            self.close()
+            raise APIConnectionError(str(e)) from e
+        return json.loads(body.decode('utf-8'))
+
+    def _stream(self, path: str, params: Dict) -> "EventStream":
+        response = self._request(path, params)
+        return EventStream(response, self._local.conn)
+
+
+class EventStream:
+    """
+    Server-Sent Eventsの data 行をチャンクとして返すイテレーター（SDKの Stream に相当）
+
+    ストリームを開いたスレッド以外（hedging のワーカー → 呼び出し元）で読み進めてもよい。
+    - close(): 読んでいるスレッドから打ち切る（開いたときのコネクションを閉じる。次の使用時に自動で張り直される）
+    - abort(): 別のスレッドが読み込み中でも中断する（ソケットを shutdown し、読み込み側は APIConnectionError）
+    """
+
+    def __init__(self, response: http.client.HTTPResponse, conn: http.client.HTTPConnection):
+        self._response = response
+        self._conn = conn
+        self._aborted = False
+        self._events = self._iter_events()
+
+    def __iter__(self) -> "EventStream":
+        return self
+
+    def __next__(self) -> Any:
+        return next(self._events)
+
+    def close(self) -> None:
+        self._events.close()
+
+    def abort(self) -> None:
+        self._aborted = True
+        sock = self._conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _iter_events(self) -> Iterator[Any]:
+        response = self._response
+        finished = False
+        try:
+            while True:
+                try:
+                    line = response.readline()
+                except (socket.timeout, OSError, http.client.HTTPException) as e:
+                    # 読み取りのタイムアウト（with_options の timeout）も接続エラーとして扱う
+                    raise APIConnectionError(str(e)) from e
+                if self._aborted:
+                    raise APIConnectionError("stream aborted")
+                if not line:
+                    break
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                yield _to_namespace(json.loads(data.decode('utf-8')))
+            finished = True
+        finally:
+            if finished:
+                # 次のリクエストでコネクションを再利用できるよう残りを読み切る
+                response.read()
+            else:
+                # 途中で打ち切られた場合は残りを読まずにコネクションを破棄
+                response.close()
+                self._conn.close()
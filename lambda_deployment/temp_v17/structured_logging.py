@@ -0,0 +1,185 @@
+"""
+structured_logging.py - リクエスト単位の構造化ログ
+
+print() を大量に呼ぶ代わりに、1リクエストにつきJSON 1行をCloudWatch Logsへ出力する。
+- レベル: DEBUG / INFO / WARNING / ERROR（LOG_LEVEL 環境変数）
+- DEBUGの詳細はリクエスト単位でサンプリング（LOG_DEBUG_SAMPLE_RATE）
+- フィールドに関数を渡すと、そのイベントが実際に出力される場合だけ評価される（遅延フォーマット）
+  例: log_debug("event received", event=lambda: json.dumps(event)[:200])
+- フェーズごとの処理時間は instrumentation.span() で記録し、同じ行にEMFメトリクスとして出力
+
+※ lambda_deployment/temp_vXX と lambda_cognito_trigger に同じファイルを配置している（Lambdaごとに別ZIPのため）
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+# 1行が巨大にならないよう、1リクエストで保持するイベント数を制限
+MAX_EVENTS_PER_REQUEST = 50
+
+
+def _resolve(value: Any) -> Any:
+    """遅延フィールド（関数）を評価"""
+    if callable(value):
+        try:
+            return value()
+        except Exception as e:
+            return f"<log field error: {e}>"
+    return value
+
+
+def _write(record: Dict) -> None:
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+class RequestLog:
+    """1リクエスト分のログ（flush時にJSON 1行で出力）"""
+
+    def __init__(self, function_name: str, context=None, level: str = LOG_LEVEL, debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE):
+        self.function_name = function_name
+        self.request_id = getattr(context, 'aws_request_id', None)
+        self.threshold = LEVELS.get(level, LEVELS["INFO"])
+        # DEBUGはLOG_LEVEL=DEBUGのとき、またはサンプリングで選ばれたリクエストのみ
+        self.debug_sampled = self.threshold <= LEVELS["DEBUG"] or random.random() < debug_sample_rate
+        self.started_at = time.perf_counter()
+        self.fields: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self.events: List[Dict] = []
+        self.dropped_events = 0
+        self.max_level = LEVELS["INFO"]
+
+    def is_enabled(self, level: str) -> bool:
+        if level == "DEBUG":
+            return self.debug_sampled
+        return LEVELS[level] >= self.threshold
+
+    def set(self, **fields) -> None:
+        """リクエスト全体の属性を追加（最終行のトップレベルに出力）"""
+        self.fields.update(fields)
+
+    def log(self, level: str, message: str, **fields) -> None:
+        if not self.is_enabled(level):
+            return
+        self.max_level = max(self.max_level, LEVELS[level])
+        if len(self.events) >= MAX_EVENTS_PER_REQUEST:
+            self.dropped_events += 1
+            return
+        event = {"t": round((time.perf_counter() - self.started_at) * 1000, 1), "level": level, "msg": message}
+        for key, value in fields.items():
+            event[key] = _resolve(value)
+        self.events.append(event)
+
+    def debug(self, message: str, **fields) -> None:
+        self.log("DEBUG", message, **fields)
+
+    def info(self, message: str, **fields) -> None:
+        self.log("INFO", message, **fields)
+
+    def warning(self, message: str, **fields) -> None:
+        self.log("WARNING", message, **fields)
+
+    def error(self, message: str, **fields) -> None:
+        self.log("ERROR", message, **fields)
+
+    def add_timing(self, name: str, elapsed_ms: float) -> None:
+        """処理時間（ミリ秒）を timings に加算（通常は instrumentation.span() 経由で呼ぶ）"""
+        self.timings[name] = round(self.timings.get(name, 0.0) + elapsed_ms, 1)
+
+    def add_count(self, name: str, value: float = 1) -> None:
+        """件数を counts に加算（通常は instrumentation.record_count() 経由で呼ぶ）"""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def flush(self, **fields) -> None:
+        """リクエストのログをJSON 1行で出力"""
+        from instrumentation import emf_fields
+
+        self.fields.update(fields)
+        level_name = next(name for name, value in LEVELS.items() if value == self.max_level)
+        duration_ms = round((time.perf_counter() - self.started_at) * 1000, 1)
+        record = {
+            "level": level_name,
+            "function": self.function_name,
+            "requestId": self.request_id,
+            "durationMs": duration_ms,
+        }
+        record.update({key: _resolve(value) for key, value in self.fields.items()})
+        # フェーズごとの処理時間はEMFメトリクス（トップレベルの xxxMs）として出力
+        metrics = emf_fields(self.function_name, self.timings, duration_ms, self.counts)
+        if metrics:
+            record.update(metrics)
+        else:
+            if self.timings:
+                record["timings"] = self.timings
+            if self.counts:
+                record["counts"] = self.counts
+        if self.events:
+            record["events"] = self.events
+        if self.dropped_events:
+            record["droppedEvents"] = self.dropped_events
+        if self.debug_sampled:
+            record["debugSampled"] = True
+        _write(record)
+
+
+_current: Optional[RequestLog] = None
+
+
+def start_request(function_name: str, context=None) -> RequestLog:
+    """
+    リクエストのログを開始（以降の log_xxx() はこのリクエストの行にまとめられる）
+
+    Lambdaは1インスタンスで同時に1リクエストしか処理しないため、モジュール変数で保持する
+    （ヘッジ用のスレッドからも同じログに書き込める）。
+    """
+    global _current
+    _current = RequestLog(function_name, context)
+    return _current
+
+
+def end_request(**fields) -> None:
+    """リクエストのログを出力して終了"""
+    global _current
+    if _current is not None:
+        _current.flush(**fields)
+        _current = None
+
+
+def current_request() -> Optional[RequestLog]:
+    return _current
+
+
+def _log(level: str, message: str, fields: Dict) -> None:
+    if _current is not None:
+        _current.log(level, message, **fields)
+        return
+    # リクエスト外（初期化時など）はその場で1行出力
+    if level == "DEBUG" or LEVELS[level] < LEVELS.get(LOG_LEVEL, LEVELS["INFO"]):
+        return
+    record = {"level": level, "msg": message}
+    record.update({key: _resolve(value) for key, value in fields.items()})
+    _write(record)
+
+
+def log_debug(message: str, **fields) -> None:
+    _log("DEBUG", message, fields)
+
+
+def log_info(message: str, **fields) -> None:
+    _log("INFO", message, fields)
+
+
+def log_warning(message: str, **fields) -> None:
+    _log("WARNING", message, fields)
+
+
+def log_error(message: str, **fields) -> None:
+    _log("ERROR", message, fields)
@@ -0,0 +1,141 @@
+"""
+token_counter.py - プロンプトのトークン数計算
+
+tiktoken（BPE）と語彙ファイルが利用可能な場合は正確なトークン数を返す。
+利用できない場合は日本語を考慮した概算（かな・漢字は1文字1トークン、ASCIIは4文字1トークン）。
+- 語彙（o200k_base）は最初にトークン数を数えるときに読み込む（import時には読み込まない）
+- 語彙はデプロイパッケージに同梱したキャッシュディレクトリ（TIKTOKEN_CACHE_DIR）から読む。
+  見つからない場合は語彙をダウンロードしに行かず、概算を使う
+- BPE使用時、メッセージ単位のトークン数は内容のハッシュをキーにLRUでキャッシュ
+  （会話履歴は毎ターンほぼ同じメッセージが送られてくるため、BPEを通すのは新しいメッセージのみ）
+
+語彙の同梱（デプロイパッケージの作成時に1回）:
+    pip install tiktoken -t temp_vXX
+    TIKTOKEN_CACHE_DIR=temp_vXX/tiktoken_cache python -c "import tiktoken; tiktoken.get_encoding('o200k_base')"
+"""
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+from lru_cache import LRUCache
+from structured_logging import log_info, log_warning
+
+# gpt-4o / gpt-5系のエンコーディング
+ENCODING_NAME = "o200k_base"
+ESTIMATE = "estimate"
+O200K_BASE_URL = "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken"
+
+# 語彙ファイルのキャッシュディレクトリ（未設定時はこのファイルと同じ場所の tiktoken_cache/）
+TIKTOKEN_CACHE_DIR = os.environ.get('TIKTOKEN_CACHE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'tiktoken_cache'
+)
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '4096'))
+
+# チャット形式の1メッセージあたりのオーバーヘッド（ロール区切りトークン）
+TOKENS_PER_MESSAGE = 3
+# 応答開始のプライミング（assistant）
+TOKENS_PER_REPLY = 3
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+_count_cache = None
+
+
+def get_encoding():
+    """BPEエンコーディング（初回呼び出し時に読み込む。利用できない場合は None）"""
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+
+    with _encoding_lock:
+        if _encoding_loaded:
+            return _encoding
+        if os.path.isfile(_vocab_cache_path()):
+            try:
+                import tiktoken
+                with _tiktoken_cache_dir(TIKTOKEN_CACHE_DIR):
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                log_info("tokenizer loaded", encoding=ENCODING_NAME)
+            except Exception as e:
+                log_warning("tokenizer unavailable, using estimate", error=str(e))
+        else:
+            log_info("tokenizer vocabulary not bundled, using estimate", cacheDir=TIKTOKEN_CACHE_DIR)
+        _encoding_loaded = True
+    return _encoding
+
+
+@contextmanager
+def _tiktoken_cache_dir(path: str):
+    """tiktoken.get_encoding() の間だけ TIKTOKEN_CACHE_DIR を設定する（終了後は元の値に戻す）"""
+    # tiktoken は import 時ではなく get_encoding() 時にこの環境変数を読む
+    previous = os.environ.get('TIKTOKEN_CACHE_DIR')
+    os.environ['TIKTOKEN_CACHE_DIR'] = path
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop('TIKTOKEN_CACHE_DIR', None)
+        else:
+            os.environ['TIKTOKEN_CACHE_DIR'] = previous
+
+
+def _vocab_cache_path() -> str:
+    # tiktoken はキャッシュファイル名に語彙URLのSHA-1を使う（無いとダウンロードしに行く）
+    return os.path.join(TIKTOKEN_CACHE_DIR, hashlib.sha1(O200K_BASE_URL.encode()).hexdigest())
+
+
+def tokenizer_name() -> str:
+    """トークン数の計算方法（ログ用）: "o200k_base" または "estimate" """
+    return ENCODING_NAME if get_encoding() is not None else ESTIMATE
+
+
+def get_count_cache() -> LRUCache:
+    """メッセージのトークン数キャッシュ（ウォームスタート間で再利用）"""
+    global _count_cache
+    if _count_cache is None:
+        _count_cache = LRUCache(max_size=TOKEN_COUNT_CACHE_SIZE)
+    return _count_cache
+
+
+def count_text_tokens(text: str) -> int:
+    """テキストのトークン数"""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    return _estimate_tokens(text)
+
+
+def count_message_tokens(message: Dict) -> int:
+    """チャットメッセージ1件のトークン数（ロールとオーバーヘッドを含む）"""
+    role = message.get("role") or ""
+    content = message.get("content") or ""
+    if get_encoding() is None:
+        # 概算はハッシュ計算より速いためキャッシュしない
+        return TOKENS_PER_MESSAGE + _estimate_tokens(role) + _estimate_tokens(content)
+    key = (role, hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest())
+    return get_count_cache().get_or_compute(
+        key, lambda: TOKENS_PER_MESSAGE + count_text_tokens(role) + count_text_tokens(content)
+    )
+
+
+def message_token_counts(messages: List[Dict]) -> List[int]:
+    """メッセージごとのトークン数（build_chat_messages() の出力と同じ順）"""
+    return [count_message_tokens(msg) for msg in messages]
+
+
+def count_messages_tokens(messages: List[Dict]) -> int:
+    """メッセージ列全体のプロンプトトークン数"""
+    return sum(message_token_counts(messages)) + TOKENS_PER_REPLY
+
+
+def _estimate_tokens(text: str) -> int:
+    """tiktokenがない環境での概算（日本語は1文字1トークン以上として多めに見積もる）"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    non_ascii_chars = len(text) - ascii_chars
+    return non_ascii_chars + (ascii_chars + 3) // 4
@@ -0,0 +1,141 @@
+"""
+user_tokenizer.py - ユーザーIDの匿名トークン化（HMAC-SHA256）
+
+ユーザーIDをソルト（秘密鍵）付きHMACで匿名トークン「user_xxxxxxxxxxxx」に変換する。
+- ソルトは初回使用時に1回だけ環境変数から読み込む
+- ユーザーID → トークンをLRUでキャッシュ（同じユーザーの繰り返し変換を省略）
+- tokenize_many() で大量のIDをまとめて変換（分析用エクスポート、一括登録など）
+- ソルトのローテーション: PII_SALT_PREVIOUS を設定している間は旧ソルトのトークンも
+  同一ユーザーとして受け入れる（accepted_tokens()）。保存済みデータは次回保存時に新トークンへ移行
+
+旧方式（SHA-256(ソルト:ユーザーID)）のトークンも、PII_ACCEPT_LEGACY_TOKENS=true の間は受け入れる。
+"""
+
+import hashlib
+import hmac
+import os
+from typing import Dict, Iterable, List, Optional
+
+from lru_cache import LRUCache
+
+TOKEN_PREFIX = "user_"
+TOKEN_HEX_LENGTH = 12
+ANONYMOUS_TOKEN = "anonymous"
+
+USER_TOKEN_CACHE_SIZE = int(os.environ.get('USER_TOKEN_CACHE_SIZE', '10000'))
+PII_ACCEPT_LEGACY_TOKENS = os.environ.get('PII_ACCEPT_LEGACY_TOKENS', 'true').lower() == 'true'
+
+
+class UserTokenizer:
+    """ソルト付きHMACによるユーザーIDのトークン化"""
+
+    def __init__(
+        self,
+        salt: str,
+        previous_salt: Optional[str] = None,
+        cache_size: int = USER_TOKEN_CACHE_SIZE,
+        accept_legacy: bool = PII_ACCEPT_LEGACY_TOKENS
+    ):
+        if not salt:
+            raise ValueError("salt is required")
+        self._salt = salt
+        # 鍵の前処理を済ませたHMACを使い回す（呼び出しごとは copy() + update() のみ）
+        self._hmac = hmac.new(salt.encode('utf-8'), digestmod=hashlib.sha256)
+        self._previous_hmac = (
+            hmac.new(previous_salt.encode('utf-8'), digestmod=hashlib.sha256) if previous_salt else None
+        )
+        self.accept_legacy = accept_legacy
+        self.cache = LRUCache(max_size=cache_size)
+
+    @classmethod
+    def from_env(cls) -> "UserTokenizer":
+        """環境変数 PII_SALT / PII_SALT_PREVIOUS から作成"""
+        salt = os.environ.get('PII_SALT')
+        if not salt:
+            raise ValueError(
+                "PII_SALT environment variable is required. "
+                "Set it in Lambda configuration."
+            )
+        return cls(salt, previous_salt=os.environ.get('PII_SALT_PREVIOUS') or None)
+
+    @staticmethod
+    def _derive(template: "hmac.HMAC", user_id: str) -> str:
+        mac = template.copy()
+        mac.update(user_id.encode('utf-8'))
+        return TOKEN_PREFIX + mac.hexdigest()[:TOKEN_HEX_LENGTH]
+
+    def token(self, user_id: str) -> str:
+        """ユーザーIDの匿名トークン（現在のソルト。数値のユーザーIDは文字列として扱う）"""
+        if not user_id:
+            return ANONYMOUS_TOKEN
+        user_id = str(user_id)
+        token = self.cache.get(user_id)
+        if token is None:
+            token = self._derive(self._hmac, user_id)
+            self.cache.put(user_id, token)
+        return token
+
+    def tokenize_many(self, user_ids: Iterable[str]) -> List[str]:
+        """
+        複数のユーザーIDをまとめてトークン化（入力と同じ順序）
+
+        バッチ内の重複はローカルの辞書で解決し、LRUには新しいIDだけを書き込む。
+        """
+        seen: Dict[str, str] = {}
+        tokens = []
+        for user_id in user_ids:
+            token = seen.get(user_id)
+            if token is None:
+                token = self.token(user_id)
+                seen[user_id] = token
+            tokens.append(token)
+        return tokens
+
+    def previous_token(self, user_id: str) -> Optional[str]:
+        """旧ソルト（PII_SALT_PREVIOUS）のトークン（ローテーション期間外はNone）"""
+        if not user_id or self._previous_hmac is None:
+            return None
+        return self._derive(self._previous_hmac, str(user_id))
+
+    def legacy_token(self, user_id: str) -> str:
+        """旧方式 SHA-256(ソルト:ユーザーID) のトークン"""
+        salted_id = f"{self._salt}:{user_id}"
+        return TOKEN_PREFIX + hashlib.sha256(salted_id.encode()).hexdigest()[:TOKEN_HEX_LENGTH]
+
+    def accepted_tokens(self, user_id: str) -> List[str]:
+        """
+        同一ユーザーとして受け入れるトークン（先頭が現在のトークン）
+
+        保存済みデータの所有者チェックに使う。ソルトのローテーション期間中は旧ソルトの
+        トークンも含める。
+        """
+        tokens = [self.token(user_id)]
+        if not user_id:
+            return tokens
+        previous = self.previous_token(user_id)
+        if previous:
+            tokens.append(previous)
+        if self.accept_legacy:
+            tokens.append(self.legacy_token(user_id))
+        return tokens
+
+
+_default_tokenizer: Optional[UserTokenizer] = None
+
+
+def get_user_tokenizer() -> UserTokenizer:
+    """
+    モジュール共通のトークナイザー（初回使用時に環境変数から作成）
+
+    Raises:
+        ValueError: PII_SALT環境変数が設定されていない場合
+    """
+    global _default_tokenizer
+    if _default_tokenizer is None:
+        _default_tokenizer = UserTokenizer.from_env()
+    return _default_tokenizer
+
+
+def tokenize_user_ids(user_ids: Iterable[str]) -> List[str]:
+    """便利関数: モジュール共通のトークナイザーで一括変換"""
+    return get_user_tokenizer().tokenize_many(user_ids)
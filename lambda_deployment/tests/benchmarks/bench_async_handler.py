@@ -0,0 +1,115 @@
+"""
+bench_async_handler.py - 同期版と asyncio版（ASYNC_HANDLER_ENABLED）のハンドラーの1リクエストあたりの実時間
+
+Secrets Manager（--secret-ms）・セッションの読み込み（--session-ms、DynamoDBの GetItem 相当）・
+OpenAI（--openai-ms）を遅延を入れたフェイクに差し替え、次の3パターンの中央値を比べる。
+- warm: API Keyキャッシュ済み・セッションなし
+- secret refetch: 毎回API Keyを取得（コールドスタート・キャッシュ期限切れ相当）
+- secret refetch + session: 加えて毎回DynamoDBからセッションを読み込む
+
+asyncio版が短縮できるのはAPI Key取得と前処理（サニタイズ・描画・セッション読み込み）の重なりの分だけ。
+OpenAI呼び出しはクライアントに依存するため重ならず、API Keyがキャッシュ済みのウォームスタートでは差はほぼない
+（参考: 1CPU・既定値で warm 差なし、secret refetch + session で約5%短縮）。
+
+実行: python lambda_deployment/tests/benchmarks/bench_async_handler.py [--secret-ms 80] [--session-ms 20] [--openai-ms 300] [--runs 15]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import lambda_function as lf  # noqa: E402
+    import async_handler  # noqa: E402
+import conversation_store  # noqa: E402
+
+
+class DelayedBackend(conversation_store.InMemoryConversationBackend):
+    """読み込みに delay 秒かかるセッションのバックエンド"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def get(self, conversation_id):
+        time.sleep(self.delay)
+        return super().get(conversation_id)
+
+
+def reset_api_key() -> None:
+    lf._api_key_cache.update(value=None, fetched_at=0.0)
+    lf._openai_client_cache.update(client=None, api_key=None)
+
+
+def run(use_async: bool, refetch_secret: bool, session_body, store, runs: int) -> float:
+    """中央値（ms）"""
+    lf.ASYNC_HANDLER_ENABLED = use_async
+    body = session_body or {"userId": "user-1", "message": "最近眠れません", "bloodData": support.sample_blood_data()}
+    event = {"body": json.dumps(body, ensure_ascii=False)}
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        lf.lambda_handler(event, None)  # ウォームアップ（import・イベントループの作成）
+        for _ in range(runs):
+            if refetch_secret:
+                reset_api_key()
+            if session_body:
+                # LRUを使わずバックエンドから読み込む
+                store.cache = conversation_store.LRUCache(max_size=128)
+            started_at = time.perf_counter()
+            response = lf.lambda_handler(event, None)
+            times.append((time.perf_counter() - started_at) * 1000)
+            assert response["statusCode"] == 200, response["body"]
+    return statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--secret-ms", type=float, default=80.0, help="Secrets Managerの取得にかかる時間（ms）")
+    parser.add_argument("--session-ms", type=float, default=20.0, help="セッションの読み込みにかかる時間（ms）")
+    parser.add_argument("--openai-ms", type=float, default=300.0, help="OpenAIの応答にかかる時間（ms）")
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+
+    def fetch_secret_string(secret_id):
+        time.sleep(args.secret_ms / 1000)
+        return json.dumps({"api_key": "sk-test"})
+
+    sync_client = support.FakeOpenAI(delay=args.openai_ms / 1000)
+
+    async def get_async_openai_client(api_key):
+        return support.FakeAsyncOpenAI(sync_client.completions)
+
+    lf.fetch_secret_string = fetch_secret_string
+    lf.create_openai_client = lambda api_key: sync_client
+    async_handler.get_async_openai_client = get_async_openai_client
+    async_handler.use_async_client = lambda: True
+
+    store = conversation_store.ConversationStore(backend=DelayedBackend(args.session_ms / 1000))
+    conversation_store._default_store = store
+    # セッションを1つ作っておき、以降はそのIDで続きのターンを送る
+    with contextlib.redirect_stdout(io.StringIO()):
+        created = lf.lambda_handler({"body": json.dumps({"userId": "user-1", "message": "こんにちは", "conversationId": None})}, None)
+    session_body = {"userId": "user-1", "message": "最近眠れません", "conversationId": json.loads(created["body"])["conversationId"]}
+
+    print(f"{'scenario':<26} {'sync':>9} {'async':>9} {'diff':>7}")
+    for label, refetch_secret, body in (
+        ("warm", False, None),
+        ("secret refetch", True, None),
+        ("secret refetch + session", True, session_body),
+    ):
+        sync_ms = run(False, refetch_secret, body, store, args.runs)
+        async_ms = run(True, refetch_secret, body, store, args.runs)
+        print(f"{label:<26} {sync_ms:7.1f}ms {async_ms:7.1f}ms {(async_ms - sync_ms) / sync_ms * 100:+6.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+bench_client_cache.py - API Key・OpenAIクライアントのキャッシュ有無による1呼び出しあたりの時間
+
+Secrets Managerの取得（--secret-ms で遅延を指定）→ クライアント作成 → Chat Completions 1回 を
+ウォームスタートの連続呼び出しとして繰り返す。接続先はローカルのフェイクサーバー（slimクライアント）。
+TLSのハンドシェイクは含まないため、実環境ではキャッシュありの差はこれより大きい。
+
+実行: python lambda_deployment/tests/benchmarks/bench_client_cache.py [--secret-ms 30] [--calls 50]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import lambda_function as lf  # noqa: E402
+from slim_openai_client import SlimOpenAI  # noqa: E402
+
+MESSAGES = [{"role": "system", "content": "あなたは健康アドバイザーです。"}, {"role": "user", "content": "最近眠れません"}]
+
+
+def reset_caches() -> None:
+    """コールドスタート相当（キャッシュなしの従来動作）"""
+    client = lf._openai_client_cache["client"]
+    if client is not None:
+        client.close()
+    lf._api_key_cache.update(value=None, fetched_at=0.0)
+    lf._openai_client_cache.update(client=None, api_key=None)
+
+
+def run(calls: int, cached: bool) -> float:
+    reset_caches()
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(calls):
+            if not cached:
+                reset_caches()
+            lf.call_openai(lf.get_openai_client(), MESSAGES)
+    return (time.perf_counter() - started_at) * 1000 / calls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--secret-ms", type=float, default=30.0, help="Secrets Managerの取得にかかる時間（ms）")
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    with support.FakeOpenAIServer() as server:
+        def fetch_secret_string(secret_id):
+            time.sleep(args.secret_ms / 1000)
+            return json.dumps({"api_key": "sk-test"})
+
+        lf.fetch_secret_string = fetch_secret_string
+        lf.create_openai_client = lambda api_key: SlimOpenAI(api_key=api_key, base_url=server.base_url)
+
+        for cached in (False, True):
+            connections_before = len(server.connections)
+            per_call = run(args.calls, cached)
+            label = "cached key + client" if cached else "fetch + create per call"
+            print(f"{label:<26} {per_call:8.2f} ms/call  "
+                  f"connections={len(server.connections) - connections_before}")
+        reset_caches()
+
+
+if __name__ == "__main__":
+    main()
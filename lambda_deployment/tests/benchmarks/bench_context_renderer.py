@@ -0,0 +1,70 @@
+"""
+bench_context_renderer.py - データコンテキストの描画時間（context_renderer、キャッシュなし）
+
+- 遺伝子: SNP 1〜1,300件（マーカーあたり10件、genotypes / impact 付き）と、
+  サニタイズ後の形（title / impact_level / score_level）のマーカー 1〜1,300件
+- 血液: アプリの25項目（verbose / compact）、バイタル（サニタイズ後）
+
+実行: python lambda_deployment/tests/benchmarks/bench_context_renderer.py [--repeat 7]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402
+from context_renderer import (  # noqa: E402
+    build_blood_data_context,
+    build_blood_data_context_compact,
+    build_gene_data_context,
+    build_gene_data_context_bounded,
+    build_vital_data_context,
+    build_vital_data_context_compact,
+)
+from pii_sanitizer import PIISanitizer  # noqa: E402
+
+SIZES = (1, 10, 100, 500, 1300)
+
+
+def best_us(fn, repeat: int) -> float:
+    """1回あたりの時間（us、repeat回の最良値）"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'gene':<28} {'size':>6} {'chars':>8} {'us/call':>10}")
+    for snps in SIZES:
+        gene_data = support.sample_gene_data(snps)
+        for name, render in (("SNPs (full)", build_gene_data_context), ("SNPs (bounded)", build_gene_data_context_bounded)):
+            chars = len(render(gene_data))
+            print(f"{name:<28} {snps:>6} {chars:>8} {best_us(lambda: render(gene_data), args.repeat):>10.1f}")
+    for markers in SIZES:
+        sanitized = PIISanitizer.sanitize_gene_data(support.sample_gene_data(markers, snps_per_marker=1))
+        for name, render in (("markers sanitized (full)", build_gene_data_context),
+                             ("markers sanitized (bounded)", build_gene_data_context_bounded)):
+            chars = len(render(sanitized))
+            print(f"{name:<28} {markers:>6} {chars:>8} {best_us(lambda: render(sanitized), args.repeat):>10.1f}")
+
+    blood = PIISanitizer.sanitize_blood_data(support.sample_blood_data(abnormal={"CRP": "異常", "LDL": "注意"}))
+    vital = PIISanitizer.sanitize_vital_data(support.SAMPLE_VITAL_DATA)
+    print()
+    for name, render, data in (
+        ("blood verbose", build_blood_data_context, blood),
+        ("blood compact", build_blood_data_context_compact, blood),
+        ("vital verbose", build_vital_data_context, vital),
+        ("vital compact", build_vital_data_context_compact, vital),
+    ):
+        print(f"{name:<28} {len(data):>6} {len(render(data)):>8} {best_us(lambda: render(data), args.repeat):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+bench_pii_scrubber.py - PIIマスクの1メッセージあたりの時間（日本語のチャット履歴）
+
+従来の順次 re.sub（パターンごとに5回走査）と PIIScrubber（1回走査 + 事前フィルタ）を比較する。
+
+実行: python lambda_deployment/tests/benchmarks/bench_pii_scrubber.py [--messages 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402,F401  (Lambdaのソースをimportパスに追加)
+from pii_sanitizer import get_pii_scrubber  # noqa: E402
+from test_pii_scrubber import TRANSCRIPT_LINES, legacy_sanitize_text  # noqa: E402
+
+PLAIN_LINES = [
+    "ありがとうございます！",
+    "コーヒーは何杯までなら大丈夫ですか",
+    "夜中に目が覚めてしまいます。寝る前にスマホを見るのはよくないですか？",
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    lines = TRANSCRIPT_LINES + PLAIN_LINES
+    messages = [" ".join(rng.choice(lines) for _ in range(rng.randint(1, 6))) for _ in range(args.messages)]
+    assert [legacy_sanitize_text(m) for m in messages] == [get_pii_scrubber().scrub(m) for m in messages]
+    chars = sum(len(m) for m in messages)
+    print(f"{len(messages)} messages, {chars / len(messages):.0f} chars/message")
+
+    scrub = get_pii_scrubber().scrub
+    for name, fn in (("sequential re.sub", legacy_sanitize_text), ("PIIScrubber", scrub)):
+        best = min(timeit.repeat(lambda: [fn(m) for m in messages], number=5, repeat=5)) / 5
+        print(f"{name:<20} {best * 1e6 / len(messages):7.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
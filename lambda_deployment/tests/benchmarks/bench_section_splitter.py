@@ -0,0 +1,47 @@
+"""
+bench_section_splitter.py - 応答のセクション分割のマイクロベンチマーク
+
+実行: python lambda_deployment/tests/benchmarks/bench_section_splitter.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402,F401  (Lambdaのソースをimportパスに追加)
+from section_splitter import SectionSplitter, split_sections  # noqa: E402
+from test_section_splitter import legacy_split  # noqa: E402
+
+SECTION = "【セクション{n}: 分析】\n" + "鉄分が少なめです。睡眠と食事を見直しましょう。\n" * 8 + "| 項目 | 値 |\n|---|---|\n| 鉄 | 20 |\n"
+
+
+def build_response(sections: int) -> str:
+    return "\n---\n".join(SECTION.format(n=n) for n in range(sections))
+
+
+def stream(text: str, delta_size: int = 4):
+    splitter = SectionSplitter()
+    sections = []
+    for i in range(0, len(text), delta_size):
+        sections.extend(splitter.feed(text[i:i + delta_size]))
+    return sections + splitter.close()
+
+
+def report(name: str, fn, number: int) -> None:
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"{name:<32} {best * 1e6:9.1f} us")
+
+
+def main() -> None:
+    for sections in (3, 10, 50):
+        text = build_response(sections)
+        print(f"-- {sections} sections, {len(text)} chars")
+        report("legacy split (full text)", lambda: legacy_split(text), 500)
+        report("split_sections (full text)", lambda: split_sections(text), 500)
+        report("SectionSplitter (4-char deltas)", lambda: stream(text), 100)
+
+
+if __name__ == "__main__":
+    main()
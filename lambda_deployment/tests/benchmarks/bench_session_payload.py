@@ -0,0 +1,85 @@
+"""
+bench_session_payload.py - 会話セッションモードのリクエストサイズとハンドラーのCPU時間（ターンごと）
+
+従来モード（毎ターン conversationHistory・bloodData・vitalData を全量送信）と
+セッションモード（2ターン目以降は conversationId と message のみ）を比較する。
+OpenAIはフェイク（応答は約1,500文字）、セッションストアはインメモリ。
+
+実行: python lambda_deployment/tests/benchmarks/bench_session_payload.py [--turns 20]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import lambda_function as lf  # noqa: E402
+
+REPLY = "\n---\n".join(
+    f"【セクション{n}】\n" + "睡眠の質を上げるには、就寝前の光と食事のタイミングを整えることが大切です。" * 8 for n in range(1, 4)
+)
+REPORT_TURNS = (1, 2, 5, 10, 20, 50)
+
+
+def message_for(turn: int) -> str:
+    return f"{turn}回目の質問です。最近眠れなくて疲れが取れません。何から始めればいいですか？"
+
+
+def run(turns: int, session_mode: bool):
+    """ターンごとの (リクエストボディのバイト数, ハンドラーのCPU時間ms)"""
+    lf.get_openai_client = lambda force_refresh=False: support.FakeOpenAI(REPLY)
+    history = []
+    conversation_id = None
+    results = []
+    for turn in range(1, turns + 1):
+        body = {"userId": "bench-user", "message": message_for(turn)}
+        if session_mode:
+            body["conversationId"] = conversation_id
+            if conversation_id is None:
+                body.update(bloodData=support.sample_blood_data(), vitalData=support.SAMPLE_VITAL_DATA)
+            else:
+                body["historyLength"] = len(history)
+        else:
+            body.update(
+                conversationHistory=history, bloodData=support.sample_blood_data(), vitalData=support.SAMPLE_VITAL_DATA
+            )
+        event = {"body": json.dumps(body, ensure_ascii=False)}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            started_at = time.process_time()
+            response = lf.lambda_handler(event, None)
+            cpu_ms = (time.process_time() - started_at) * 1000
+        assert response["statusCode"] == 200, response
+        envelope = json.loads(response["body"])
+        conversation_id = envelope.get("conversationId")
+        history = history + [{"role": "user", "content": body["message"]}, {"role": "assistant", "content": envelope["response"]}]
+        results.append((len(event["body"].encode("utf-8")), cpu_ms))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    legacy = run(args.turns, session_mode=False)
+    session = run(args.turns, session_mode=True)
+    print(f"{'turn':>4} {'legacy bytes':>13} {'session bytes':>14} {'legacy cpu ms':>14} {'session cpu ms':>15}")
+    for turn in REPORT_TURNS:
+        if turn <= args.turns:
+            (legacy_bytes, legacy_cpu), (session_bytes, session_cpu) = legacy[turn - 1], session[turn - 1]
+            print(f"{turn:>4} {legacy_bytes:>13,} {session_bytes:>14,} {legacy_cpu:>14.2f} {session_cpu:>15.2f}")
+    print(f"{'sum':>4} {sum(b for b, _ in legacy):>13,} {sum(b for b, _ in session):>14,} "
+          f"{sum(c for _, c in legacy):>14.2f} {sum(c for _, c in session):>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
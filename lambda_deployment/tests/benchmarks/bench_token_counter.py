@@ -0,0 +1,106 @@
+"""
+bench_token_counter.py - プロンプトのトークン数計算（会話履歴200件）
+
+- cold: メッセージ単位のLRUが空の状態で全履歴を数える
+- warm: 全メッセージがLRUに載っている状態（ウォームスタートで同じ会話の次のターン）
+- 100 turns: 会話が1往復ずつ伸び、毎ターン全履歴を数える（BPEはLRUあり / なし。概算はLRUを使わない）
+BPEは語彙（TIKTOKEN_CACHE_DIR の o200k_base）が読み込める場合のみ計測する。無い場合は概算のみ。
+
+実行: python lambda_deployment/tests/benchmarks/bench_token_counter.py [--messages 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402,F401  (Lambdaのソースをimportパスに追加)
+import token_counter  # noqa: E402
+
+JA = [
+    "最近疲れやすく、睡眠も浅い気がします。",
+    "血糖値とHbA1cの推移について教えてください。",
+    "運動は週に3回、30分ほどのランニングをしています。",
+    "コレステロールが高めと言われました。食事で気をつけることは？",
+    "HRVが下がっているのはストレスの影響でしょうか。",
+    "お酒は週末にビールを2杯ほど飲みます。",
+]
+EN = [
+    "Resting heart rate 58 bpm, HRV 45 ms, sleep 6.5 h.",
+    "LDL 142 mg/dL (ref <140), HDL 55 mg/dL, TG 120 mg/dL.",
+]
+
+
+def sample_history(messages: int, rng: random.Random):
+    """ユーザーの短い質問とアシスタントの長い回答が交互に続く会話履歴"""
+    history = []
+    for n in range(messages):
+        text = " ".join(rng.choice(JA + EN) for _ in range(rng.randint(3, 12)))
+        if n % 2 == 0:
+            history.append({"role": "user", "content": text})
+        else:
+            history.append({"role": "assistant", "content": text * 4})
+    return history
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def run(mode: str, history, chars: int, bpe: bool) -> None:
+    cache = token_counter.get_count_cache()
+
+    def cold():
+        cache.clear()
+        token_counter.count_messages_tokens(history)
+
+    def growing():
+        cache.clear()
+        for n in range(2, len(history) + 1, 2):
+            token_counter.count_messages_tokens(history[:n])
+
+    def growing_without_cache():
+        for n in range(2, len(history) + 1, 2):
+            sum(token_counter.TOKENS_PER_MESSAGE + token_counter.count_text_tokens(m["content"]) for m in history[:n])
+
+    elapsed = best_of(cold)
+    print(f"{mode + ': cold':<40} {elapsed * 1000:8.2f} ms  {chars / elapsed / 1e6:6.2f} Mchar/s")
+    cold()
+    elapsed = best_of(lambda: token_counter.count_messages_tokens(history))
+    print(f"{mode + ': warm':<40} {elapsed * 1000:8.2f} ms  {chars / elapsed / 1e6:6.2f} Mchar/s")
+    turns = len(history) // 2
+    variants = [("LRU", growing), ("no LRU", growing_without_cache)] if bpe else [(None, growing)]
+    for label, fn in variants:
+        elapsed = best_of(fn, repeat=1)
+        name = f"{mode}: {turns} turns" + (f" ({label})" if label else "")
+        print(f"{name:<40} {elapsed * 1000:8.2f} ms  ({elapsed / turns * 1000:.3f} ms/turn)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    history = sample_history(args.messages, random.Random(1))
+    chars = sum(len(m["content"]) for m in history)
+    print(f"history: {len(history)} messages, {chars:,} chars")
+
+    encoding = token_counter.get_encoding()
+    modes = [("estimate", None)] + ([(token_counter.ENCODING_NAME, encoding)] if encoding is not None else [])
+    for mode, mode_encoding in modes:
+        token_counter._encoding, token_counter._encoding_loaded = mode_encoding, True
+        run(mode, history, chars, bpe=mode_encoding is not None)
+    if encoding is None:
+        print(f"({token_counter.ENCODING_NAME} skipped: vocabulary not found in {token_counter.TIKTOKEN_CACHE_DIR})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+bench_user_tokenizer.py - ユーザーIDのトークン化（1M件）
+
+- legacy: 変更前の anonymize_user_id（毎回 os.environ からソルトを読み SHA-256）
+- token(): キャッシュ付きHMAC（1件ずつ）
+- tokenize_many(): バッチAPI
+distinct=重複なしのID数（分析用エクスポートのように同じユーザーが何度も現れる想定）。
+
+実行: python lambda_deployment/tests/benchmarks/bench_user_tokenizer.py [--ids 1000000] [--distinct 50000]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support  # noqa: E402,F401  (Lambdaのソースをimportパスに追加)
+from user_tokenizer import UserTokenizer  # noqa: E402
+
+
+def legacy_anonymize_user_id(user_id: str) -> str:
+    """user_tokenizer 導入前の PIISanitizer.anonymize_user_id"""
+    salt = os.environ.get('PII_SALT')
+    if not salt:
+        raise ValueError("PII_SALT environment variable is required.")
+    salted_id = f"{salt}:{user_id}"
+    return f"user_{hashlib.sha256(salted_id.encode()).hexdigest()[:12]}"
+
+
+def timed(name: str, fn) -> None:
+    started_at = time.perf_counter()
+    fn()
+    print(f"{name:<28} {time.perf_counter() - started_at:6.2f} s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=50_000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    distinct = [f"user-{n:08d}@example.com" for n in range(args.distinct)]
+    user_ids = [rng.choice(distinct) for _ in range(args.ids)]
+    print(f"{args.ids:,} IDs, {args.distinct:,} distinct")
+
+    timed("legacy sha256 per call", lambda: [legacy_anonymize_user_id(u) for u in user_ids])
+    cached = UserTokenizer(os.environ['PII_SALT'], cache_size=args.distinct)
+    timed("token() (LRU)", lambda: [cached.token(u) for u in user_ids])
+    timed("tokenize_many()", lambda: UserTokenizer(os.environ['PII_SALT'], cache_size=args.distinct).tokenize_many(user_ids))
+    unique = [f"user-{n:08d}@example.com" for n in range(args.ids)]
+    timed("tokenize_many() all distinct", lambda: UserTokenizer(os.environ['PII_SALT']).tokenize_many(unique))
+
+
+if __name__ == "__main__":
+    main()
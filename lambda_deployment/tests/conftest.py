@@ -0,0 +1,45 @@
+"""
+テスト共通設定
+
+実行: python -m pytest -q lambda_deployment/tests
+"""
+
+import contextlib
+import io
+
+import pytest
+
+import support
+
+MODULE_SINGLETONS = {
+    "conversation_store": ["_default_store"],
+    "context_cache": ["_default_cache"],
+    "history_compactor": ["_default_compactor"],
+    "rate_limiter": ["_default_limiter", "_budget"],
+    "token_counter": ["_count_cache"],
+    "pii_sanitizer": ["_history_cache"],
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_singletons(monkeypatch):
+    """モジュール共通のキャッシュ・ストアをテストごとに作り直す（ウォームスタートの持ち越しを防ぐ）"""
+    import importlib
+    for module_name, names in MODULE_SINGLETONS.items():
+        module = importlib.import_module(module_name)
+        for name in names:
+            monkeypatch.setattr(module, name, None)
+
+
+@pytest.fixture
+def fake_openai():
+    return support.FakeOpenAI()
+
+
+@pytest.fixture
+def lambda_function(monkeypatch, fake_openai):
+    """OpenAIクライアントをフェイクに差し替えた lambda_function"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import lambda_function as module
+    monkeypatch.setattr(module, "get_openai_client", lambda force_refresh=False: fake_openai)
+    return module
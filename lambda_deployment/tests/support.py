@@ -0,0 +1,406 @@
+"""
+support.py - テスト・ベンチマーク共通のヘルパー
+
+- Lambdaのソースディレクトリ（最新の temp_vXX。LAMBDA_SOURCE_DIR で上書き可）をimportパスに追加
+- OpenAIクライアントの代わりに使うフェイク（SDKの chat.completions.create と同じ形の応答を返す。AsyncOpenAI版あり）
+- lambda_handler の呼び出しとログ行の取り出し
+"""
+
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+import types
+from typing import Dict, List, Optional, Tuple
+
+LAMBDA_DEPLOYMENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# テスト用のソルト（本番の PII_SALT とは無関係）
+os.environ.setdefault('PII_SALT', 'test-salt-' + '0' * 32)
+
+
+def source_dir() -> str:
+    """テスト対象のLambdaソース（LAMBDA_SOURCE_DIR 未設定時は番号が最大の temp_vXX）"""
+    configured = os.environ.get('LAMBDA_SOURCE_DIR')
+    if configured:
+        return os.path.abspath(configured)
+    versions = []
+    for name in os.listdir(LAMBDA_DEPLOYMENT_DIR):
+        match = re.fullmatch(r'temp_v(\d+)', name)
+        if match:
+            versions.append((int(match.group(1)), name))
+    return os.path.join(LAMBDA_DEPLOYMENT_DIR, max(versions)[1])
+
+
+def add_source_dir() -> str:
+    path = source_dir()
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return path
+
+
+add_source_dir()
+
+REPLY = "【セクション1: 分析】\n**分析** 鉄が少なめです\n---\n睡眠を整えましょう\n---\n🔜 次は食事について"
+
+# アプリが送る bloodData（BloodTestService.createDemoData() と同じ項目）
+_BLOOD_ROWS = """HbA1c,ヘモグロビンA1c,5.6,%,4.6-6.2
+FPG,空腹時血糖,95,mg/dL,70-109
+TG,中性脂肪,120,mg/dL,30-149
+HDL,HDLコレステロール,58,mg/dL,40-96
+LDL,LDLコレステロール,105,mg/dL,70-139
+TC,総コレステロール,195,mg/dL,150-219
+CRP,C反応性タンパク,0.08,mg/dL,0.00-0.30
+AST,AST(GOT),25,U/L,10-40
+ALT,ALT(GPT),28,U/L,5-45
+GGT,γ-GTP,32,U/L,0-70
+ALP,ALP,215,U/L,100-325
+TP,総蛋白,7.2,g/dL,6.7-8.3
+ALB,アルブミン,4.5,g/dL,3.8-5.2
+BUN,尿素窒素,15,mg/dL,8-20
+CRE,クレアチニン,0.85,mg/dL,0.60-1.10
+UA,尿酸,5.8,mg/dL,3.0-7.0
+WBC,白血球数,6500,/μL,3500-9000
+RBC,赤血球数,480,万/μL,400-550
+Hb,ヘモグロビン,14.5,g/dL,13.5-17.5
+Ht,ヘマトクリット,43.2,%,39.0-52.0
+PLT,血小板数,25.5,万/μL,13.0-35.0
+CK,クレアチンキナーゼ,145,U/L,50-250
+LDH,乳酸脱水素酵素,185,U/L,120-240
+Ferritin,フェリチン,125,ng/mL,20-300
+INS,インスリン,8.5,μU/mL,2.0-15.0"""
+
+
+def sample_blood_data(abnormal: Optional[Dict[str, str]] = None) -> List[Dict]:
+    """
+    bloodData のサンプル（abnormal に {key: status} を渡すとその項目のステータスを変える）
+    """
+    items = []
+    for row in _BLOOD_ROWS.split("\n"):
+        key, name, value, unit, reference = row.split(",")
+        status = (abnormal or {}).get(key, "正常")
+        items.append({"key": key, "nameJp": name, "value": value, "unit": unit, "status": status, "reference": reference})
+    return items
+
+
+# アプリが送る vitalData（HealthKitData をJSONEncoderでエンコードした形）
+SAMPLE_VITAL_DATA = {
+    "bodyMass": 68.2, "height": 172.0, "bodyFatPercentage": 18.5, "leanBodyMass": 55.6,
+    "restingHeartRate": 58.0, "vo2Max": 42.3, "heartRateVariability": 48.0, "heartRate": 72.0,
+    "activeEnergyBurned": 520.0, "basalEnergyBurned": 1650.0, "exerciseTime": 35.0, "stepCount": 8432.0,
+    "walkingRunningDistance": 6.1, "cyclingDistance": 0.0, "lastUpdated": 781234567.0,
+}
+
+GENE_CATEGORIES = ["睡眠", "糖質代謝", "アルコール代謝", "筋肉・運動", "肌"]
+GENOTYPES = ["AA", "AG", "GG", "CT", "TT"]
+
+
+def sample_gene_data(snps: int, snps_per_marker: int = 10) -> Dict:
+    """
+    geneData のサンプル（2段階抽出の第2段階: genotypes / impact を含む配列形式）
+
+    SNPを snps 件、マーカーあたり snps_per_marker 件ずつカテゴリーに振り分ける。
+    """
+    gene_data: Dict[str, List[Dict]] = {category: [] for category in GENE_CATEGORIES}
+    for n, start in enumerate(range(0, snps, snps_per_marker)):
+        count = min(snps_per_marker, snps - start)
+        risk = n % 4
+        gene_data[GENE_CATEGORIES[n % len(GENE_CATEGORIES)]].append({
+            "title": f"{GENE_CATEGORIES[n % len(GENE_CATEGORIES)]}マーカー{n + 1}",
+            "genotypes": {f"rs{1000000 + start + i}": GENOTYPES[(start + i) % len(GENOTYPES)] for i in range(count)},
+            "impact": {"protective": count - risk, "risk": risk, "neutral": 0, "score": count - 2 * risk},
+            "scoreLevel": "high" if risk == 0 else "low",
+        })
+    return {category: markers for category, markers in gene_data.items() if markers}
+
+
+class FakeUsage:
+    prompt_tokens = 100
+    completion_tokens = 10
+    total_tokens = 110
+    prompt_tokens_details = None
+
+
+def text_chunk(text: str):
+    """ストリーミングのチャンク（choices[0].delta.content）"""
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))], usage=None)
+
+
+def usage_chunk():
+    """ストリーミングの最後のチャンク（usageのみ）"""
+    return types.SimpleNamespace(choices=[], usage=FakeUsage())
+
+
+class FakeCompletions:
+    """chat.completions（呼び出しのパラメータを記録し、固定の応答を返す。delay 秒待ってから応答）"""
+
+    def __init__(self, reply: str = REPLY, chunk_size: int = 5, delay: float = 0.0):
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.calls: List[Dict] = []
+
+    def create(self, **params):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.respond(params)
+
+    def respond(self, params: Dict):
+        self.calls.append(params)
+        if params.get('stream'):
+            chunks = [text_chunk(self.reply[i:i + self.chunk_size]) for i in range(0, len(self.reply), self.chunk_size)]
+            return iter(chunks + [usage_chunk()])
+        message = types.SimpleNamespace(content=self.reply)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=FakeUsage())
+
+
+class FakeOpenAI:
+    """OpenAIクライアントのフェイク"""
+
+    def __init__(self, reply: str = REPLY, delay: float = 0.0):
+        self.completions = FakeCompletions(reply, delay=delay)
+        self.chat = types.SimpleNamespace(completions=self.completions)
+        self.options: List[Dict] = []
+
+    def with_options(self, **options):
+        self.options.append(options)
+        return self
+
+
+class FakeAsyncCompletions:
+    """AsyncOpenAI の chat.completions（記録・応答は同期版の FakeCompletions と共有。待ち時間は asyncio.sleep）"""
+
+    def __init__(self, completions: FakeCompletions):
+        self.completions = completions
+
+    async def create(self, **params):
+        import asyncio
+        if self.completions.delay:
+            await asyncio.sleep(self.completions.delay)
+        return self.completions.respond(params)
+
+
+class FakeAsyncOpenAI:
+    """AsyncOpenAIクライアントのフェイク"""
+
+    def __init__(self, completions: FakeCompletions):
+        self.chat = types.SimpleNamespace(completions=FakeAsyncCompletions(completions))
+
+    def with_options(self, **options):
+        return self
+
+
+class FakeOpenAIServer:
+    """
+    /v1/chat/completions を返すローカルHTTPサーバー（slim_openai_client の接続先）
+
+    plan に (ステータスコード, ヘッダー, 応答までの秒数) を積むと、先頭から順にその応答を返す。
+    plan が空になった後は reply をそのまま返す（stream=True の場合はSSE）。
+    stream=True で200の場合、秒数はヘッダー送信後・最初のイベントまでの時間（最初のトークンまでの時間）。
+    """
+
+    def __init__(self, reply: str = REPLY, plan: Optional[List[Tuple[int, Dict[str, str], float]]] = None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import threading
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                params = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server.lock:
+                    server.requests.append(params)
+                    server.connections.add(self.client_address)
+                    status, headers, delay = server.plan.pop(0) if server.plan else (200, {}, 0.0)
+                if params.get('stream') and status == 200:
+                    self._send_stream(server.reply, delay)
+                    return
+                if delay:
+                    time.sleep(delay)
+                if status != 200:
+                    self._send(status, headers, b'{"error": {"message": "fake error"}}')
+                else:
+                    self._send(200, {}, json.dumps({
+                        'choices': [{'message': {'content': server.reply}}],
+                        'usage': {'prompt_tokens': 100, 'completion_tokens': 10, 'total_tokens': 110},
+                    }, ensure_ascii=False).encode('utf-8'))
+
+            def _send(self, status, headers, body):
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, text, first_token_delay=0.0):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                if first_token_delay:
+                    self.wfile.flush()
+                    time.sleep(first_token_delay)
+                events = [{'choices': [{'delta': {'content': text[i:i + 5]}}], 'usage': None} for i in range(0, len(text), 5)]
+                events.append({'choices': [], 'usage': {'prompt_tokens': 100, 'completion_tokens': 10, 'total_tokens': 110}})
+                payloads = [json.dumps(event, ensure_ascii=False).encode('utf-8') for event in events] + [b'[DONE]']
+                for payload in payloads:
+                    data = b'data: ' + payload + b'\n\n'
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.write(b'0\r\n\r\n')
+
+        self.reply = reply
+        self.plan = list(plan or [])
+        self.requests: List[Dict] = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        # クライアントが中断した接続への書き込みエラー（BrokenPipe等）は出力しない
+        self._server.handle_error = lambda request, client_address: None
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}/v1'
+        # close() の shutdown() がポーリング間隔だけ待つため短くする
+        threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class FakeDynamoDBTable:
+    """
+    boto3 の Table（get_item / put_item / update_item）のインメモリ版
+
+    DynamoDBXxxBackend をそのままテストするため、各バックエンドが使う条件式
+    （attribute_not_exists / 比較 / AND / OR / 括弧）と更新式（SET if_not_exists / ADD）を評価する。
+    条件を満たさない場合は本物と同じ ClientError（ConditionalCheckFailedException）をraiseする。
+    put_item は400KBを超えるアイテムを ValidationException で拒否する。
+    """
+
+    ITEM_LIMIT_BYTES = 400 * 1024
+    TOKEN = re.compile(r'\s*(\(|\)|<=|>=|<>|=|<|>|,|:\w+|[A-Za-z_]\w*)')
+
+    def __init__(self, key_name: str):
+        self.key_name = key_name
+        self.items: Dict[str, Dict] = {}
+
+    def get_item(self, Key: Dict, ConsistentRead: bool = False) -> Dict:
+        item = self.items.get(Key[self.key_name])
+        return {"Item": dict(item)} if item is not None else {}
+
+    def put_item(self, Item: Dict, ConditionExpression: Optional[str] = None,
+                 ExpressionAttributeValues: Optional[Dict] = None) -> Dict:
+        self._check(self.items.get(Item[self.key_name]), ConditionExpression, ExpressionAttributeValues, "PutItem")
+        size = sum(len(name.encode("utf-8")) + len(str(value).encode("utf-8")) for name, value in Item.items())
+        if size > self.ITEM_LIMIT_BYTES:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {
+                "Code": "ValidationException", "Message": "Item size has exceeded the maximum allowed size",
+            }}, "PutItem")
+        self.items[Item[self.key_name]] = dict(Item)
+        return {}
+
+    def update_item(self, Key: Dict, UpdateExpression: str, ExpressionAttributeValues: Dict,
+                    ConditionExpression: Optional[str] = None) -> Dict:
+        current = self.items.get(Key[self.key_name])
+        self._check(current, ConditionExpression, ExpressionAttributeValues, "UpdateItem")
+        item = dict(current or Key)
+        set_part, _, add_part = UpdateExpression.partition(" ADD ")
+        for assignment in re.split(r",(?![^(]*\))", set_part.replace("SET ", "", 1)):
+            if not assignment.strip():
+                continue
+            name, value = [part.strip() for part in assignment.split("=", 1)]
+            match = re.fullmatch(r'if_not_exists\((\w+),\s*(:\w+)\)', value)
+            if match:
+                item[name] = item.get(match.group(1), ExpressionAttributeValues[match.group(2)])
+            else:
+                item[name] = ExpressionAttributeValues[value]
+        for addition in add_part.split(","):
+            if addition.strip():
+                name, value = addition.split()
+                item[name] = item.get(name, 0) + ExpressionAttributeValues[value]
+        self.items[Key[self.key_name]] = item
+        return {}
+
+    def _check(self, item: Optional[Dict], condition: Optional[str], values: Optional[Dict], operation: str) -> None:
+        if condition is None:
+            return
+        tokens = self.TOKEN.findall(condition)
+        position, result = self._or(tokens, 0, item or {}, values or {})
+        assert position == len(tokens), condition
+        if not result:
+            from botocore.exceptions import ClientError
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": condition}}, operation)
+
+    def _or(self, tokens, position, item, values):
+        position, result = self._and(tokens, position, item, values)
+        while position < len(tokens) and tokens[position] == "OR":
+            position, right = self._and(tokens, position + 1, item, values)
+            result = result or right
+        return position, result
+
+    def _and(self, tokens, position, item, values):
+        position, result = self._factor(tokens, position, item, values)
+        while position < len(tokens) and tokens[position] == "AND":
+            position, right = self._factor(tokens, position + 1, item, values)
+            result = result and right
+        return position, result
+
+    def _factor(self, tokens, position, item, values):
+        token = tokens[position]
+        if token == "(":
+            position, result = self._or(tokens, position + 1, item, values)
+            return position + 1, result
+        if token in ("attribute_not_exists", "attribute_exists"):
+            exists = tokens[position + 2] in item
+            return position + 4, exists if token == "attribute_exists" else not exists
+        name, operator, value = tokens[position:position + 3]
+        if name not in item:
+            return position + 3, False
+        left, right = item[name], values[value]
+        result = {
+            "=": left == right, "<>": left != right, "<": left < right,
+            "<=": left <= right, ">": left > right, ">=": left >= right,
+        }[operator]
+        return position + 3, result
+
+
+class FakeLambdaContext:
+    """Lambdaのcontext（残り時間は remaining_seconds から実時間で減る）"""
+
+    def __init__(self, remaining_seconds: float):
+        self._deadline = time.monotonic() + remaining_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+def invoke(lambda_function, body: Dict, context=None) -> Tuple[Dict, Dict, Optional[Dict]]:
+    """
+    lambda_handler を呼び出す
+
+    Returns:
+        (Lambdaの応答, 応答ボディ（JSON。NDJSONの場合は最後の行）, リクエストのログ行)
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        response = lambda_function.lambda_handler({'body': json.dumps(body, ensure_ascii=False)}, context)
+    lines = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{')]
+    request_logs = [line for line in lines if line.get('function') == 'chat']
+    body_lines = response['body'].strip().split('\n')
+    return response, json.loads(body_lines[-1]), request_logs[-1] if request_logs else None
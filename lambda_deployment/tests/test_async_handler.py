@@ -0,0 +1,99 @@
+"""asyncio版ハンドラー（ASYNC_HANDLER_ENABLED=true で run_async_handler に委譲）の応答が同期版と同じこと"""
+
+import contextlib
+import io
+import json
+
+import pytest
+
+import support
+
+GENE_DATA = support.sample_gene_data(20)
+
+
+@pytest.fixture
+def async_handler(lambda_function, fake_openai, monkeypatch):
+    """AsyncOpenAI をフェイク（同期版のフェイクと呼び出し記録を共有）に差し替えた async_handler"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import async_handler as module
+
+    async def get_async_openai_client(api_key):
+        return support.FakeAsyncOpenAI(fake_openai.completions)
+
+    monkeypatch.setattr(module, "get_async_openai_client", get_async_openai_client)
+    monkeypatch.setattr(module, "use_async_client", lambda: True)
+    monkeypatch.setattr(lambda_function, "get_openai_api_key", lambda force_refresh=False: "sk-test")
+    return module
+
+
+def run_turns(lambda_function, fake_openai, monkeypatch, turns, use_async):
+    """
+    同じリクエスト列を新しいセッションストアで実行
+
+    Returns:
+        [(statusCode, headers, ボディの各行（timestamp・conversationId を除く）, OpenAIへ送ったパラメータ), ...]
+    """
+    import conversation_store
+    monkeypatch.setattr(lambda_function, "ASYNC_HANDLER_ENABLED", use_async)
+    monkeypatch.setattr(conversation_store, "_default_store", None)
+    results = []
+    conversation_id = None
+    for body in turns:
+        if "conversationId" in body and body["conversationId"] == "previous":
+            body = {**body, "conversationId": conversation_id}
+        fake_openai.completions.calls.clear()
+        response, last_line, _ = support.invoke(lambda_function, body)
+        conversation_id = last_line.get("conversationId", conversation_id)
+        events = [json.loads(line) for line in response["body"].strip().split("\n")]
+        for event in events:
+            # 実行ごとに変わる値
+            event.pop("timestamp", None)
+            if "conversationId" in event:
+                event["conversationId"] = "<id>"
+        results.append((response["statusCode"], response["headers"], events, fake_openai.completions.calls[:]))
+    return results
+
+
+def assert_same_as_sync(lambda_function, fake_openai, monkeypatch, turns):
+    sync_results = run_turns(lambda_function, fake_openai, monkeypatch, turns, use_async=False)
+    async_results = run_turns(lambda_function, fake_openai, monkeypatch, turns, use_async=True)
+    assert async_results == sync_results
+    return async_results
+
+
+def test_json_mode_matches_sync(async_handler, lambda_function, fake_openai, monkeypatch):
+    results = assert_same_as_sync(lambda_function, fake_openai, monkeypatch, [
+        {"userId": "user-1", "message": "最近眠れません", "bloodData": support.sample_blood_data(), "geneData": GENE_DATA},
+    ])
+
+    assert results[0][0] == 200
+    assert "stream" not in results[0][3][0]
+
+
+def test_stream_mode_matches_sync(async_handler, lambda_function, fake_openai, monkeypatch):
+    monkeypatch.setattr(lambda_function, "STREAM_MODE_ENABLED", True)
+
+    results = assert_same_as_sync(lambda_function, fake_openai, monkeypatch, [
+        {"userId": "user-1", "message": "最近眠れません", "stream": True, "vitalData": support.SAMPLE_VITAL_DATA},
+    ])
+
+    assert results[0][1]["Content-Type"] == "application/x-ndjson"
+    assert results[0][3][0]["stream"] is True
+
+
+def test_session_mode_matches_sync(async_handler, lambda_function, fake_openai, monkeypatch):
+    results = assert_same_as_sync(lambda_function, fake_openai, monkeypatch, [
+        {"userId": "user-1", "message": "最近眠れません", "conversationId": None, "bloodData": support.sample_blood_data()},
+        {"userId": "user-1", "message": "どうすればいい？", "conversationId": "previous", "historyLength": 2},
+    ])
+
+    assert [status for status, *_ in results] == [200, 200]
+    # 2ターン目は保存済みの履歴を使う
+    assert [m["content"] for m in results[1][3][0]["messages"] if m["role"] == "user"][-2:] == ["最近眠れません", "どうすればいい？"]
+
+
+def test_validation_error_matches_sync(async_handler, lambda_function, fake_openai, monkeypatch):
+    results = assert_same_as_sync(lambda_function, fake_openai, monkeypatch, [{"userId": "user-1"}])
+
+    assert results[0][0] == 400
+    assert results[0][3] == []
@@ -0,0 +1,78 @@
+"""batch_sanitize（JSONLの一括サニタイズ: チャンク分割・出力順・マスク件数・レポート）"""
+
+import json
+
+import pytest
+
+from batch_sanitize import REPLACEMENT_TOKENS, BatchSanitizer, _chunks, count_redactions, sanitize_chunk
+from pii_sanitizer import sanitize_for_openai
+
+
+def record(n: int) -> str:
+    """n番目のリクエストボディ（n % 3 == 0 はメール1件、n % 5 == 0 は履歴に電話番号1件）"""
+    message = f"質問{n}: 連絡先は user{n}@example.com です" if n % 3 == 0 else f"質問{n}: 最近眠れません"
+    history = [{"role": "user", "content": f"電話は 090-1234-{n:04d} です"}] if n % 5 == 0 else []
+    return json.dumps({"userId": f"user-{n}", "message": message, "conversationHistory": history}, ensure_ascii=False)
+
+
+RECORDS = [record(n) for n in range(50)]
+
+
+def test_count_redactions_counts_new_tokens_per_pattern():
+    original = {
+        "message": "メールは a@b.com と c@d.jp、電話は 090-1234-5678",
+        "conversationHistory": [{"role": "assistant", "content": "[EMAIL] は既にマスク済み rs12345"}],
+    }
+
+    counts = count_redactions(original, sanitize_for_openai(original))
+
+    # 元から含まれていた [EMAIL] は数えない
+    assert counts == {"[EMAIL]": 2, "[PHONE]": 1, "[SNP]": 1}
+
+
+def test_chunks_split_records_and_skip_blank_lines():
+    chunks = list(_chunks(["a", "", "b", "  \n", "c", "d", "e"], chunk_size=2))
+
+    assert chunks == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_sanitize_chunk_skips_malformed_lines():
+    lines, counts, errors = sanitize_chunk(['{"userId": "u", "message": "a@b.com"}', "{not json", "[1, 2]", '"text"'])
+
+    assert errors == 3
+    assert [json.loads(line)["message"] for line in lines] == ["[EMAIL]"]
+    assert counts == {"[EMAIL]": 1}
+
+
+def test_missing_salt_is_not_counted_as_malformed(monkeypatch):
+    monkeypatch.delenv("PII_SALT")
+    import user_tokenizer
+    monkeypatch.setattr(user_tokenizer, "_default_tokenizer", None)
+
+    with pytest.raises(ValueError, match="PII_SALT"):
+        sanitize_chunk([RECORDS[1]])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_output_order_and_counts_are_deterministic(workers):
+    batch = BatchSanitizer(workers=workers, chunk_size=7, max_pending_chunks=2)
+
+    output = list(batch.run(RECORDS[:25] + ["{broken", ""] + RECORDS[25:]))
+
+    assert [json.loads(line) for line in output] == [sanitize_for_openai(json.loads(r)) for r in RECORDS]
+    report = batch.report()
+    assert report["records"] == 50
+    assert report["errors"] == 1
+    assert report["redactions"] == {
+        token: {"[EMAIL]": 17, "[PHONE]": 10}.get(token, 0) for token in REPLACEMENT_TOKENS
+    }
+    assert report["recordsPerSecond"] > 0
+    assert report["elapsedSeconds"] >= 0
+
+
+def test_report_before_run():
+    report = BatchSanitizer(workers=1).report()
+
+    assert report["records"] == 0
+    assert report["recordsPerSecond"] is None
+    assert set(report["redactions"]) == set(REPLACEMENT_TOKENS)
@@ -0,0 +1,116 @@
+"""ContextRenderCache（コンテンツアドレスのキー・ヒット/ミス数・共有ストア）"""
+
+import pytest
+
+import support
+from context_cache import ContextRenderCache, content_hash, get_context_cache
+
+
+class RecordingRenderer:
+    """描画関数の呼び出し回数を記録する"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, data, **options):
+        self.calls += 1
+        return f"{sorted(data.items())} {options}"
+
+
+class DictStore:
+    """DynamoDBRenderStore と同じ get/put を持つ共有ストア"""
+
+    def __init__(self, fail: bool = False):
+        self.items = {}
+        self.fail = fail
+
+    def get(self, key):
+        if self.fail:
+            raise RuntimeError("store unavailable")
+        return self.items.get(key)
+
+    def put(self, key, text):
+        if self.fail:
+            raise RuntimeError("store unavailable")
+        self.items[key] = text
+
+
+@pytest.fixture
+def renderer():
+    return RecordingRenderer()
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_hits_and_misses_are_counted(renderer):
+    cache = ContextRenderCache(max_size=8)
+
+    first = cache.render("blood", renderer, {"Hb": 14.5, "Ferritin": 125})
+    second = cache.render("blood", renderer, {"Ferritin": 125, "Hb": 14.5})
+    cache.render("blood", renderer, {"Hb": 13.0})
+
+    assert first == second
+    assert renderer.calls == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["shared_hits"]) == (1, 2, 0)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_kind_and_options_are_part_of_the_key(renderer):
+    cache = ContextRenderCache(max_size=8)
+    data = {"Hb": 14.5}
+
+    cache.render("blood", renderer, data)
+    cache.render("vital", renderer, data)
+    cache.render("blood", renderer, data, compact=True)
+
+    assert renderer.calls == 3
+    assert cache.stats()["hits"] == 0
+
+
+def test_local_cache_is_bounded(renderer):
+    cache = ContextRenderCache(max_size=2)
+
+    for value in range(3):
+        cache.render("blood", renderer, {"Hb": value})
+    cache.render("blood", renderer, {"Hb": 0})
+
+    assert renderer.calls == 4
+    assert cache.stats()["size"] == 2
+
+
+def test_shared_store_serves_other_instances(renderer):
+    store = DictStore()
+    ContextRenderCache(shared_store=store).render("blood", renderer, {"Hb": 14.5})
+    other = ContextRenderCache(shared_store=store)
+
+    text = other.render("blood", renderer, {"Hb": 14.5})
+    other.render("blood", renderer, {"Hb": 14.5})
+
+    assert renderer.calls == 1
+    assert text == store.items.popitem()[1]
+    stats = other.stats()
+    assert (stats["hits"], stats["misses"], stats["shared_hits"]) == (1, 1, 1)
+
+
+def test_shared_store_errors_fall_back_to_rendering(renderer):
+    cache = ContextRenderCache(shared_store=DictStore(fail=True))
+
+    assert cache.render("blood", renderer, {"Hb": 14.5}) == cache.render("blood", renderer, {"Hb": 14.5})
+    assert renderer.calls == 1
+    assert cache.stats()["shared_hits"] == 0
+
+
+def test_handler_renders_each_context_once_per_input(lambda_function):
+    body = {"userId": "user-1", "message": "今日のおすすめは？",
+            "bloodData": support.sample_blood_data(), "vitalData": support.SAMPLE_VITAL_DATA}
+
+    support.invoke(lambda_function, body)
+    support.invoke(lambda_function, body)
+
+    stats = get_context_cache().stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 2
@@ -0,0 +1,138 @@
+"""context_renderer（データコンテキストの描画）をサニタイズ済みデータで確認"""
+
+import pytest
+
+import support
+from context_renderer import (
+    build_blood_data_context,
+    build_blood_data_context_compact,
+    build_gene_data_context,
+    build_gene_data_context_bounded,
+    build_vital_data_context,
+    build_vital_data_context_compact,
+)
+from context_cache import get_context_cache
+from pii_sanitizer import PIISanitizer
+
+
+@pytest.fixture
+def blood():
+    return PIISanitizer.sanitize_blood_data(support.sample_blood_data(abnormal={"CRP": "異常", "LDL": "注意"}))
+
+
+@pytest.fixture
+def vital():
+    return PIISanitizer.sanitize_vital_data(support.SAMPLE_VITAL_DATA)
+
+
+@pytest.mark.parametrize("render", [build_blood_data_context, build_blood_data_context_compact])
+def test_every_sanitized_blood_item_is_rendered_with_its_name(render, blood):
+    context = render(blood)
+
+    for item in blood:
+        assert item["name"] in context
+    assert "|  " not in context and ":  " not in context
+
+
+def test_compact_blood_context(blood):
+    lines = build_blood_data_context_compact(blood[:7]).split("\n")
+
+    assert lines == [
+        "【血液検査】",
+        "判定|項目|値|基準値",
+        "異常|C反応性タンパク|0.08 mg/dL|0.00-0.30",
+        "注意|LDLコレステロール|105 mg/dL|70-139",
+        "正常5項目: ヘモグロビンA1c 5.6, 空腹時血糖 95, 中性脂肪 120, HDLコレステロール 58, 総コレステロール 195",
+    ]
+
+
+def test_sanitized_vital_context(vital):
+    assert build_vital_data_context_compact(vital) == (
+        "【バイタル(7日)】記録あり 体組成/心拍/活動量/VO2Max, VO2Max 標準(35-45), 安静時心拍数 良好(55-69bpm)"
+    )
+    assert build_vital_data_context(vital).split("\n")[2:] == [
+        "【記録状況】", "- 記録あり: 体組成/心拍/活動量/VO2Max", "- VO2Max: 標準(35-45)", "- 安静時心拍数: 良好(55-69bpm)",
+    ]
+
+
+def test_missing_heart_data_has_no_resting_hr_level():
+    vital = PIISanitizer.sanitize_vital_data({"stepCount": 4000.0})
+
+    assert vital["resting_hr_level"] == "average"
+    assert build_vital_data_context_compact(vital) == "【バイタル(7日)】記録あり 活動量"
+
+
+def test_raw_vital_data_is_still_rendered():
+    assert "安静時心拍数 58 bpm" in build_vital_data_context_compact(support.SAMPLE_VITAL_DATA)
+
+
+def test_handler_compact_prompt_uses_sanitized_names(lambda_function, fake_openai):
+    body = {
+        "userId": "user-1", "message": "今日のおすすめは？", "contextFormat": "compact",
+        "bloodData": support.sample_blood_data(), "vitalData": support.SAMPLE_VITAL_DATA,
+    }
+
+    support.invoke(lambda_function, body)
+
+    prompt = "\n".join(message["content"] for message in fake_openai.completions.calls[0]["messages"])
+    assert "正常25項目: ヘモグロビンA1c 5.6, 空腹時血糖 95" in prompt
+    assert "【バイタル(7日)】記録あり 体組成/心拍/活動量/VO2Max" in prompt
+
+
+def sanitized_gene_data(markers):
+    return PIISanitizer.sanitize_gene_data(support.sample_gene_data(markers, snps_per_marker=1))
+
+
+def test_sanitized_gene_markers_show_their_score():
+    context = build_gene_data_context(sanitized_gene_data(2))
+
+    assert context.split("\n")[2:] == [
+        "■ 睡眠", "  - 睡眠マーカー1", "    影響スコア: +1 (high)", "", "■ 糖質代謝", "  - 糖質代謝マーカー2", "    影響スコア: -1 (low)",
+    ]
+
+
+def test_sanitized_gene_data_is_bounded_by_relevance():
+    gene_data = sanitized_gene_data(1300)
+
+    context = build_gene_data_context_bounded(gene_data, query="お酒を飲むと眠れない", max_chars=600)
+
+    assert len(context) <= 600 + 60
+    assert context.split("\n")[2] == "■ アルコール代謝"
+    assert "影響スコア" in context
+    assert context.endswith("件は省略しています）")
+
+
+@pytest.mark.parametrize("markers", [3, 1300])
+def test_gene_context_is_rendered_once_per_input_when_within_bounds(lambda_function, fake_openai, markers):
+    gene_data = support.sample_gene_data(markers, snps_per_marker=1)
+    messages = ["睡眠の質を上げたい", "お酒は控えた方がいい？", "筋トレのメニューは？"]
+
+    for message in messages:
+        support.invoke(lambda_function, {"userId": "user-1", "message": message, "geneData": gene_data})
+
+    stats = get_context_cache().stats()
+    if markers == 3:
+        # 上限内: 質問はキャッシュキーに入らないので2ターン目以降はヒット
+        assert (stats["misses"], stats["hits"]) == (1, 2)
+    else:
+        # 上限超: 全体の描画はヒット、質問に応じた要約は毎ターン描画
+        assert (stats["misses"], stats["hits"]) == (1 + len(messages), len(messages) - 1)
+
+
+def test_over_budget_gene_context_is_rendered_in_full_once(lambda_function, monkeypatch):
+    import context_renderer
+    calls = []
+    original = context_renderer.build_gene_data_context
+
+    def counting(gene_data):
+        calls.append(gene_data)
+        return original(gene_data)
+
+    monkeypatch.setattr(context_renderer, "build_gene_data_context", counting)
+    monkeypatch.setattr(lambda_function, "build_gene_data_context", counting)
+    gene_data = support.sample_gene_data(1300, snps_per_marker=1)
+
+    support.invoke(lambda_function, {"userId": "user-1", "message": "お酒は控えた方がいい？", "geneData": gene_data})
+
+    assert len(calls) == 1
+    assert get_context_cache().stats()["misses"] == 2
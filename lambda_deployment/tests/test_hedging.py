@@ -0,0 +1,127 @@
+"""hedging（遅い1本目をヘッジし、負けた側の最初のトークン待ちを中断する）"""
+
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import support
+from hedging import HedgePolicy, LatencyWindow, abort_stream, hedged_call, prime_stream
+from retry_scheduler import Deadline, with_attempt_timeout
+from slim_openai_client import SlimOpenAI
+
+POLICY = HedgePolicy(enabled=True, delay_ms=100, min_delay_ms=100, min_samples=1000, hedge_model="hedge-model")
+
+
+class BlockingStream:
+    """abort() されるまで最初のチャンクを返さないストリーム"""
+
+    def __init__(self):
+        self.aborted = threading.Event()
+        self.closed = False
+
+    def __iter__(self):
+        if not self.aborted.wait(10):
+            raise AssertionError("loser was not aborted")
+        raise ConnectionError("aborted")
+        yield
+
+    def abort(self):
+        self.aborted.set()
+
+    def close(self):
+        self.closed = True
+
+
+def text_of(stream):
+    return "".join(chunk.choices[0].delta.content for chunk in stream if chunk.choices)
+
+
+def test_loser_is_aborted_once_the_hedge_wins():
+    slow = BlockingStream()
+    finished = threading.Event()
+
+    def start(model):
+        try:
+            if model == "primary-model":
+                return prime_stream(slow)
+            return prime_stream(iter([support.text_chunk("こんにちは"), support.usage_chunk()]))
+        finally:
+            if model == "primary-model":
+                finished.set()
+
+    started = time.monotonic()
+    stream = hedged_call(start, "primary-model", policy=POLICY, window=LatencyWindow())
+
+    assert text_of(stream) == "こんにちは"
+    assert finished.wait(1.0)
+    assert slow.aborted.is_set()
+    assert time.monotonic() - started < 1.0
+
+
+def test_slim_stream_waiting_for_first_token_is_released():
+    # 1本目は最初のトークンまで5秒（ヘッダーは即時）、2本目はすぐ返る
+    with support.FakeOpenAIServer(plan=[(200, {}, 5.0)]) as server:
+        client = SlimOpenAI(api_key="sk-test", base_url=server.base_url)
+        released = {}
+
+        def start(model):
+            try:
+                return prime_stream(with_attempt_timeout(client, Deadline()).chat.completions.create(
+                    model=model, messages=[], stream=True
+                ))
+            finally:
+                released[model] = time.monotonic()
+
+        started = time.monotonic()
+        stream = hedged_call(start, "primary-model", policy=POLICY, window=LatencyWindow())
+        assert text_of(stream) == support.REPLY
+
+        deadline = time.monotonic() + 2.0
+        while "primary-model" not in released and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert [request["model"] for request in server.requests] == ["primary-model", "hedge-model"]
+    # 1本目のワーカーは5秒のトークン待ちやタイムアウト（60秒）を待たずに解放される
+    assert released["primary-model"] - started < 1.5
+
+
+def test_primary_that_wins_before_the_threshold_is_not_hedged():
+    calls = []
+
+    def start(model):
+        calls.append(model)
+        return prime_stream(iter([support.text_chunk("はい")]))
+
+    stream = hedged_call(start, "primary-model", policy=POLICY, window=LatencyWindow())
+
+    assert text_of(stream) == "はい"
+    assert calls == ["primary-model"]
+
+
+def test_both_failing_raises_the_primary_error():
+    def start(model):
+        time.sleep(0.2 if model == "primary-model" else 0.0)
+        raise ValueError(model)
+
+    with pytest.raises(ValueError, match="primary-model"):
+        hedged_call(start, "primary-model", policy=POLICY, window=LatencyWindow())
+
+
+def test_abort_stream_shuts_down_the_sdk_response_socket():
+    # openai SDK の Stream は httpx のレスポンス（network_stream 拡張）からソケットを取り出す
+    reader, writer = socket.socketpair()
+    network_stream = SimpleNamespace(get_extra_info=lambda name: reader if name == "socket" else None)
+    stream = SimpleNamespace(response=SimpleNamespace(extensions={"network_stream": network_stream}))
+    try:
+        abort_stream(stream)
+        reader.settimeout(1.0)
+        assert reader.recv(1) == b""
+    finally:
+        reader.close()
+        writer.close()
+
+    # 拡張を持たないストリームでは何もしない
+    abort_stream(iter([]))
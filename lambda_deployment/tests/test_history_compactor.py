@@ -0,0 +1,108 @@
+"""HistoryCompactor（会話履歴のトークン上限・直近ターンの保持・ローリングサマリーの再利用）"""
+
+import pytest
+
+from history_compactor import SUMMARY_HEADER, HistoryCompactor, extractive_summarizer
+from token_counter import count_message_tokens, count_text_tokens, message_token_counts
+
+BUDGET = 2000
+
+
+def turn(n: int):
+    return [
+        {"role": "user", "content": f"質問{n}: 最近{n}日ほど眠りが浅く、朝に疲れが残ります。どうすればいいですか？"},
+        {"role": "assistant", "content": f"回答{n}: 【睡眠】\n就寝前の画面時間を減らし、起床時刻を揃えましょう。" + "夕方以降のカフェインは控えめに。" * 5},
+    ]
+
+
+def history(turns: int):
+    return [message for n in range(turns) for message in turn(n)]
+
+
+class RecordingSummarizer:
+    """extractive_summarizer への呼び出しを記録する"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, previous_summary, messages):
+        self.calls.append((previous_summary, list(messages)))
+        return extractive_summarizer(previous_summary, messages)
+
+
+@pytest.fixture
+def summarizer():
+    return RecordingSummarizer()
+
+
+@pytest.fixture
+def compactor(summarizer):
+    return HistoryCompactor(max_tokens=BUDGET, summarizer=summarizer)
+
+
+def test_history_within_budget_is_returned_unchanged(compactor, summarizer):
+    short = history(2)
+
+    assert compactor.compact(short) is short
+    assert summarizer.calls == []
+
+
+def test_sixty_turns_fit_the_token_ceiling(compactor):
+    long_history = history(60)
+    assert sum(message_token_counts(long_history)) > BUDGET * 2
+
+    compacted = compactor.compact(long_history)
+
+    assert sum(message_token_counts(compacted)) <= BUDGET
+    assert compacted[0]["role"] == "system"
+    assert compacted[0]["content"].startswith(SUMMARY_HEADER)
+    # 直近のターンはそのまま残る
+    recent = compacted[1:]
+    assert len(recent) >= 2
+    assert recent == long_history[-len(recent):]
+    assert recent[-1] == turn(59)[1]
+
+
+def test_next_turn_reuses_cached_rolling_summary(compactor, summarizer):
+    compactor.compact(history(60))
+    first_summarized = len(summarizer.calls[-1][1])
+
+    compacted = compactor.compact(history(61))
+
+    assert sum(message_token_counts(compacted)) <= BUDGET
+    assert len(summarizer.calls) == 2
+    previous_summary, messages = summarizer.calls[-1]
+    # 前回の要約を起点に、新しく古くなったメッセージだけを要約する
+    assert previous_summary is not None
+    assert 0 < len(messages) <= 2
+    assert len(messages) < first_summarized
+
+    # 同じ履歴をもう一度送った場合は要約器を呼ばない
+    compactor.compact(history(61))
+    assert len(summarizer.calls) == 2
+
+
+def test_summary_over_its_budget_keeps_newest_lines():
+    compactor = HistoryCompactor(max_tokens=BUDGET)
+    lines = [f"- ユーザー: 質問{n}" for n in range(200)]
+    message = {"role": "system", "content": "\n".join([SUMMARY_HEADER] + lines)}
+    budget = 100
+    assert count_message_tokens(message) > budget
+
+    content = compactor._fit_summary(message, budget)
+
+    kept = content.split("\n")
+    assert kept[0] == SUMMARY_HEADER
+    assert kept[-1] == lines[-1]
+    assert kept[1:] == lines[-(len(kept) - 1):]
+    assert count_message_tokens({"role": "system", "content": content}) <= budget
+    assert count_text_tokens(content) < count_text_tokens(message["content"])
+
+
+def test_small_summary_ratio_still_respects_ceiling():
+    compactor = HistoryCompactor(max_tokens=600, summary_ratio=0.05)
+
+    compacted = compactor.compact(history(60))
+
+    assert sum(message_token_counts(compacted)) <= 600
+    assert compacted[0]["content"].startswith(SUMMARY_HEADER)
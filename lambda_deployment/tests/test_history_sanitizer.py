@@ -0,0 +1,98 @@
+"""会話履歴のサニタイズ（historySequence による走査の省略・メッセージごとのキャッシュ）"""
+
+import json
+import time
+import types
+
+import pytest
+
+import pii_sanitizer
+import support
+from pii_sanitizer import PIISanitizer, get_history_cache, sanitize_history_text
+
+HISTORY = [
+    {"role": "user", "content": "連絡先は taro.yamada@example.com です"},
+    {"role": "assistant", "content": "承知しました"},
+]
+
+
+def sent_contents(fake_openai):
+    return [m["content"] for m in fake_openai.completions.calls[-1]["messages"] if m["role"] != "system"]
+
+
+def test_history_sequence_is_ignored_without_session(lambda_function, fake_openai):
+    _, _, request_log = support.invoke(lambda_function, {
+        "userId": "user-a", "message": "続きです", "conversationHistory": HISTORY, "historySequence": 2,
+    })
+
+    sent = sent_contents(fake_openai)
+    assert sent[0] == "連絡先は [EMAIL] です"
+    assert all("taro.yamada" not in content for content in sent)
+    assert "conversationId" not in request_log
+
+
+@pytest.mark.parametrize("expired", [False, True])
+def test_history_sequence_is_ignored_when_session_is_missing_or_expired(lambda_function, fake_openai, expired):
+    conversation_id = "unknown"
+    if expired:
+        _, first, _ = support.invoke(lambda_function, {"userId": "user-a", "message": "こんにちは", "conversationId": None})
+        conversation_id = first["conversationId"]
+        store = lambda_function.get_conversation_store()
+        store.cache.clear()
+        item = store.backend.get(conversation_id)
+        store.backend._items[conversation_id] = json.dumps({**item, "expiresAt": int(time.time()) - 60})
+
+    _, body, request_log = support.invoke(lambda_function, {
+        "userId": "user-a", "message": "続きです", "conversationId": conversation_id,
+        "conversationHistory": HISTORY, "historySequence": 2,
+    })
+
+    # 検証できない historySequence は信頼せず、履歴全体をサニタイズし直す
+    assert request_log["sessionCreated"] is True
+    assert request_log["previousConversationId"] == conversation_id
+    assert body["conversationId"] != conversation_id
+    assert sent_contents(fake_openai)[:3] == ["連絡先は [EMAIL] です", "承知しました", "続きです"]
+
+
+def test_trusted_prefix_is_skipped_only_with_a_session(lambda_function):
+    request_log = types.SimpleNamespace(set=lambda **fields: None)
+
+    def trusted_length(body):
+        return lambda_function.parse_chat_request({"body": json.dumps(body)}, request_log).trusted_history_length
+
+    base = {"userId": "user-a", "message": "m", "historySequence": 2}
+    assert trusted_length(base) == 0
+    assert trusted_length({**base, "conversationId": None}) == 0
+    assert trusted_length({**base, "conversationId": "c1"}) == 2
+    assert trusted_length({**base, "conversationId": "c1", "historySequence": "2"}) == 0
+    assert trusted_length({**base, "conversationId": "c1", "historySequence": -1}) == 0
+
+
+def test_cache_hit_returns_cached_sanitized_text(monkeypatch):
+    text = "電話 090-1234-5678 に連絡ください"
+    first = sanitize_history_text(text)
+
+    def fail(text):
+        raise AssertionError("cached text was scanned again")
+
+    monkeypatch.setattr(PIISanitizer, "sanitize_text", fail)
+    assert sanitize_history_text(text) == first == "電話 [PHONE] に連絡ください"
+    assert get_history_cache().stats()["hits"] == 1
+
+
+def test_cache_is_bounded_by_pii_history_cache_size(monkeypatch):
+    monkeypatch.setattr(pii_sanitizer, "PII_HISTORY_CACHE_SIZE", 3)
+    scanned = []
+    original = PIISanitizer.sanitize_text
+    monkeypatch.setattr(PIISanitizer, "sanitize_text", lambda text: scanned.append(text) or original(text))
+
+    texts = [f"メッセージ{i}: 0{i}0-1234-5678" for i in range(5)]
+    for text in texts:
+        sanitize_history_text(text)
+
+    assert len(get_history_cache()) == 3
+    # 最も古いものは追い出されて再走査、新しいものはキャッシュから返る
+    sanitize_history_text(texts[4])
+    sanitize_history_text(texts[0])
+    assert scanned == texts + [texts[0]]
+    assert len(get_history_cache()) == 3
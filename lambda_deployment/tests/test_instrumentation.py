@@ -0,0 +1,118 @@
+"""instrumentation（span の計測とCloudWatch Embedded Metric Format の出力）"""
+
+import json
+import time
+
+import pytest
+
+import instrumentation
+import structured_logging
+from instrumentation import emf_fields, record_count, span, time_first_item
+from structured_logging import end_request, start_request
+
+EMF_UNITS = {"Milliseconds", "Count"}
+
+
+def assert_emf_record(record):
+    """CloudWatch EMF の仕様（_aws.Timestamp / CloudWatchMetrics / トップレベルの値）を満たすか"""
+    metadata = record["_aws"]
+    assert isinstance(metadata["Timestamp"], int)
+    assert abs(metadata["Timestamp"] - time.time() * 1000) < 60_000
+    (directive,) = metadata["CloudWatchMetrics"]
+    assert set(directive) == {"Namespace", "Dimensions", "Metrics"}
+    assert isinstance(directive["Namespace"], str) and directive["Namespace"]
+    for dimension_set in directive["Dimensions"]:
+        assert 1 <= len(dimension_set) <= 30
+        for dimension in dimension_set:
+            assert isinstance(record[dimension], str)
+    assert 1 <= len(directive["Metrics"]) <= instrumentation.MAX_METRICS_PER_RECORD
+    for metric in directive["Metrics"]:
+        assert set(metric) == {"Name", "Unit"}
+        assert metric["Unit"] in EMF_UNITS
+        assert isinstance(record[metric["Name"]], (int, float))
+    return {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]}
+
+
+def flushed_record(capsys):
+    (line,) = capsys.readouterr().out.splitlines()
+    return json.loads(line)
+
+
+def test_emf_fields_match_the_cloudwatch_schema():
+    fields = emf_fields("chat", {"piiSanitize": 1.5, "openaiTotal": 820.0}, duration_ms=900.0, counts={"sessionCreated": 1})
+
+    units = assert_emf_record(json.loads(json.dumps(fields)))
+    assert units == {
+        "piiSanitizeMs": "Milliseconds", "openaiTotalMs": "Milliseconds",
+        "durationMs": "Milliseconds", "sessionCreated": "Count",
+    }
+    assert fields["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["function"]]
+    assert fields["function"] == "chat"
+    assert fields["piiSanitizeMs"] == 1.5
+
+
+def test_metrics_are_capped_per_directive():
+    timings = {f"phase{n}": float(n) for n in range(instrumentation.MAX_METRICS_PER_RECORD + 10)}
+
+    fields = emf_fields("chat", timings)
+
+    assert len(fields["_aws"]["CloudWatchMetrics"][0]["Metrics"]) == instrumentation.MAX_METRICS_PER_RECORD
+
+
+def test_disabled_metrics_fall_back_to_plain_timings(capsys, monkeypatch):
+    monkeypatch.setattr(instrumentation, "METRICS_ENABLED", False)
+    assert emf_fields("chat", {"promptBuild": 1.0}) == {}
+
+    start_request("chat")
+    with span("promptBuild"):
+        pass
+    end_request()
+
+    record = flushed_record(capsys)
+    assert "_aws" not in record
+    assert set(record["timings"]) == {"promptBuild"}
+
+
+def test_spans_are_summed_and_flushed_as_emf(capsys, monkeypatch):
+    monkeypatch.setattr(structured_logging.random, "random", lambda: 0.99)
+
+    @span("secretFetch")
+    def fetch():
+        return "secret"
+
+    start_request("chat")
+    assert fetch() == "secret"
+    with span("piiSanitize"):
+        pass
+    with span("piiSanitize") as measured:
+        pass
+    record_count("sessionCreated")
+    deltas = list(time_first_item(iter(["a", "b"]), "openaiFirstToken", time.perf_counter()))
+    end_request(statusCode=200)
+
+    record = flushed_record(capsys)
+    units = assert_emf_record(record)
+    assert deltas == ["a", "b"]
+    assert measured.elapsed_ms is not None
+    assert set(units) == {"secretFetchMs", "piiSanitizeMs", "openaiFirstTokenMs", "durationMs", "sessionCreated"}
+    assert record["sessionCreated"] == 1
+    assert record["statusCode"] == 200
+
+
+def test_span_records_time_when_the_block_raises(capsys):
+    start_request("chat")
+    with pytest.raises(ValueError):
+        with span("bodyParse"):
+            raise ValueError("bad body")
+    end_request()
+
+    assert "bodyParseMs" in assert_emf_record(flushed_record(capsys))
+
+
+def test_handler_request_line_is_a_valid_emf_record(lambda_function, capsys):
+    lambda_function.lambda_handler({"body": json.dumps({"userId": "user-1", "message": "こんにちは"})}, None)
+
+    record = flushed_record(capsys)
+    units = assert_emf_record(record)
+    assert record["function"] == "chat"
+    assert {"piiSanitizeMs", "promptBuildMs", "openaiTotalMs", "durationMs"} <= set(units)
@@ -0,0 +1,118 @@
+"""intent_router（質問内容による血液・バイタル項目の絞り込み）をサニタイズ済みデータで確認"""
+
+import json
+
+import pytest
+
+import support
+from intent_router import BLOOD_NAME_KEYS, DOMAIN_METRICS, blood_item_key, build_route, filter_blood_items, filter_vital_data, route_intent
+from pii_sanitizer import PIISanitizer
+
+RECOVERY_NAMES = {"C反応性タンパク", "クレアチンキナーゼ", "フェリチン", "アルブミン", "乳酸脱水素酵素", "ヘモグロビン", "赤血球数", "ヘマトクリット"}
+
+
+def prompt_text(fake_openai):
+    return "\n".join(message["content"] for message in fake_openai.completions.calls[0]["messages"])
+
+
+def test_every_app_marker_resolves_from_the_sanitized_name():
+    for item in PIISanitizer.sanitize_blood_data(support.sample_blood_data()):
+        assert blood_item_key(item) in {key.lower() for key in BLOOD_NAME_KEYS.values()} | {"fbg", "insulin"}
+    raw = support.sample_blood_data()
+    sanitized = PIISanitizer.sanitize_blood_data(raw)
+    assert [blood_item_key(item) for item in raw] == [blood_item_key(item) for item in sanitized]
+
+
+def test_sanitized_blood_items_keep_the_domain_markers():
+    blood = PIISanitizer.sanitize_blood_data(support.sample_blood_data(abnormal={"HbA1c": "異常"}))
+
+    kept, omitted = filter_blood_items(blood, route_intent("眠れないし疲れが取れない"))
+
+    assert {item["name"] for item in kept} == RECOVERY_NAMES | {"ヘモグロビンA1c"}
+    assert omitted == len(blood) - len(kept)
+
+
+@pytest.mark.parametrize("domain", sorted(DOMAIN_METRICS))
+def test_each_domain_keeps_its_spec_markers(domain):
+    blood = PIISanitizer.sanitize_blood_data(support.sample_blood_data())
+    kept, _ = filter_blood_items(blood, build_route((domain,)))
+
+    kept_keys = {blood_item_key(item) for item in kept}
+    present = {blood_item_key(item) for item in blood}
+    assert {key.lower() for key in DOMAIN_METRICS[domain]["blood"]} & present <= kept_keys
+
+
+def test_sanitized_vital_fields_are_routed():
+    vital = PIISanitizer.sanitize_vital_data(support.SAMPLE_VITAL_DATA)
+
+    assert set(filter_vital_data(vital, build_route(("recovery",)))) == {"has_heart_data", "resting_hr_level"}
+    assert set(filter_vital_data(vital, build_route(("metabolic",)))) == {
+        "has_body_composition", "has_vo2max", "vo2max_level", "has_activity_data",
+    }
+
+
+def test_handler_prompt_keeps_normal_recovery_markers(lambda_function, fake_openai):
+    body = {"userId": "user-1", "message": "眠れないし疲れが取れない", "bloodData": support.sample_blood_data()}
+
+    response, _, request_log = support.invoke(lambda_function, body)
+
+    prompt = prompt_text(fake_openai)
+    assert response["statusCode"] == 200
+    assert "フェリチン" in prompt and "C反応性タンパク" in prompt
+    assert "ヘモグロビンA1c" not in prompt
+    assert "17件は省略" in prompt
+
+
+@pytest.mark.parametrize("message, metabolic", [
+    ("太陽の光を浴びると眠りやすい？", False),
+    ("太ももの筋肉痛がつらい", False),
+    ("丸太を運んで疲れた", False),
+    ("最近太りやすくなりました", True),
+    ("太ったので痩せたい", True),
+    ("甘いものを食べると太る？", True),
+])
+def test_weight_keywords_do_not_match_other_words_with_the_same_kanji(message, metabolic):
+    route = route_intent(message)
+
+    assert (route is not None and "metabolic" in route.domains) is metabolic
+
+
+def test_routed_context_follows_the_history(lambda_function, fake_openai):
+    history = [{"role": "user", "content": "こんにちは"}, {"role": "assistant", "content": "どうしましたか"}]
+    body = {"userId": "user-1", "message": "眠れないし疲れが取れない", "bloodData": support.sample_blood_data(),
+            "conversationHistory": history}
+
+    support.invoke(lambda_function, body)
+
+    contents = [message["content"] for message in fake_openai.completions.calls[0]["messages"]]
+    blood_index = next(i for i, content in enumerate(contents) if "17件は省略" in content)
+    # システムプロンプト → 会話履歴 → 絞り込み済みの血液データ → ユーザーメッセージ
+    assert contents[1:3] == ["こんにちは", "どうしましたか"]
+    assert blood_index > 2
+    assert contents[-1] == "眠れないし疲れが取れない"
+
+
+def test_replay_compares_routed_and_unrouted_prompt_tokens(lambda_function, tmp_path, capsys, monkeypatch):
+    import intent_router_replay
+    from token_counter import count_messages_tokens
+
+    bodies = [
+        {"userId": "user-1", "message": "最近眠れません", "bloodData": support.sample_blood_data(),
+         "vitalData": support.SAMPLE_VITAL_DATA, "conversationId": "c1"},
+        {"userId": "user-2", "message": "今日のおすすめは？", "bloodData": support.sample_blood_data()},
+        {"userId": "user-3", "message": "こんにちは"},
+    ]
+    source = tmp_path / "requests.jsonl"
+    source.write_text("\n".join(json.dumps(body, ensure_ascii=False) for body in bodies) + "\n", encoding="utf-8")
+    monkeypatch.setattr("sys.argv", ["intent_router_replay.py", str(source)])
+
+    assert intent_router_replay.main() == 0
+
+    *rows, total = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [row["domains"] for row in rows] == [["recovery"], None]
+    _, routed = intent_router_replay.build_prompt(bodies[0])
+    _, unrouted = intent_router_replay.build_prompt(bodies[0], scope="all")
+    assert rows[0]["routedTokens"] == count_messages_tokens(routed) < rows[0]["allTokens"] == count_messages_tokens(unrouted)
+    assert rows[1]["savedTokens"] == 0
+    assert total["requests"] == 2 and total["routedRequests"] == 1
+    assert total["savedTokens"] == rows[0]["savedTokens"] > 0
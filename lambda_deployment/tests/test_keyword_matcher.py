@@ -0,0 +1,96 @@
+"""KeywordMatcher（Aho–Corasick法）と str.find による素朴な検索の一致"""
+
+import random
+
+import pytest
+
+from keyword_matcher import KeywordMatch, KeywordMatcher
+
+# 重なり（頭痛/痛/痛い）・他のキーワードの接尾辞（痛/頭痛, い/痛い）・接頭辞（眠/眠れない）を含む
+KEYWORDS = {
+    "痛み": ["痛い", "痛み", "痛", "頭痛", "いたい", "い"],
+    "睡眠": ["眠れない", "眠", "不眠", "れない"],
+    "英字": ["abc", "bc", "c", "abcd", "CA"],
+}
+ALPHABET = list("頭痛いたみ眠れな不abcdABCD 。") + ["頭痛", "眠れない", "abca"]
+
+
+def naive_find_all(keywords, text):
+    """キーワードごとに str.find で重なりを含めて全位置を探す"""
+    lowered = text.lower()
+    matches = []
+    for group, words in keywords.items():
+        for keyword in words:
+            start = lowered.find(keyword.lower())
+            while start != -1:
+                matches.append(KeywordMatch(keyword, start, start + len(keyword), group))
+                start = lowered.find(keyword.lower(), start + 1)
+    return sorted(matches, key=lambda m: (m.end, m.start, m.keyword))
+
+
+def sorted_matches(matches):
+    return sorted(matches, key=lambda m: (m.end, m.start, m.keyword))
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return KeywordMatcher.from_groups(KEYWORDS)
+
+
+def test_overlapping_and_suffix_keywords_with_exact_offsets(matcher):
+    assert sorted_matches(matcher.find_all("頭痛い")) == [
+        KeywordMatch("頭痛", 0, 2, "痛み"),
+        KeywordMatch("痛", 1, 2, "痛み"),
+        KeywordMatch("痛い", 1, 3, "痛み"),
+        KeywordMatch("い", 2, 3, "痛み"),
+    ]
+    assert sorted_matches(matcher.find_all("不眠れない")) == [
+        KeywordMatch("不眠", 0, 2, "睡眠"),
+        KeywordMatch("眠", 1, 2, "睡眠"),
+        KeywordMatch("眠れない", 1, 5, "睡眠"),
+        KeywordMatch("れない", 2, 5, "睡眠"),
+        KeywordMatch("い", 4, 5, "痛み"),
+    ]
+
+
+def test_repeated_overlapping_occurrences(matcher):
+    matches = [m for m in matcher.find_all("abcabcd") if m.keyword in ("abc", "abcd", "CA")]
+
+    assert sorted_matches(matches) == [
+        KeywordMatch("abc", 0, 3, "英字"),
+        KeywordMatch("CA", 2, 4, "英字"),
+        KeywordMatch("abc", 3, 6, "英字"),
+        KeywordMatch("abcd", 3, 7, "英字"),
+    ]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_naive_search_on_random_text(matcher, seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+
+    assert sorted_matches(matcher.find_all(text)) == naive_find_all(KEYWORDS, text)
+    assert matcher.contains_any(text) == bool(naive_find_all(KEYWORDS, text))
+
+
+def test_results_are_in_end_position_order(matcher):
+    ends = [m.end for m in matcher.find_all("頭痛で眠れないabcd")]
+
+    assert ends == sorted(ends)
+
+
+def test_count_by_payload_and_empty_inputs(matcher):
+    assert matcher.count_by_payload("頭痛で眠れない") == {"痛み": 3, "睡眠": 3}
+    assert matcher.find_all("") == []
+    assert KeywordMatcher().find_all("頭痛") == []
+    with pytest.raises(ValueError):
+        KeywordMatcher().add("")
+
+
+def test_added_keyword_rebuilds_automaton():
+    matcher = KeywordMatcher.from_groups({"痛み": ["頭痛"]})
+    assert matcher.find_all("腹痛") == []
+
+    matcher.add("腹痛", "痛み")
+
+    assert matcher.find_all("腹痛") == [KeywordMatch("腹痛", 0, 2, "痛み")]
@@ -0,0 +1,73 @@
+"""PIIScrubber（1回走査のPII除去）と従来の順次 re.sub の出力の一致"""
+
+import random
+import re
+
+import pytest
+
+from pii_sanitizer import PIISanitizer, get_pii_scrubber
+
+ALPHABET = list("0123456789-−/.@_ab rsRSc.com日本語、。ａ１|%+") + [
+    ".com", "@x.jp", "rs12", "090-1234-5678", "03−1234−5678", "123-4567-8901", "2024/1/2", "2024-05-01",
+    "taro.yamada@example.co.jp", "ſ", "K", "İ", "ı", "\n",
+]
+
+TRANSCRIPT_LINES = [
+    "最近よく眠れなくて、朝起きるのがつらいです。",
+    "血糖値が 110 mg/dL と言われました。改善するにはどうすればいいですか？",
+    "【セクション1: 分析】\n**睡眠の質** について、HRVが低めです。\n---\n1日7,000歩を目標にしましょう。",
+    "遺伝子検査の結果で rs1801133 が気になります",
+    "連絡先は taro.yamada@example.com です",
+    "2024/05/01 の健診結果を見てください",
+    "電話 090-1234-5678 に連絡ください",
+    "運動は週3回、30分程度が目安です。タンパク質は体重1kgあたり1.2gを目安に。",
+]
+
+
+def legacy_sanitize_text(text):
+    """PIIScrubber 導入前の PIISanitizer.sanitize_text"""
+    if not text:
+        return ""
+    result = text
+    for pattern, replacement in PIISanitizer.PII_PATTERNS:
+        result = re.sub(pattern, replacement, result, flags=re.IGNORECASE)
+    return result
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_sequential_substitution_on_fuzzed_strings(seed):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 30)))
+        assert PIISanitizer.sanitize_text(text) == legacy_sanitize_text(text), text
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_sequential_substitution_on_transcripts(seed):
+    rng = random.Random(100 + seed)
+    for _ in range(500):
+        text = " ".join(rng.choice(TRANSCRIPT_LINES) for _ in range(rng.randint(1, 6)))
+        assert PIISanitizer.sanitize_text(text) == legacy_sanitize_text(text)
+
+
+@pytest.mark.parametrize("text", [
+    "123-0456-7890-1234",          # 異なるパターンの候補が重なる（順次置換へフォールバック）
+    "090-1234-5678-2024/01/02",
+    "a@b.co090-1234-5678",
+    "rs123@example.com",
+    "2024/01/02/03",
+    "0901234567812345",
+])
+def test_overlapping_candidates_fall_back_to_sequential(text):
+    assert get_pii_scrubber().scrub(text) == legacy_sanitize_text(text)
+
+
+def test_replacements():
+    text = "taro@example.com 090-1234-5678 123-4567-8901 2024/05/01 rs1801133"
+    assert PIISanitizer.sanitize_text(text) == "[EMAIL] [PHONE] [ID] [DATE] [SNP]"
+
+
+def test_text_without_digits_or_at_sign_is_returned_unchanged():
+    text = "最近よく眠れません。rsってなんですか？"
+    assert get_pii_scrubber().scrub(text) is text
+    assert PIISanitizer.sanitize_text("") == ""
@@ -0,0 +1,70 @@
+"""プロンプトキャッシュ（prompt_cache_key・メッセージの並び順・キャッシュ済みトークン数のログ）"""
+
+import types
+
+import pytest
+
+import support
+
+FIRST = {"userId": "user-1", "message": "今日のおすすめは？", "bloodData": support.sample_blood_data()}
+
+
+def next_turn(body, message):
+    history = [{"role": "user", "content": body["message"]}, {"role": "assistant", "content": support.REPLY}]
+    return {**body, "message": message, "conversationHistory": history}
+
+
+def leading_system_messages(messages):
+    prefix = []
+    for message in messages:
+        if message["role"] != "system" or message["content"].startswith("【ヒント】"):
+            break
+        prefix.append(message)
+    return prefix
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_prompt_cache_key_and_prefix_are_stable_across_turns(lambda_function, fake_openai, monkeypatch, stream):
+    monkeypatch.setattr(lambda_function, "STREAM_MODE_ENABLED", stream)
+
+    support.invoke(lambda_function, {**FIRST, "stream": stream})
+    support.invoke(lambda_function, {**next_turn(FIRST, "他にもありますか？"), "stream": stream})
+
+    first, second = fake_openai.completions.calls
+    assert first["prompt_cache_key"] == second["prompt_cache_key"] == lambda_function.PROMPT_CACHE_KEY
+    assert first["messages"][0]["content"] == lambda_function.build_system_prompt()
+    # システムプロンプトとデータコンテキストはバイト単位で同一、その直後に会話履歴が続く
+    prefix = leading_system_messages(first["messages"])
+    assert len(prefix) == 2
+    assert second["messages"][:len(prefix)] == prefix
+    assert [m["content"] for m in second["messages"][len(prefix):len(prefix) + 2]] == [FIRST["message"], support.REPLY]
+
+
+def test_symptom_hint_follows_history(lambda_function, fake_openai):
+    support.invoke(lambda_function, next_turn(FIRST, "頭痛もあります"))
+
+    messages = fake_openai.completions.calls[-1]["messages"]
+    assert messages[-2]["role"] == "system"
+    assert messages[-2]["content"].startswith("【ヒント】")
+    assert messages[-3]["content"] == support.REPLY
+    assert messages[-1] == {"role": "user", "content": "頭痛もあります"}
+
+
+def test_cached_prompt_tokens_are_logged(lambda_function, monkeypatch):
+    monkeypatch.setattr(support.FakeUsage, "prompt_tokens_details", types.SimpleNamespace(cached_tokens=80))
+
+    _, _, request_log = support.invoke(lambda_function, FIRST)
+
+    usage = next(event for event in request_log["events"] if event["msg"] == "token usage")
+    assert usage["promptTokens"] == 100
+    assert usage["cachedPromptTokens"] == 80
+    assert usage["uncachedPromptTokens"] == 20
+    assert usage["promptCacheHitRate"] == 80.0
+
+
+def test_missing_prompt_tokens_details_counts_as_uncached(lambda_function):
+    _, _, request_log = support.invoke(lambda_function, FIRST)
+
+    usage = next(event for event in request_log["events"] if event["msg"] == "token usage")
+    assert usage["cachedPromptTokens"] == 0
+    assert usage["uncachedPromptTokens"] == 100
@@ -0,0 +1,141 @@
+"""rate_limiter（直近60秒の予算・試行ごとの予約・ハンドラーの 429 / RATE_LIMITED）"""
+
+import functools
+
+import pytest
+
+import support
+import rate_limiter
+import retry_scheduler
+from rate_limiter import (
+    DynamoDBRateLimitBackend, InMemoryRateLimitBackend, RateBudgetExceeded, RateLimiter, reserve_attempt, start_budget,
+)
+
+
+class Clock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def dynamodb_backend() -> DynamoDBRateLimitBackend:
+    backend = DynamoDBRateLimitBackend.__new__(DynamoDBRateLimitBackend)
+    backend.table = support.FakeDynamoDBTable("bucketKey")
+    return backend
+
+
+@pytest.fixture(params=["memory", "dynamodb"])
+def backend(request):
+    return InMemoryRateLimitBackend() if request.param == "memory" else dynamodb_backend()
+
+
+def admitted(limiter: RateLimiter, count: int, tokens: int = 10) -> int:
+    for n in range(count):
+        try:
+            limiter.acquire(tokens)
+        except RateBudgetExceeded:
+            return n
+    return count
+
+
+def test_window_boundary_does_not_double_the_budget(backend):
+    clock = Clock(59.0)
+    limiter = RateLimiter(requests_per_minute=10, backend=backend, clock=clock)
+    assert admitted(limiter, 20) == 10
+
+    # 固定の1分窓なら境目の直後にさらに10件通る（2秒間で20件）
+    clock.now = 61.0
+    assert admitted(limiter, 20) == 0
+
+    # 前の1分の半分が直近60秒から外れた時点で、その分だけ通る
+    clock.now = 90.0
+    assert admitted(limiter, 20) == 5
+
+
+def test_tokens_carry_over_from_the_previous_minute(backend):
+    clock = Clock(30.0)
+    limiter = RateLimiter(tokens_per_minute=1000, backend=backend, clock=clock)
+    limiter.acquire(800)
+
+    clock.now = 75.0
+    with pytest.raises(RateBudgetExceeded) as excinfo:
+        limiter.acquire(500)
+    assert excinfo.value.retry_after == pytest.approx(45.0)
+    limiter.acquire(400)
+
+
+def test_previous_minute_is_read_once_per_minute():
+    backend = dynamodb_backend()
+    reads = []
+    get_item = backend.table.get_item
+    backend.table.get_item = lambda **kwargs: reads.append(kwargs["Key"]) or get_item(**kwargs)
+    clock = Clock(60.0)
+    limiter = RateLimiter(requests_per_minute=100, backend=backend, clock=clock)
+
+    assert admitted(limiter, 5) == 5
+    clock.now = 125.0
+    assert admitted(limiter, 5) == 5
+
+    assert reads == [{"bucketKey": "openai#0"}, {"bucketKey": "openai#1"}]
+
+
+def test_unavailable_backend_allows_requests():
+    class Broken:
+        def reserve(self, *args, **kwargs):
+            raise RuntimeError("dynamodb down")
+
+        def usage(self, bucket_key):
+            raise RuntimeError("dynamodb down")
+
+    assert admitted(RateLimiter(requests_per_minute=1, backend=Broken()), 3) == 3
+
+
+def test_first_attempt_is_prepaid_and_later_attempts_reserve():
+    limiter = RateLimiter(requests_per_minute=2, clock=Clock(0.0))
+    limiter.acquire(10)
+    start_budget(limiter, 10)
+
+    reserve_attempt()   # 1回目（ハンドラーで予約済み）
+    reserve_attempt()   # リトライ
+    with pytest.raises(RateBudgetExceeded):
+        reserve_attempt()
+
+
+@pytest.fixture
+def failing_openai(monkeypatch, lambda_function, fake_openai):
+    """1回目は500を返すOpenAI（リトライの待ち時間は短くする）"""
+    class ServerError(Exception):
+        status_code = 500
+
+    create = fake_openai.completions.create
+    calls = []
+
+    def fail_first(**params):
+        calls.append(params)
+        if len(calls) == 1:
+            raise ServerError("upstream error")
+        return create(**params)
+
+    monkeypatch.setattr(fake_openai.completions, "create", fail_first)
+    # 401判定の例外型を slim_openai_client から取る（SDKを読み込まない）
+    monkeypatch.setattr(lambda_function, "OPENAI_HTTP_CLIENT", "slim")
+    monkeypatch.setattr(
+        lambda_function, "RetryPolicy", functools.partial(retry_scheduler.RetryPolicy, base_delay=0.01, max_delay=0.02)
+    )
+    return calls
+
+
+@pytest.mark.parametrize("requests_per_minute, status_code, calls", [(2, 200, 2), (1, 429, 1)])
+def test_retry_reserves_its_own_budget(monkeypatch, lambda_function, failing_openai, requests_per_minute, status_code, calls):
+    limiter = RateLimiter(requests_per_minute=requests_per_minute)
+    monkeypatch.setattr(rate_limiter, "_default_limiter", limiter)
+
+    response, body, _ = support.invoke(lambda_function, {"userId": "user-1", "message": "こんにちは"})
+
+    assert response["statusCode"] == status_code
+    assert len(failing_openai) == calls
+    if status_code == 429:
+        assert body["errorCode"] == "RATE_LIMITED"
+        assert "Retry-After" in response["headers"]
@@ -0,0 +1,135 @@
+"""retry_scheduler（429 / 5xx のリトライ・Retry-After・デッドライン）をローカルのフェイクOpenAIで確認"""
+
+import os
+import random
+import subprocess
+import sys
+import time
+
+import pytest
+
+import support
+from retry_scheduler import Deadline, RetryPolicy, call_with_retry, with_attempt_timeout
+from slim_openai_client import APIConnectionError, APIError, InternalServerError, RateLimitError, SlimOpenAI
+
+FAST = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05, min_attempt_seconds=0.2, rng=random.Random(0))
+
+
+def chat(server, deadline, policy=FAST):
+    client = SlimOpenAI(api_key="sk-test", base_url=server.base_url)
+    messages = [{"role": "user", "content": "こんにちは"}]
+    return call_with_retry(
+        lambda: with_attempt_timeout(client, deadline).chat.completions.create(model="m", messages=messages),
+        operation="test", policy=policy, deadline=deadline
+    )
+
+
+def remaining(seconds):
+    return Deadline(support.FakeLambdaContext(seconds).get_remaining_time_in_millis, safety_margin=0.0)
+
+
+@pytest.mark.parametrize("plan", [
+    [(429, {}, 0.0)],
+    [(500, {}, 0.0), (503, {}, 0.0)],
+    [(429, {"retry-after-ms": "50"}, 0.0), (502, {}, 0.0)],
+])
+def test_retryable_errors_are_retried(plan):
+    with support.FakeOpenAIServer(plan=list(plan)) as server:
+        response = chat(server, Deadline())
+
+    assert response.choices[0].message.content == support.REPLY
+    assert len(server.requests) == len(plan) + 1
+
+
+def test_retry_after_is_honoured():
+    with support.FakeOpenAIServer(plan=[(429, {"Retry-After": "1"}, 0.0)]) as server:
+        started = time.monotonic()
+        chat(server, Deadline())
+
+    assert time.monotonic() - started >= 1.0
+
+
+def test_gives_up_after_max_attempts_and_on_fatal_errors():
+    with support.FakeOpenAIServer(plan=[(500, {}, 0.0)] * 3) as server:
+        with pytest.raises(InternalServerError):
+            chat(server, Deadline())
+    assert len(server.requests) == 3
+
+    with support.FakeOpenAIServer(plan=[(400, {}, 0.0)]) as server:
+        with pytest.raises(APIError):
+            chat(server, Deadline())
+    assert len(server.requests) == 1
+
+
+@pytest.mark.parametrize("max_attempts", [0, -1])
+def test_policy_without_attempts_is_rejected(max_attempts):
+    with pytest.raises(ValueError, match="max_attempts"):
+        RetryPolicy(max_attempts=max_attempts)
+
+
+def test_single_attempt_policy_raises_the_first_error():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise APIConnectionError("connection reset")
+
+    with pytest.raises(APIConnectionError):
+        call_with_retry(fail, operation="chat", policy=RetryPolicy(max_attempts=1), deadline=Deadline())
+    assert calls == [1]
+
+
+def test_retry_after_beyond_the_deadline_is_not_waited_for():
+    with support.FakeOpenAIServer(plan=[(429, {"Retry-After": "30"}, 0.0)]) as server:
+        started = time.monotonic()
+        with pytest.raises(RateLimitError):
+            chat(server, remaining(2.0))
+
+    assert time.monotonic() - started < 1.0
+    assert len(server.requests) == 1
+
+
+def test_slow_attempt_is_cut_at_the_deadline():
+    with support.FakeOpenAIServer(plan=[(200, {}, 2.0)]) as server:
+        started = time.monotonic()
+        with pytest.raises(APIConnectionError):
+            chat(server, remaining(0.5))
+
+    # SlimOpenAIの既定（60秒）ではなく残り時間で打ち切り、リトライもしない
+    assert time.monotonic() - started < 1.5
+    assert len(server.requests) == 1
+
+
+def test_attempt_timeout_follows_the_remaining_time():
+    assert Deadline().attempt_timeout(limit=60.0) == 60.0
+    assert 9.0 < remaining(10.0).attempt_timeout(limit=60.0) <= 10.0
+    assert remaining(100.0).attempt_timeout(limit=60.0) == 60.0
+    assert remaining(-1.0).attempt_timeout(limit=60.0) == pytest.approx(0.1)
+
+
+def test_with_options_shares_the_connection():
+    with support.FakeOpenAIServer() as server:
+        client = SlimOpenAI(api_key="sk-test", base_url=server.base_url)
+        for timeout in (5.0, 4.0, 3.0):
+            client.with_options(timeout=timeout).chat.completions.create(model="m", messages=[])
+
+    assert len(server.requests) == 3
+    assert len(server.connections) == 1
+
+
+def test_handler_passes_the_remaining_time_as_timeout(lambda_function, fake_openai):
+    support.invoke(lambda_function, {"userId": "user-1", "message": "こんにちは"}, context=support.FakeLambdaContext(30.0))
+
+    assert len(fake_openai.options) == 1
+    assert 25.0 < fake_openai.options[0]["timeout"] < 30.0
+
+
+def test_sync_handler_does_not_import_asyncio():
+    # asyncio のimport（約50ms）は asyncio版ハンドラーを使う場合だけ
+    code = "import sys, lambda_function; print('asyncio' in sys.modules)"
+    env = dict(os.environ, OPENAI_HTTP_CLIENT="slim")
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=support.source_dir(), env=env, capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.strip().splitlines()[-1] == "False"
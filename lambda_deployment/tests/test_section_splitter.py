@@ -0,0 +1,93 @@
+"""SectionSplitter のプロパティテスト（任意のデルタ境界・従来実装との一致）"""
+
+import random
+
+import pytest
+
+from section_splitter import SectionSplitter, split_sections
+
+PIECES = [
+    "---", "--", "-", "\n", "\n\n", " ", "【セクション1: 分析】", "【セクション2】\n", "本文", "鉄分",
+    "| 項目 | 値 |", "|---|---|", "| a | 1 |", "**太字**", "🔜", "x", "。",
+]
+
+
+def legacy_split(response_text):
+    """SectionSplitter 導入前の split_response_into_chunks"""
+    def clean(chunk):
+        lines = chunk.strip().split('\n')
+        return '\n'.join(line for line in lines if not line.strip().startswith('【セクション')).strip()
+
+    if '---' in response_text:
+        chunks = [chunk.strip() for chunk in response_text.split('---') if chunk.strip()]
+        cleaned = [clean(chunk) for chunk in chunks if clean(chunk)]
+        return cleaned if cleaned else [response_text.strip()]
+    return [response_text.strip()]
+
+
+def random_text(rng, pieces=PIECES, max_pieces=30):
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, max_pieces)))
+
+
+def random_deltas(rng, text):
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(0, 8)))) if len(text) > 1 else []
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def feed_all(deltas):
+    splitter = SectionSplitter()
+    sections = []
+    for delta in deltas:
+        sections.extend(splitter.feed(delta))
+    return sections + splitter.close()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_any_delta_boundaries_give_same_sections(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        text = random_text(rng)
+        assert feed_all(random_deltas(rng, text)) == split_sections(text), text
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_single_split_point(seed):
+    rng = random.Random(1000 + seed)
+    text = random_text(rng, max_pieces=40)
+    expected = split_sections(text)
+    for k in range(len(text) + 1):
+        assert feed_all([text[:k], text[k:]]) == expected
+    assert feed_all(list(text)) == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_legacy_implementation_without_tables(seed):
+    rng = random.Random(2000 + seed)
+    pieces = [piece for piece in PIECES if not piece.startswith('|')]
+    for _ in range(200):
+        text = random_text(rng, pieces)
+        assert split_sections(text) == legacy_split(text), text
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_at_least_one_section_and_no_labels(seed):
+    rng = random.Random(3000 + seed)
+    for _ in range(200):
+        sections = split_sections(random_text(rng))
+        assert len(sections) >= 1
+        if len(sections) > 1:
+            # 区切りで分割できた場合はラベル行が残らない（全セクションが空の場合は原文のまま）
+            assert all(not line.strip().startswith('【セクション') for s in sections for line in s.split('\n'))
+
+
+def test_table_separator_row_is_not_a_section_break():
+    text = "【セクション1: 数値】\n| 項目 | 値 |\n|---|---|\n| 鉄 | 20 |\n---\n次の話題"
+    assert split_sections(text) == ["| 項目 | 値 |\n|---|---|\n| 鉄 | 20 |", "次の話題"]
+
+
+def test_separator_split_across_deltas():
+    assert feed_all(["前半-", "-", "-後半"]) == ["前半", "後半"]
+
+
+def test_no_separator_returns_whole_text():
+    assert split_sections("  区切りなし\n【セクション1】  ") == ["区切りなし\n【セクション1】"]
@@ -0,0 +1,30 @@
+"""ストリーミングモード（STREAM_MODE_ENABLED）"""
+
+import json
+
+import support
+
+BODY = {"userId": "user-1", "message": "最近眠れません", "stream": True}
+
+
+def test_stream_request_gets_plain_json_when_disabled(lambda_function, fake_openai):
+    response, body, request_log = support.invoke(lambda_function, BODY)
+
+    assert response["statusCode"] == 200
+    assert response["headers"]["Content-Type"] == "application/json"
+    assert body["chunks"] == ["**分析** 鉄が少なめです", "睡眠を整えましょう", "🔜 次は食事について"]
+    assert request_log["stream"] is False
+    assert request_log["streamRequested"] is True
+    assert "stream" not in fake_openai.completions.calls[0]
+
+
+def test_stream_request_gets_ndjson_events_when_enabled(lambda_function, monkeypatch):
+    monkeypatch.setattr(lambda_function, "STREAM_MODE_ENABLED", True)
+
+    response, done, _ = support.invoke(lambda_function, BODY)
+
+    events = [json.loads(line) for line in response["body"].strip().split("\n")]
+    assert response["headers"]["Content-Type"] == "application/x-ndjson"
+    assert [event["content"] for event in events if event["type"] == "chunk"] == done["chunks"]
+    assert done["type"] == "done"
+    assert done["chunks"] == ["**分析** 鉄が少なめです", "睡眠を整えましょう", "🔜 次は食事について"]
@@ -0,0 +1,100 @@
+"""StreamingRedactor（モデル応答のストリーミング中のPIIマスク）の境界ケース"""
+
+import random
+
+import pytest
+
+import support
+from pii_sanitizer import StreamingRedactor, get_output_scrubber
+
+TOKENS = [
+    "090-1234-5678", "03-1234-5678", "123-4567-8901", "2024/01/15", "rs12345", "a@b.com",
+    "foo.bar@ex.co.jp", "電話", "です。", "@", " ", "あ", "rs", "0", ".", "\n", "【", "】", "ſ", "K",
+]
+ALPHABET = list("0123456789") * 3 + list("--−/@.|%+_ rsRSabcomKſ") + ["あ", "電", "。", "、", "０", " ", "\n", "x"]
+
+
+def redact(deltas, **options):
+    return "".join(StreamingRedactor(**options).redact(deltas))
+
+
+def random_deltas(rng, text):
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(0, 6)))) if len(text) > 1 else []
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_chunking_matches_full_text_scrub(seed):
+    rng = random.Random(seed)
+    scrub = get_output_scrubber().scrub
+    for _ in range(300):
+        text = "".join(rng.choice(TOKENS + ALPHABET) for _ in range(rng.randint(0, 25)))
+        assert redact(random_deltas(rng, text)) == scrub(text), text
+
+
+@pytest.mark.parametrize("text", [
+    "連絡先は taro.yamada@example.com です。電話は090-1234-5678まで",
+    "2024/01/15に受診、rs1801133 と rs4680 を確認",
+    "a@b.com090-1234-5678",
+    "番号:03−1234−5678。",
+    "ſ@ex.com K@ex.com",
+])
+def test_every_split_point_and_single_character_deltas(text):
+    expected = get_output_scrubber().scrub(text)
+    for k in range(len(text) + 1):
+        assert redact([text[:k], text[k:]]) == expected, k
+    assert redact(list(text)) == expected
+    assert redact([""] + list(text) + [""]) == expected
+
+
+def test_safe_text_is_emitted_before_a_possible_match_completes():
+    redactor = StreamingRedactor()
+
+    assert redactor.feed("お電話は 090-12") == "お電話は "
+    assert redactor.feed("34-56") == ""
+    assert redactor.feed("78 まで") == "[PHONE] まで"
+    assert redactor.feed(" 3") == " "
+    assert redactor.close() == "3"
+
+
+def test_japanese_text_is_not_held_back():
+    redactor = StreamingRedactor()
+    assert redactor.feed("よく眠れていますか？") == "よく眠れていますか？"
+    assert redactor.close() == ""
+
+
+def test_hold_is_bounded():
+    redactor = StreamingRedactor(max_hold_chars=16)
+    emitted = []
+    for _ in range(100):
+        emitted.append(redactor.feed("1"))
+        assert len(redactor._pending) <= 16
+    emitted.append(redactor.close())
+    assert "".join(emitted) == "1" * 100
+
+
+def test_stream_mode_redacts_phone_number_split_across_chunks(lambda_function, fake_openai, monkeypatch):
+    fake_openai.completions.reply = "連絡は 090-1234-5678 へ\n---\n以上です"
+    fake_openai.completions.chunk_size = 3
+    monkeypatch.setattr(lambda_function, "STREAM_MODE_ENABLED", True)
+
+    response, done, _ = support.invoke(lambda_function, {"userId": "u", "message": "連絡先は？", "stream": True})
+
+    assert "090" not in response["body"]
+    assert done["chunks"] == ["連絡は [PHONE] へ", "以上です"]
+
+
+def test_snp_ids_and_dates_in_model_output_are_kept():
+    text = "rs1801133 (MTHFR) はAG型です。2024/01/15の結果では連絡先 a@b.com を確認"
+
+    assert redact([text[:5], text[5:]]) == "rs1801133 (MTHFR) はAG型です。2024/01/15の結果では連絡先 [EMAIL] を確認"
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_model_output_keeps_rsids_in_both_modes(lambda_function, fake_openai, monkeypatch, stream):
+    fake_openai.completions.reply = "rs1801133 (MTHFR) と rs4680 はAG型です\n---\n電話 090-1234-5678 へ"
+    monkeypatch.setattr(lambda_function, "STREAM_MODE_ENABLED", stream)
+
+    _, done, _ = support.invoke(lambda_function, {"userId": "u", "message": "遺伝子は？", "stream": stream})
+
+    assert done["chunks"] == ["rs1801133 (MTHFR) と rs4680 はAG型です", "電話 [PHONE] へ"]
@@ -0,0 +1,128 @@
+"""structured_logging（1リクエスト1行・DEBUGのサンプリング・遅延フィールド）"""
+
+import json
+
+import pytest
+
+import structured_logging
+from structured_logging import RequestLog, end_request, log_debug, log_error, log_info, log_warning, start_request
+
+
+def output_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+class Expensive:
+    """遅延フィールド（評価された回数を記録する）"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return "x" * 200
+
+
+@pytest.fixture
+def sampled_out(monkeypatch):
+    monkeypatch.setattr(structured_logging.random, "random", lambda: 0.99)
+
+
+def test_sampled_out_request_writes_one_line_without_debug_events(capsys, sampled_out):
+    expensive = Expensive()
+    request_log = RequestLog("chat", level="INFO", debug_sample_rate=0.01)
+
+    request_log.debug("event received", event=expensive)
+    request_log.info("calling OpenAI", messages=3)
+    assert capsys.readouterr().out == ""
+    request_log.flush(statusCode=200)
+
+    lines = output_lines(capsys)
+    assert len(lines) == 1
+    assert lines[0]["level"] == "INFO"
+    assert [event["msg"] for event in lines[0]["events"]] == ["calling OpenAI"]
+    assert "debugSampled" not in lines[0]
+    assert expensive.calls == 0
+
+
+def test_sampled_out_request_still_reports_errors(capsys, sampled_out):
+    request_log = RequestLog("chat", level="WARNING", debug_sample_rate=0.01)
+
+    request_log.debug("event received", event=Expensive())
+    request_log.info("calling OpenAI")
+    request_log.error("OpenAI call failed", error="timeout")
+    request_log.flush(statusCode=500)
+
+    (line,) = output_lines(capsys)
+    assert line["level"] == "ERROR"
+    assert line["statusCode"] == 500
+    assert [(event["level"], event["msg"], event["error"]) for event in line["events"]] == [
+        ("ERROR", "OpenAI call failed", "timeout")
+    ]
+
+
+def test_sampled_in_request_evaluates_debug_fields(capsys, monkeypatch):
+    monkeypatch.setattr(structured_logging.random, "random", lambda: 0.0)
+    expensive = Expensive()
+    request_log = RequestLog("chat", level="INFO", debug_sample_rate=0.01)
+
+    request_log.debug("event received", event=expensive)
+    request_log.flush()
+
+    (line,) = output_lines(capsys)
+    assert line["debugSampled"] is True
+    assert line["events"][0]["event"] == "x" * 200
+    assert expensive.calls == 1
+
+
+def test_events_per_request_are_capped(capsys, sampled_out):
+    request_log = RequestLog("chat", level="INFO")
+
+    for n in range(structured_logging.MAX_EVENTS_PER_REQUEST + 5):
+        request_log.info("retry", attempt=n)
+    request_log.flush()
+
+    (line,) = output_lines(capsys)
+    assert len(line["events"]) == structured_logging.MAX_EVENTS_PER_REQUEST
+    assert line["droppedEvents"] == 5
+
+
+def test_logs_outside_a_request_respect_the_level(capsys, monkeypatch):
+    monkeypatch.setattr(structured_logging, "LOG_LEVEL", "WARNING")
+    expensive = Expensive()
+
+    log_debug("init", detail=expensive)
+    log_info("init")
+    log_warning("secret cache expired", ttl=300)
+
+    assert output_lines(capsys) == [{"level": "WARNING", "msg": "secret cache expired", "ttl": 300}]
+    assert expensive.calls == 0
+
+
+def test_module_functions_collect_into_the_current_request(capsys, sampled_out):
+    start_request("chat")
+    log_debug("event received", event=Expensive())
+    log_info("token usage", promptTokens=100)
+    log_error("failed", error="boom")
+    end_request(statusCode=500)
+
+    lines = output_lines(capsys)
+    assert len(lines) == 1
+    assert lines[0]["level"] == "ERROR"
+    assert [event["msg"] for event in lines[0]["events"]] == ["token usage", "failed"]
+    assert structured_logging.current_request() is None
+
+
+def test_handler_writes_one_line_per_request_when_sampled_out(lambda_function, fake_openai, capsys, sampled_out):
+    event = {"body": json.dumps({"userId": "user-1", "message": "こんにちは"})}
+
+    lambda_function.lambda_handler(event, None)
+    fake_openai.completions.create = lambda **params: (_ for _ in ()).throw(RuntimeError("boom"))
+    lambda_function.lambda_handler(event, None)
+
+    lines = output_lines(capsys)
+    assert [(line["function"], line["level"], line["statusCode"]) for line in lines] == [
+        ("chat", "INFO", 200), ("chat", "ERROR", 500),
+    ]
+    assert all(event["level"] != "DEBUG" for line in lines for event in line["events"])
+    assert not any("debugSampled" in line for line in lines)
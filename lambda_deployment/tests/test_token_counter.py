@@ -0,0 +1,54 @@
+"""token_counter（語彙の読み込み時だけ TIKTOKEN_CACHE_DIR を設定する）"""
+
+import os
+import sys
+import types
+
+import pytest
+
+import token_counter
+
+
+@pytest.fixture
+def fake_tiktoken(monkeypatch, tmp_path):
+    """get_encoding() 呼び出し時の TIKTOKEN_CACHE_DIR を記録する tiktoken の代わり"""
+    seen = []
+
+    def get_encoding(name):
+        seen.append(os.environ.get("TIKTOKEN_CACHE_DIR"))
+        return types.SimpleNamespace(name=name)
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    monkeypatch.setattr(token_counter, "TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(token_counter, "_encoding", None)
+    monkeypatch.setattr(token_counter, "_encoding_loaded", False)
+    open(token_counter._vocab_cache_path(), "w").close()
+    return seen
+
+
+@pytest.mark.parametrize("previous", [None, "/opt/other-cache"])
+def test_cache_dir_is_set_only_while_loading(monkeypatch, tmp_path, fake_tiktoken, previous):
+    if previous is None:
+        monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+    else:
+        monkeypatch.setenv("TIKTOKEN_CACHE_DIR", previous)
+
+    encoding = token_counter.get_encoding()
+
+    assert encoding.name == token_counter.ENCODING_NAME
+    assert fake_tiktoken == [str(tmp_path)]
+    assert os.environ.get("TIKTOKEN_CACHE_DIR") == previous
+    assert token_counter.tokenizer_name() == token_counter.ENCODING_NAME
+
+
+def test_cache_dir_is_restored_when_loading_fails(monkeypatch, fake_tiktoken):
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+
+    def broken(name):
+        raise RuntimeError("corrupt vocabulary")
+
+    monkeypatch.setattr(sys.modules["tiktoken"], "get_encoding", broken)
+
+    assert token_counter.get_encoding() is None
+    assert "TIKTOKEN_CACHE_DIR" not in os.environ
+    assert token_counter.tokenizer_name() == token_counter.ESTIMATE
@@ -0,0 +1,53 @@
+"""UserTokenizer（HMACトークン・バッチ変換・ソルトのローテーション）"""
+
+import hashlib
+import hmac
+
+import support
+from user_tokenizer import ANONYMOUS_TOKEN, UserTokenizer
+
+
+def hmac_token(salt, user_id):
+    return "user_" + hmac.new(salt.encode(), user_id.encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def test_token_is_salted_hmac_and_cached():
+    tokenizer = UserTokenizer("salt-a", cache_size=2)
+
+    assert tokenizer.token("user-1") == hmac_token("salt-a", "user-1")
+    assert tokenizer.token("user-1") == hmac_token("salt-a", "user-1")
+    assert tokenizer.token("") == ANONYMOUS_TOKEN
+    assert UserTokenizer("salt-b").token("user-1") != tokenizer.token("user-1")
+
+
+def test_tokenize_many_keeps_order_and_duplicates():
+    tokenizer = UserTokenizer("salt-a", cache_size=1)
+    ids = ["a", "b", "a", "c", "b"]
+
+    assert tokenizer.tokenize_many(ids) == [hmac_token("salt-a", user_id) for user_id in ids]
+
+
+def test_accepted_tokens_during_rotation():
+    tokenizer = UserTokenizer("new-salt", previous_salt="old-salt", accept_legacy=True)
+    legacy = "user_" + hashlib.sha256(b"new-salt:user-1").hexdigest()[:12]
+
+    assert tokenizer.accepted_tokens("user-1") == [
+        hmac_token("new-salt", "user-1"), hmac_token("old-salt", "user-1"), legacy,
+    ]
+    assert UserTokenizer("new-salt", accept_legacy=False).accepted_tokens("user-1") == [hmac_token("new-salt", "user-1")]
+
+
+def test_numeric_user_id_is_tokenized_as_a_string():
+    tokenizer = UserTokenizer("new-salt", previous_salt="old-salt", accept_legacy=True)
+
+    assert tokenizer.token(12345) == tokenizer.token("12345") == hmac_token("new-salt", "12345")
+    assert tokenizer.previous_token(12345) == hmac_token("old-salt", "12345")
+    assert tokenizer.accepted_tokens(12345) == tokenizer.accepted_tokens("12345")
+    assert tokenizer.tokenize_many([12345, "12345", 0]) == [hmac_token("new-salt", "12345")] * 2 + [ANONYMOUS_TOKEN]
+
+
+def test_handler_accepts_a_numeric_user_id(lambda_function):
+    response, body, _ = support.invoke(lambda_function, {"userId": 12345, "message": "こんにちは"})
+
+    assert response["statusCode"] == 200
+    assert body["chunks"]